@@ -0,0 +1,71 @@
+"""
+Image Conversion Benchmark
+===========================
+Per-frame cost of converting sensor_msgs/Image messages to numpy: cv_bridge versus the zero-copy view of
+`image_conversion.image_msg_to_numpy`.
+"""
+
+import argparse
+import time
+
+import numpy as np
+from cv_bridge import CvBridge
+from sensor_msgs.msg import Image as RosImage
+from curigpt_ros.utils.image_conversion import image_msg_to_numpy
+
+
+def make_image_msg(width, height, encoding, dtype, channels):
+    """Create a random image message, with rows padded to a multiple of 64 bytes."""
+    itemsize = np.dtype(dtype).itemsize
+    row_bytes = width * channels * itemsize
+    step = (row_bytes + 63) // 64 * 64
+    data = np.random.randint(0, 255, size=height * step, dtype=np.uint8)
+
+    msg = RosImage()
+    msg.height = height
+    msg.width = width
+    msg.encoding = encoding
+    msg.is_bigendian = 0
+    msg.step = step
+    msg.data = data.tobytes()
+    return msg
+
+
+def time_per_frame(convert, msg, iterations):
+    """Return the mean conversion time per frame in microseconds."""
+    convert(msg)  # warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        convert(msg)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    bridge = CvBridge()
+    cases = [
+        ("bgr8", "bgr8", np.uint8, 3),
+        ("rgb8", "bgr8", np.uint8, 3),
+        ("16UC1", "passthrough", np.uint16, 1),
+        ("32FC1", "passthrough", np.float32, 1),
+    ]
+
+    print("{:>8} -> {:<12} {:>14} {:>14} {:>9}".format("encoding", "desired", "cv_bridge [us]", "numpy [us]",
+                                                          "speedup"))
+    for encoding, desired, dtype, channels in cases:
+        msg = make_image_msg(args.width, args.height, encoding, dtype, channels)
+        assert np.array_equal(bridge.imgmsg_to_cv2(msg, desired), image_msg_to_numpy(msg, desired))
+
+        bridge_us = time_per_frame(lambda m: bridge.imgmsg_to_cv2(m, desired), msg, args.iterations)
+        numpy_us = time_per_frame(lambda m: image_msg_to_numpy(m, desired), msg, args.iterations)
+        print("{:>8} -> {:<12} {:>14.1f} {:>14.1f} {:>8.1f}x".format(encoding, desired, bridge_us, numpy_us,
+                                                                     bridge_us / numpy_us))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,70 +5,143 @@ High-level task reasoning for CURI manipulation via Multimodal Large Language Mo
 """
 
 from http import HTTPStatus
-import dashscope
 from dashscope import MultiModalConversation
 from curigpt_ros.models.audio_assistant import AudioAssistant
-from curigpt_ros.utils.vis_utils import save_color_image_rs, save_images_gemini, plot_image_with_bbox, get_spatial_coordinates
-from curigpt_ros.utils.action_utils import process_robot_actions
+from curigpt_ros.models.response_cache import ResponseCache, prompt_hash
+from curigpt_ros.models.conversation import ConversationHistory
+from curigpt_ros.models.prompt_library import PromptRegistry
+from curigpt_ros.models.example_selector import ExampleSelector
+from curigpt_ros.models.intent_router import IntentRouter, CHAT, SCENE
+from curigpt_ros.models.prompt_compiler import PromptCompiler
+from curigpt_ros.models.mllm_backends import create_backend
+from curigpt_ros.models.hedging import HedgedBackend
+from curigpt_ros.models.response_parser import parse_response, validate_action, ResponseError
+from curigpt_ros.models.stream_parser import StreamingJSONParser
+from curigpt_ros.utils.vis_utils import save_images_gemini
+from curigpt_ros.utils.action_utils import process_robot_actions, ActionDispatcher
+from curigpt_ros.utils.frame_store import FrameStore
+from curigpt_ros.utils.shm_frames import CaptureProcess
+from curigpt_ros.utils.realsense_utils import RealSenseSource
+from curigpt_ros.utils.scene_utils import SceneChangeDetector, SceneCache
+from curigpt_ros.utils.image_encoding import ImageEncoder
+from curigpt_ros.utils.roi_utils import refine_action_bboxes
+from curigpt_ros.utils.depth_utils import load_camera_config, GEMINI_INTRINSICS
+from curigpt_ros.utils.ros_utils import wait_for_camera_intrinsics
 import json
 import rospy
 import threading
+from functools import partial
 
 
-def single_multimodal_call(model_name, base_prompt, query, prompt_img_path, log=True, return_response=True):
+def single_multimodal_call(backend, base_prompt, query, prompt_img_path, log=True, return_response=True):
     """
     Single round multimodal conversation call with CuriGPT.
 
     Parameters:
+        backend (MLLMBackend): The reasoning backend, see `create_backend`.
         base_prompt (list): The base prompt for multimodal reasoning.
         query (str): The user query.
-        rgb_img_path (str): The path to the real-time image.
+        rgb_img_path (str): The path to the real-time image, None for a text-only turn.
         log (bool): Whether to log the response.
         return_response (bool): Whether to return the response.
     """
     # make a copy of the base prompt to create a new prompt
     new_prompt = base_prompt.copy()
-    prompt_img_path = prompt_img_path
+    image_content = [{"image": prompt_img_path}] if prompt_img_path is not None else []
+    new_prompt.append({"role": "user", "content": image_content + [{"text": query}]})
+
+    # get the response from the configured reasoning backend
+    result = backend.call(new_prompt)
+    if result.ok:
+        response = result.text
+        print("CURI response:\n", response)
+    else:
+        response = None
+        print(result.status_code)  # The error code.
+        print(result.error)  # The error message.
+
+    # plot the image with bounding boxes if the response contains actions.
+    # plot_image_with_bbox(prompt_img_path, response)
+
+    if return_response:
+        return response
+
+
+def stream_multimodal_call(backend, base_prompt, query, prompt_img_path, on_field=None, on_item=None,
+                           on_item_error=None):
+    """
+    Streaming multimodal conversation call with CuriGPT.
+
+    The response is parsed incrementally, and `on_field(key, value)` is called as soon as a top-level field of the
+    JSON response ("robot_response", "robot_actions") is complete, while the model is still generating the rest, and
+    `on_item(key, index, value)` as soon as each element of a top-level array (each robot action) is complete, or
+    `on_item_error(key, index, text)` if the element is not valid JSON.
+
+    Parameters:
+        backend (MLLMBackend): The reasoning backend, see `create_backend`.
+        base_prompt (list): The base prompt for multimodal reasoning.
+        query (str): The user query.
+        prompt_img_path (str): The path to the real-time image.
+        on_field (callable): The callback for the completed top-level fields.
+        on_item (callable): The callback for the completed elements of top-level arrays.
+        on_item_error (callable): The callback for the elements of top-level arrays that are not valid JSON.
+
+    Returns:
+        str: The complete response, or None if the call failed.
+    """
+    new_prompt = base_prompt.copy()
     new_prompt.append({"role": "user", "content": [{"image": prompt_img_path}, {"text": query}]})
 
-    # check if the model name belongs to qwen-vl-max or qwen-vl-chat-v1
-    if model_name not in ['qwen-vl-max', 'qwen-vl-chat-v1']:
-        raise ValueError("Model name must be either 'qwen-vl-max' or 'qwen-vl-chat-v1'.")
+    parser = StreamingJSONParser(on_field, on_item, on_item_error)
+    try:
+        for chunk in backend.stream(new_prompt):
+            parser.feed(chunk)
+    except RuntimeError as e:
+        print(e)  # The error message.
+        return None
 
-    # get the response from qwen_vl_max
-    if model_name == 'qwen-vl-max':
-        response_dict = dashscope.MultiModalConversation.call(model='qwen-vl-max',
-                                                     messages=new_prompt)
+    print("CURI response:\n", parser.text)
+    return parser.text
 
-        if response_dict.status_code == HTTPStatus.OK:
-            response = response_dict[
-                "output"]["choices"][0]["message"]["content"][0]["text"]
-            print("CURI response:\n", response)
 
-        else:
-            print(response_dict.code)  # The error code.
-            print(response_dict.message)  # The error message.
+def correct_response(backend, base_prompt, query, prompt_img_path, response, error):
+    """
+    Ask CuriGPT to correct an invalid response that could not be repaired locally.
 
-    # get the response from qwen-vl-chat-v1
-    elif model_name == 'qwen-vl-chat-v1':
-        response_dict = MultiModalConversation.call(model=MultiModalConversation.Models.qwen_vl_chat_v1,
-                                                                                               messages=new_prompt, top_p=0.9, top_k=100)
+    Parameters:
+        backend (MLLMBackend): The reasoning backend, see `create_backend`.
+        base_prompt (list): The base prompt for multimodal reasoning.
+        query (str): The user query the invalid response answers.
+        prompt_img_path (str): The path to the real-time image of the query.
+        response (str): The invalid response.
+        error (ResponseError): The validation errors of the response.
 
-        if response_dict.status_code == HTTPStatus.OK:
-            response = response_dict[
-                "output"]["choices"][0]["message"]["content"]
-            print("CURI response:\n", response)
+    Returns:
+        str: The corrected response, or None if the call failed.
+    """
+    correction_prompt = base_prompt + [
+        {"role": "user", "content": [{"image": prompt_img_path}, {"text": query}]},
+        {"role": "assistant", "content": [{"text": response}]},
+    ]
+    correction = ("Your response is invalid: {}. Respond again to my previous instruction, with only the corrected "
+                  "JSON object.").format(error)
+    return single_multimodal_call(backend, correction_prompt, correction, None, log=True, return_response=True)
 
-        else:
-            print(response_dict.code)  # The error code.
-            print(response_dict.message)  # The error message.
 
+def locate_object(backend, image_path, description):
+    """
+    Ground a single object on an image crop, the second stage of the two-stage grounding.
 
-    # plot the image with bounding boxes if the response contains actions.
-    # plot_image_with_bbox(prompt_img_path, response)
+    Parameters:
+        image_path (str): The path to the image crop.
+        description (str): The description of the object to locate.
 
-    if return_response:
-        return response
+    Returns:
+        str: The response with the bbox of the object in normalized 0-1000 coordinates of the crop.
+    """
+    query = ("Locate the {} in the image. Respond only with its bounding box in JSON format: "
+             '{{"bbox_coordinates": [x1, y1, x2, y2]}}').format(description)
+    return single_multimodal_call(backend, [], query, image_path, log=False, return_response=True)
 
 
 def multiple_multimodal_call(base_prompt, query, prompt_img_path, rounds=10, log=True, return_response=False):
@@ -84,7 +157,6 @@ def multiple_multimodal_call(base_prompt, query, prompt_img_path, rounds=10, log
     """
 
     new_prompt = base_prompt.copy()
-    prompt_img_path = prompt_img_path
 
     for i in range(rounds):
         new_prompt.append({"role": "user", "content": [{"image": prompt_img_path}, {"text": query}]})
@@ -114,46 +186,37 @@ def multiple_multimodal_call(base_prompt, query, prompt_img_path, rounds=10, log
             return response
 
 
-def get_curi_response(base_multimodal_prompt, rounds=10, prompt_append=False):
-
-    """Get CURI response for a given number of rounds."""
-    inference_results = None
-    if not prompt_append:
-        print("without prompt append")
-        for i in range(rounds):
-            instruction = input("Please input your instruction: ")
-            inference_results = single_multimodal_call(base_multimodal_prompt, instruction, log=True, return_response=False)
-
-    else:
-        if rounds < 1:
-            raise ValueError("Number of rounds must be at least 1.")
-
-        for i in range(rounds):
-            instruction = input("Please input your instruction: ")
-
-            # Single call for each round
-            if i == 1:
-                # For the first round or if not returning response, just update the prompt
-                inference_results = single_multimodal_call(base_multimodal_prompt, instruction, log=True,
-                                                           return_response=False)
+def get_curi_response(backend, base_multimodal_prompt, prompt_img_path, rounds=10, prompt_append=False):
+    """
+    Get CURI responses to typed instructions for a given number of rounds.
 
-            else:
-                # For subsequent rounds, get the response as well to append to the prompt
-                new_prompt, response_dict = single_multimodal_call(base_multimodal_prompt, instruction, log=True,
-                                                                   return_response=True)
-                if 'output' in response_dict and 'choices' in response_dict['output'] and len(
-                        response_dict['output']['choices']) > 0:
-                    # Append the model's response to the prompt for the next round
-                    response_content = response_dict['output']['choices'][0]['message']['content']
-                    response_role = response_dict['output']['choices'][0]['message']['role']
-                    new_prompt.append({'role': response_role, 'content': [{'text': response_content}]})
-                base_multimodal_prompt = new_prompt
+    Parameters:
+        backend (MLLMBackend): The reasoning backend, see `create_backend`.
+        base_multimodal_prompt (list): The base prompt for multimodal reasoning.
+        prompt_img_path (str): The path or URL of the image of the scene.
+        rounds (int): The number of rounds.
+        prompt_append (bool): Whether to send the previous turns with each request.
+    """
+    history = ConversationHistory() if prompt_append else None
+    for i in range(rounds):
+        instruction = input("Please input your instruction: ")
+        prompt = base_multimodal_prompt + history.messages() if history is not None else base_multimodal_prompt
+        response = single_multimodal_call(backend, prompt, instruction, prompt_img_path, log=True,
+                                          return_response=True)
+        if history is not None and response is not None:
+            history.add_turn(instruction, prompt_img_path, response)
 
 
 def get_curi_response_with_audio(model_name, api_key, base_url, user_input, curigpt_output, rgb_img_path,
                                  depth_img_path,
                                  local_img_path,
-                                 base_multimodal_prompt, rounds=10, realtime_flag=True, prompt_append=False):
+                                 base_multimodal_prompt, rounds=10, realtime_flag=True, prompt_append=False,
+                                 max_frame_age=1.0, sync_slop=0.05, camera_config=None, capture_process=False,
+                                 camera_source="gemini", image_encoding=None,
+                                 roi_refinement=None, stream_response=False, response_cache=None,
+                                 upload_prompt_images=True, mllm_backend=None,
+                                 hedging=None, max_parse_retries=1, conversation_history=None,
+                                 example_selection=None, intent_routing=None):
     """
     Get CURI response with audio input and output.
 
@@ -162,13 +225,43 @@ def get_curi_response_with_audio(model_name, api_key, base_url, user_input, curi
         base_url (str): The base URL for the OpenAI API.
         user_input (str): The path to the user audio input file.
         curigpt_output (str): The path to the CuriGPT audio output file.
-        rgb_img_path (str): The path to the real-time image.
+        rgb_img_path (str): The path to the real-time image (unused, the upload image is written to the encoder cache).
         depth_img_path (str): The path to the depth image.
         local_img_path (str): The path to the local image.
         base_multimodal_prompt (list): The base prompt for multimodal reasoning.
         rounds (int): The number of rounds.
         realtime_flag (bool): Whether to enable interactive reasoning in real-time.
-        prompt_append (bool): Whether to append the model's current response to the next prompt.
+        prompt_append (bool): Whether to keep a multi-turn conversation, with the previous turns appended to the next
+            prompt within the `conversation_history` budget.
+        max_frame_age (float): The maximum age in seconds of the RGB-D frame used for a turn.
+        sync_slop (float): The maximum capture time difference in seconds between the paired RGB and depth frames.
+        camera_config (dict): The camera intrinsics and depth-to-color extrinsics, see `load_camera_config`; by default
+            the Gemini color intrinsics, with the depth already aligned to color.
+        capture_process (bool): Whether to capture images in a separate process and share them via shared memory.
+        camera_source (str): The camera to use, "gemini" (ROS topics) or "realsense" (persistent pyrealsense2 pipeline,
+            whose stream intrinsics and depth scale replace the configured ones).
+        image_encoding (dict): The pixel budget, format and quality of the uploaded images, see `ImageEncoder`.
+        roi_refinement (dict): The two-stage grounding settings: "enabled", the "scene_max_pixels" of the scene pass,
+            and the crop "margin" and "min_size", see `refine_action_bboxes`.
+        stream_response (bool): Whether to stream the response, start the speech synthesis as soon as the verbal
+            response is complete and dispatch each action as soon as it is complete, while the model is still
+            generating the rest of the plan.
+        response_cache (dict): The response cache settings: "enabled", "bypass", "ttl", "max_entries" and
+            "cache_dir", see `ResponseCache`; responses with robot actions are never cached.
+        upload_prompt_images (bool): Whether to upload each distinct prompt image once and reference it by URL,
+            instead of sending the local files with every request.
+        mllm_backend (dict): The reasoning backend settings, see `create_backend`; the model defaults to `model_name`.
+        hedging (dict): The hedging settings: "enabled", the "secondary" backend settings, and the deadline
+            "percentile", "min_samples" and "default_deadline", see `HedgedBackend`.
+        max_parse_retries (int): How many times to ask for a corrected response when a response is invalid even after
+            the local repairs.
+        conversation_history (dict): The multi-turn history budget: "max_turns", "max_tokens",
+            "keep_images" and "image_tokens", see `ConversationHistory`.
+        example_selection (dict): The few-shot example selection, off by default so that every example is sent:
+            "enabled", the number "k" of examples and their "max_tokens" budget, see `ExampleSelector`.
+        intent_routing (dict): The intent routing settings: "enabled", the classifier "examples", "min_confidence",
+            "chat_min_confidence", "overrides", "force" and "log_path" (see `IntentRouter`), and the "chat_model" and
+            "chat_system_prompt" of the text-only chat path.
     """
 
     rospy.init_node('curigpt_response', anonymous=True)
@@ -176,76 +269,263 @@ def get_curi_response_with_audio(model_name, api_key, base_url, user_input, curi
     # Create an instance of the AudioAssistant class
     assistant = AudioAssistant(api_key, base_url, user_input, curigpt_output)
 
-    # check if the CuriGPT need to work in the real-time mode
-    prompt_img_path = rgb_img_path if realtime_flag else local_img_path
+    # Downsize and compress the uploaded images to a pixel budget; the encoded files are cached by image content
+    image_encoder = ImageEncoder.from_config(image_encoding or {})
+
+    # With the two-stage grounding, the scene pass gets a small image and the returned bboxes are refined on
+    # high-resolution crops of the frame
+    roi_refinement = roi_refinement or {}
+    refine_bboxes = roi_refinement.get("enabled", False)
+    if refine_bboxes:
+        scene_encoder = ImageEncoder.from_config(dict(image_encoding or {},
+                                                      max_pixels=roi_refinement.get("scene_max_pixels", 640 * 360)))
+    else:
+        scene_encoder = image_encoder
 
-    # Start the image saving thread
-    image_thread = threading.Thread(target=save_images_gemini)
-    image_thread.start()
+    # check if the CuriGPT need to work in the real-time mode
+    encoded_image = None if realtime_flag else image_encoder.encode_file(local_img_path)
+
+    # Create the reasoning backend, which keeps its HTTP connections alive across turns
+    backend = create_backend(dict({"model": model_name}, **(mllm_backend or {})))
+
+    # Optionally hedge slow calls with a secondary model, the first valid response wins; the crop grounding replies
+    # are bboxes, not plans, which would never validate and always hedge, so they go to the primary backend directly
+    grounding_backend = backend
+    hedging = hedging or {}
+    if hedging.get("enabled", False):
+        backend = HedgedBackend.from_config(backend, hedging)
+
+    # Compile the few-shot prompt once, with each distinct example image encoded and uploaded once
+    prompt_compiler = PromptCompiler(image_encoder, backend.upload_image if upload_prompt_images else None)
+    compiled_prompt = prompt_compiler.compile(base_multimodal_prompt)
+    base_multimodal_prompt = compiled_prompt.messages
+
+    # Optionally send only the few-shot examples most similar to each query
+    example_selection = example_selection or {}
+    example_selector = None
+    if example_selection.get("enabled", False):
+        example_selector = ExampleSelector.from_config(base_multimodal_prompt, example_selection)
+
+    # Reuse the responses to the same question on the same scene with the same prompt
+    response_cache = ResponseCache.from_config(response_cache or {})
+
+    # Route each query by intent: conversation to the text-only chat model, scene questions to the vision model
+    # without the grounding examples, and action requests to the full grounding prompt
+    intent_routing = intent_routing or {}
+    intent_router = IntentRouter.from_config(intent_routing) if intent_routing.get("enabled", False) else None
+
+    # In multi-turn mode, the previous turns are sent with each request, as a window bounded by turns and tokens
+    history = ConversationHistory.from_config(conversation_history or {}) if prompt_append else None
+
+    # Load the camera intrinsics, from the camera_info topics if configured, and the depth registration
+    camera_config = dict(camera_config) if camera_config is not None else \
+        {"color_intrinsics": GEMINI_INTRINSICS.to_dict()}
+    for intrinsics_key, topic_key in (("color_intrinsics", "color_info_topic"), ("depth_intrinsics", "depth_info_topic")):
+        if camera_config.get(topic_key):
+            camera_config[intrinsics_key] = wait_for_camera_intrinsics(camera_config[topic_key]).to_dict()
+    cam_intrinsics, depth_registration = load_camera_config(camera_config)
+    depth_scale = 1000.0  # raw depth units per meter, millimeters for the Gemini
+
+    # Start the image capture, either from a persistent RealSense pipeline, in a separate process writing to shared
+    # memory or in a thread feeding the in-memory frame store; all provide the same snapshot API
+    if camera_source == "realsense":
+        realsense = RealSenseSource()
+        realsense.start()
+        frame_store = realsense.frame_store
+        # the pipeline aligns depth to its color stream, whose resolution and intrinsics differ from the Gemini
+        # ones of the config, and reports the depth units of the device
+        cam_intrinsics, depth_registration = realsense.color_intrinsics, None
+        depth_scale = 1.0 / realsense.depth_scale
+    elif capture_process:
+        capture = CaptureProcess()
+        capture.start()
+        frame_store = capture.reader
+    else:
+        frame_store = FrameStore()
+        image_thread = threading.Thread(target=save_images_gemini, args=(frame_store,))
+        image_thread.start()
 
-    if not prompt_append:
-        try:
-            for i in range(rounds):
-                # save_images_gemini()
-                assistant.record_audio()
-                transcription = assistant.transcribe_audio()
+    # Track scene changes between turns so that results for an unchanged scene can be reused
+    scene_detector = SceneChangeDetector()
+    scene_cache = SceneCache()
 
-                response = single_multimodal_call(model_name, base_multimodal_prompt, transcription,
+    try:
+        for i in range(rounds):
+            assistant.record_audio()
+            transcription = assistant.transcribe_audio()
+
+            # pure conversation needs neither the camera image nor the grounding prompt
+            route = intent_router.route(transcription) if intent_router is not None else None
+            if route is not None and route.intent == CHAT:
+                verbal_response = assistant.generate_response(
+                    transcription, model=intent_routing.get("chat_model", "gpt-3.5-turbo"),
+                    system_prompt=intent_routing.get("chat_system_prompt"))
+                print("CURI audio response:\n", verbal_response)
+                assistant.text_to_speech(verbal_response)
+                if history is not None:
+                    history.add_turn(transcription, None,
+                                     json.dumps({"robot_response": verbal_response, "robot_actions": None}))
+                continue
+
+            # grab one synchronized RGB-D frame per turn, shared by the reasoning and the action execution
+            rgbd_frame = frame_store.snapshot_rgbd(max_age=max_frame_age, slop=sync_slop)
+            if rgbd_frame is None:
+                print(f"No synchronized RGB-D frame newer than {max_frame_age}s, skipping this turn.")
+                continue
+            rgbd_frame = rgbd_frame._replace(scene_version=scene_detector.update(rgbd_frame.rgb))
+
+            # the image is only encoded for the upload once per scene version
+            if realtime_flag:
+                encoded_image = scene_cache.get(rgbd_frame.scene_version, "prompt_image")
+                if encoded_image is None:
+                    encoded_image = scene_encoder.encode(rgbd_frame.rgb)
+                    scene_cache.put(rgbd_frame.scene_version, "prompt_image", encoded_image)
+            prompt_img_path = prompt_compiler.reference(encoded_image)
+            prompt = base_multimodal_prompt
+            prompt_version = compiled_prompt.version
+            if route is not None and route.intent == SCENE:
+                # a question about the scene needs the image, but not the grounding examples
+                prompt = [message for message in base_multimodal_prompt if message["role"] == "system"]
+                prompt_version = prompt_hash([prompt_version, SCENE])
+            elif example_selector is not None:
+                selection = example_selector.select_indices(transcription)
+                print("Few-shot examples {} of {}".format(selection, len(example_selector.examples)))
+                prompt = example_selector.messages(selection)
+                prompt_version = prompt_hash([prompt_version, selection])
+            if history is not None and history.turns:
+                # the same question can have another answer later in the conversation
+                prompt = prompt + history.messages()
+                prompt_version = prompt_hash([prompt_version, history.messages()])
+            cache_key = response_cache.make_key(backend.model, prompt_version, encoded_image.content_hash,
+                                                transcription)
+            response = response_cache.get(cache_key)
+            if response is None:
+                payload_size = prompt_compiler.payload_size(compiled_prompt, prompt_img_path, transcription, prompt)
+                if history is not None:
+                    print("Request payload: {} bytes, with a history of {} turns: {} bytes, ~{} tokens".format(
+                        payload_size, len(history.turns), history.size_bytes(), history.tokens()))
+                else:
+                    print("Request payload: {} bytes".format(payload_size))
+
+            # when streaming, speak the verbal response in the background as soon as it is complete, and
+            # dispatch each robot action as soon as its JSON object is complete
+            speech_threads = []
+            streamed_actions = []
+            dispatcher = ActionDispatcher(rgbd_frame.rgb, rgbd_frame.depth, cam_intrinsics, depth_registration,
+                                          depth_scale=depth_scale)
+
+            def speak_response(key, value):
+                if key == 'robot_response' and value:
+                    print("CURI audio response:\n", value)
+                    speech_thread = threading.Thread(target=assistant.text_to_speech, args=(value,))
+                    speech_thread.start()
+                    speech_threads.append(speech_thread)
+
+            def dispatch_action(key, index, action):
+                if key == 'robot_actions':
+                    print("CURI action response:\n", action)
+                    streamed_actions.append(action)
+                    try:
+                        action = validate_action(action).to_dict()
+                    except ResponseError as e:
+                        print("Invalid action, dropping the rest of the plan: {}".format(e))
+                        dispatcher.aborted = True
+                        return
+                    if refine_bboxes:
+                        action = refine_action_bboxes(
+                            [action], rgbd_frame.rgb, partial(locate_object, grounding_backend), image_encoder,
+                            roi_refinement.get("margin", 0.5), roi_refinement.get("min_size", 0.15))[0]
+                    dispatcher.submit(action)
+
+            def reject_action(key, index, text):
+                if key == 'robot_actions':
+                    # the repaired plan is only executed if nothing was streamed, so the later actions, which may
+                    # depend on this one, must not be executed without it
+                    print("Invalid action {}, dropping the rest of the plan: {}".format(index, text))
+                    dispatcher.aborted = True
+
+            if response is not None:
+                print("CURI response (cached):\n", response)
+            elif stream_response:
+                response = stream_multimodal_call(backend, prompt, transcription,
+                                                  prompt_img_path, on_field=speak_response,
+                                                  on_item=dispatch_action, on_item_error=reject_action)
+            else:
+                response = single_multimodal_call(backend, prompt, transcription,
                                                   prompt_img_path,
                                                   log=True, return_response=True)
 
 
-                # print("Type of response:", type(response))
-                # print("Response content:", response)
+            # print("Type of response:", type(response))
+            # print("Response content:", response)
 
-                # parse the JSON string of response.
+            # parse and validate the response, with local repairs; a response that cannot be repaired is sent
+            # back for correction, unless parts of it were already spoken or executed while streaming
+            plan = None
+            for attempt in range(max_parse_retries + 1):
+                if response is None:
+                    # the error of the failed call is already printed
+                    break
                 try:
-                    output_data = json.loads(response)
-                except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON: {e}")
-                    return
-
-                if output_data['robot_response']:
-                    verbal_response = output_data['robot_response']
-                    assistant.text_to_speech(verbal_response)
-                    print("CURI audio response:\n", verbal_response)
-
-                if output_data['robot_actions']:
-                    action_response = output_data['robot_actions']
-                    print("CURI action response:\n", action_response)
-                    process_robot_actions(action_response, rgb_img_path, depth_img_path)
-
-
-        finally:
-            # Ensure all threads are cleaned up properly
-            rospy.signal_shutdown("Shutting down ROS node.")
+                    plan = parse_response(response)
+                    break
+                except ResponseError as e:
+                    print("Invalid response: {}".format(e))
+                    if attempt == max_parse_retries or speech_threads or streamed_actions:
+                        break
+                    response = correct_response(backend, prompt, transcription, prompt_img_path,
+                                                response, e)
+
+            if plan is None:
+                # wait for the next instruction
+                dispatcher.close()
+                for speech_thread in speech_threads:
+                    speech_thread.join()
+                continue
+            if plan.repairs:
+                print("Repaired response: {}".format(", ".join(plan.repairs)))
+            if not plan.actions:
+                # the scene version ignores small changes, such as an object moved a few centimeters, so a cached
+                # plan could be executed with stale bboxes; only the responses without actions are reused
+                response_cache.put(cache_key, response)
+            if history is not None:
+                history.add_turn(transcription, prompt_img_path, response)
+
+            if plan.robot_response and not speech_threads:
+                verbal_response = plan.robot_response
+                assistant.text_to_speech(verbal_response)
+                print("CURI audio response:\n", verbal_response)
+
+            if plan.actions and not streamed_actions:
+                action_response = plan.action_dicts()
+                print("CURI action response:\n", action_response)
+                if refine_bboxes:
+                    action_response = refine_action_bboxes(
+                        action_response, rgbd_frame.rgb, partial(locate_object, grounding_backend),
+                        image_encoder, roi_refinement.get("margin", 0.5), roi_refinement.get("min_size", 0.15))
+                process_robot_actions(action_response, rgbd_frame.rgb, rgbd_frame.depth, cam_intrinsics,
+                                      depth_registration, depth_scale=depth_scale)
+
+            # do not record the next instruction while the robot is still moving or speaking
+            dispatcher.close()
+            for speech_thread in speech_threads:
+                speech_thread.join()
+
+
+    finally:
+        # Ensure all threads are cleaned up properly
+        rospy.signal_shutdown("Shutting down ROS node.")
+        if camera_source == "realsense":
+            realsense.stop()
+        elif capture_process:
+            capture.stop()
+        else:
             image_thread.join()  # Wait for the image saving thread to finish
-            print("Processing complete.")
-
-    else:
-        if rounds < 1:
-            raise ValueError("Number of rounds must be at least 1.")
-
-        for i in range(rounds):
-            instruction = input("Please input your instruction: ")
-
-            # Single call for each round
-            if i == 1:
-                # for the first round or if not returning response, just update the prompt
-                inference_results = single_multimodal_call(base_multimodal_prompt, instruction, log=True,
-                                                           return_response=False)
-
-            else:
-                # For subsequent rounds, get the response as well to append to the prompt
-                new_prompt, response_dict = single_multimodal_call(base_multimodal_prompt, instruction, log=True,
-                                                                   return_response=True)
-                if 'output' in response_dict and 'choices' in response_dict['output'] and len(
-                        response_dict['output']['choices']) > 0:
-                    # Append the model's response to the prompt for the next round
-                    response_content = response_dict['output']['choices'][0]['message']['content']
-                    response_role = response_dict['output']['choices'][0]['message']['role']
-                    new_prompt.append({'role': response_role, 'content': [{'text': response_content}]})
-                base_multimodal_prompt = new_prompt
+        print(response_cache.stats())
+        if isinstance(backend, HedgedBackend):
+            print(backend.stats())
+        backend.close()
+        print("Processing complete.")
 
 
 if __name__ == '__main__':
@@ -263,320 +543,38 @@ if __name__ == '__main__':
     rgb_img_path = config['rgb_img_path']
     local_img_path = config['local_img_path']
     model_name = config['model_name']
-
-    base_multimodal_prompt = [
-        {
-            "role": "system",
-            "content": [{
-                "text": '''You are an excellent responser of human instructions for household tabletop tasks. Given an verbal instruction and an image of the tabletop scenario, you respond to the human instruction and select appropriate robot actions if necessary.
-
-                        Your response must be output in a structured JSON format and contain the following two keywords:
-                        - "robot_response" for the verbal response to the human instruction.
-                        - "robot_actions" for the description of the physical action you will perform, including the specific action name and parameters for bounding box coordinates.
-                        Must add the "," delimiter between the two keywords to ensure proper JSON formatting.
-
-                        Two robot actions are available to you:
-                        - grasp_and_place(arg1, arg2): The robot grasps the object located at the bounding box coordinates specified by `arg1`, and places it at the location specified by `arg2`.
-                        - grasp_and_give(arg1): The robot picks up the object identified by the bounding box coordinates `arg1` and hands it directly to the user. This action requires only arg1 for the coordinates of the object to be picked up.
-                        Note that both arg1 and arg2 should be detected by yourself from the provided image.'''
-            }]
-        },
-        {
-            "role": "user",
-            "content": [
-                {"image": local_img_path},
-                {"text": "hey CURI, what do you see right now?"},
-            ]
-        },
-        {
-            "role": "assistant",
-            "content": [{
-                "text": json.dumps({
-                    "robot_response": "Now I see a red plate in the center of the table, and an empty spam can, a banana, and a soda can near the plate. There is also a green container on the upper left corner of the table.",
-                    "robot_actions": None
-                }, indent=4)
-            }]
-        },
-        {
-            "role": "user",
-            "content": [
-                {"image": local_img_path},
-                {"text": "Can you give me the soda can on the table?"}
-            ]
-        },
-        {
-            "role": "assistant",
-            "content": [{
-                "text": json.dumps({
-                    "robot_response": "Sure, here is your soda can.",
-                    "robot_actions": [
-                        {
-                            "action": "grasp_and_give",
-                            "parameters": {
-                                "arg1": {
-                                    "description": "soda can",
-                                    "bbox_coordinates": [634, 672, 815, 780] # Hypothetical bbox coordinates [x1, y1, x2, y2] for the soda can
-
-                                }
-                            }
-                        }
-                    ]
-                }, indent=4)
-            }]
-        },
-        {
-            "role": "user",
-            "content": [
-                {"image": local_img_path},
-                {"text": "Can you put the spam can in the container?"}
-            ]
-        },
-        {
-            "role": "assistant",
-            "content": [{
-                "text": json.dumps({
-                    "robot_response": "Sure thing.",
-                    "robot_actions": [
-                        {
-                            "action": "grasp_and_place",
-                            "parameters": {
-                                "arg1": {
-                                    "description": "spam can",
-                                    "bbox_coordinates": [139, 719, 317, 862]  # Hypothetical bbox coordinates [x1, y1, x2, y2] for the spam can
-                                },
-                                "arg2": {
-                                    "description": "container",
-                                    "bbox_coordinates": [579, 67, 961, 300]  # Hypothetical bbox coordinates [x1, y1, x2, y2] for the container
-                                }
-                            }
-                        }
-                    ]
-                }, indent=4)
-            }]
-        }
-    ]
+    max_frame_age = config.get('max_frame_age', 1.0)
+    sync_slop = config.get('rgbd_sync_slop', 0.05)
+    camera_config = config['camera']
+    capture_process = config.get('capture_process', False)
+    camera_source = config.get('camera_source', 'gemini')
+    image_encoding = config.get('image_encoding', {})
+    roi_refinement = config.get('roi_refinement', {})
+    response_cache = config.get('response_cache', {})
+    upload_prompt_images = config.get('upload_prompt_images', True)
+    mllm_backend = config.get('mllm_backend', {})
+    hedging = config.get('hedging', {})
+    prompt_append = config.get('prompt_append', False)
+    conversation_history = config.get('conversation_history', {})
+    example_selection = config.get('example_selection', {})
+    intent_routing = config.get('intent_routing', {})
+    max_parse_retries = config.get('max_parse_retries', 1)
+    stream_response = config.get('stream_response', False)
+
+    # load the few-shot prompt from the prompt library shared by the entry points, with the local image as its scene
+    prompt_registry = PromptRegistry(config.get('prompt_dir', 'prompt'))
+    base_multimodal_prompt = prompt_registry.messages(config.get('prompt_name', 'tabletop_en'),
+                                                      images={"scene": local_img_path})
 
     # get the CURI response with audio input and output
-
-    # base_multimodal_prompt = [
-    #     {
-    #         "role": "system",
-    #         "content": [{
-    #             "text": '''You are an excellent responser of human instructions for household tabletop tasks. Given an verbal instruction and an image of the tabletop scenario, you respond to the human instruction and select appropriate robot actions if necessary.
-    #
-    #                     Your response must be output in a structured JSON format and contain the following two keywords:
-    #                     - "robot_response" for the verbal response to the human instruction.
-    #                     - "robot_actions" for the description of the physical action you will perform, including the specific action name and parameters for bounding box coordinates.
-    #                     Must add the "," delimiter between the two keywords to ensure proper JSON formatting.
-    #
-    #                     Two robot actions are available to you:
-    #                     - grasp_and_place(arg1, arg2): The robot grasps the object located at the bounding box coordinates specified by `arg1`, and places it at the location specified by `arg2`.
-    #                     - grasp_and_give(arg1): The robot picks up the object identified by the bounding box coordinates `arg1` and hands it directly to the user. This action requires only arg1 for the coordinates of the object to be picked up.
-    #                     Note that both arg1 and arg2 should be detected by yourself from the provided image.'''
-    #         }]
-    #     },
-    #     {
-    #         "role": "user",
-    #         "content": [
-    #             {"image": local_img_path},
-    #             {"text": "hey CURI, what do you see right now?"},
-    #         ]
-    #     },
-    #     {
-    #         "role": "assistant",
-    #         "content": [{
-    #             "text": json.dumps({
-    #                 "robot_response": "Now I see a white table with various objects on it, including a banana, an apple, a spray bottle, a green box, and a red game controller.",
-    #                 "robot_actions": None
-    #             }, indent=4)
-    #         }]
-    #     },
-    #     {
-    #         "role": "user",
-    #         "content": [
-    #             {"image": local_img_path},
-    #             {"text": "do you know how to use the spray bottle?"},
-    #         ]
-    #     },
-    #     {
-    #         "role": "assistant",
-    #         "content": [{
-    #             "text": json.dumps({
-    #                 "robot_response": "Yes, I know how to use a spray bottle. It's a common household item used for cleaning or other purposes. To use it, you typically press down on the top part of the bottle, which releases the liquid inside through a nozzle, creating a fine mist or stream of liquid.",
-    #                 "robot_actions": None
-    #             }, indent=4)
-    #         }]
-    #     },
-    #     {
-    #         "role": "user",
-    #         "content": [
-    #             {"image": local_img_path},
-    #             {"text": "Can you handover the spray bottle to me?"}
-    #         ]
-    #     },
-    #     {
-    #         "role": "assistant",
-    #         "content": [{
-    #             "text": json.dumps({
-    #                 "robot_response": "Sure thing, here is the spray bottle.",
-    #                 "robot_actions": [
-    #                     {
-    #                         "action": "grasp_and_give",
-    #                         "parameters": {
-    #                             "arg1": {
-    #                                 "description": "spray bottle",
-    #                                 "bbox_coordinates": [634, 672, 815, 780]
-    #                                 # Hypothetical coordinates for the spray bottle
-    #                                 # [x1, y1, x2, y2]
-    #                             }
-    #                         }
-    #                     }
-    #                 ]
-    #             }, indent=4)
-    #         }]
-    #     }
-    #     # {
-    #     #     "role": "user",
-    #     #     "content": [
-    #     #         {"image": local_img_path},
-    #     #         {"text": "Can you put the spam can in the container?"}
-    #     #     ]
-    #     # },
-    #     # {
-    #     #     "role": "assistant",
-    #     #     "content": [{
-    #     #         "text": json.dumps({
-    #     #             "robot_response": "Sure thing.",
-    #     #             "robot_actions": [
-    #     #                 {
-    #     #                     "action": "grasp_and_place",
-    #     #                     "parameters": {
-    #     #                         "arg1": {
-    #     #                             "description": "spam can",
-    #     #                             "bbox_coordinates": [139, 719, 317, 862]  # [x1, y1, x2, y2]
-    #     #                         },
-    #     #                         "arg2": {
-    #     #                             "description": "container",
-    #     #                             "bbox_coordinates": [579, 67, 961, 300]  # [x1, y1, x2, y2]
-    #     #                         }
-    #     #                     }
-    #     #                 }
-    #     #             ]
-    #     #         }, indent=4)
-    #     #     }]
-    #     # }
-    # ]
-
-    # base_multimodal_prompt = [
-    #     {
-    #         "role": "system",
-    #         "content": [{
-    #             "text": '''You are an excellent responser of human instructions for household tabletop tasks. Given an verbal instruction and an image of the tabletop scenario, you respond to the human instruction and select appropriate robot actions if necessary.
-    #
-    #                     Your response must be output in a structured JSON format and contain the following two keywords:
-    #                     - "robot_response" for the verbal response to the human instruction.
-    #                     - "robot_actions" for the description of the physical action you will perform, including the specific action name and parameters for bounding box coordinates.
-    #                     Must add the "," delimiter between the two keywords to ensure proper JSON formatting.
-    #
-    #                     Two robot actions are available to you:
-    #                     - grasp_and_place(arg1, arg2): The robot grasps the object located at the bounding box coordinates specified by `arg1`, and places it at the location specified by `arg2`.
-    #                     - grasp_and_give(arg1): The robot picks up the object identified by the bounding box coordinates `arg1` and hands it directly to the user. This action requires only arg1 for the coordinates of the object to be picked up.
-    #                     Note that both arg1 and arg2 should be detected by yourself from the provided image.'''
-    #         }]
-    #     },
-    #     {
-    #         "role": "user",
-    #         "content": [
-    #             {"image": local_img_path},
-    #             {"text": "hey CURI, what do you see right now?"},
-    #         ]
-    #     },
-    #     {
-    #         "role": "assistant",
-    #         "content": [{
-    #             "text": json.dumps({
-    #                 "robot_response": "Now I see a white table with various objects on it, including a banana, an apple, a spray bottle, a green box, and a red game controller.",
-    #                 "robot_actions": None
-    #             }, indent=4)
-    #         }]
-    #     },
-    #     {
-    #         "role": "user",
-    #         "content": [
-    #             {"image": local_img_path},
-    #             {"text": "I wan to eat some fruits, can you give me one?"},
-    #         ]
-    #     },
-    #     {
-    #         "role": "assistant",
-    #         "content": [{
-    #             "text": json.dumps({
-    #                 "robot_response": "There's a banana and an apple on the table. Which one do you prefer?",
-    #                 "robot_actions": None
-    #             }, indent=4)
-    #         }]
-    #     },
-    #     {
-    #         "role": "user",
-    #         "content": [
-    #             {"image": local_img_path},
-    #             {"text": "Give me the apple, please."}
-    #         ]
-    #     },
-    #     {
-    #         "role": "assistant",
-    #         "content": [{
-    #             "text": json.dumps({
-    #                 "robot_response": "Sure, Here's the apple for you.",
-    #                 "robot_actions": [
-    #                     {
-    #                         "action": "grasp_and_give",
-    #                         "parameters": {
-    #                             "arg1": {
-    #                                 "description": "apple",
-    #                                 "bbox_coordinates": [435, 320, 496, 437]  # Hypothetical coordinates for the apple
-    #                             }
-    #                         }
-    #                     }
-    #                 ]
-    #             }, indent=4)
-    #         }]
-    #     },
-    #     {
-    #         "role": "user",
-    #         "content": [
-    #             {"image": local_img_path},
-    #             {"text": "Can you put the banana in the green box?"}
-    #         ]
-    #     },
-    #     {
-    #         "role": "assistant",
-    #         "content": [{
-    #             "text": json.dumps({
-    #                 "robot_response": "Sure thing.",
-    #                 "robot_actions": [
-    #                     {
-    #                         "action": "grasp_and_place",
-    #                         "parameters": {
-    #                             "arg1": {
-    #                                 "description": "banana",
-    #                                 "bbox_coordinates": [379, 486, 474, 652] # Hypothetical coordinates for the banana
-    #
-    #                             },
-    #                             "arg2": {
-    #                                 "description": "green box",
-    #                                 "bbox_coordinates": [538, 284, 709, 656]  # Hypothetical coordinates for the green box
-    #                             }
-    #                         }
-    #                     }
-    #                 ]
-    #             }, indent=4)
-    #         }]
-    #     }
-    # ]
-
-
     get_curi_response_with_audio(model_name, api_key, base_url, user_input_filename, curigpt_output_filename,
                                  rgb_img_path,
                                  depth_img_path, local_img_path, base_multimodal_prompt, rounds=10,
-                                 realtime_flag=True, prompt_append=False)
\ No newline at end of file
+                                 realtime_flag=True, prompt_append=prompt_append, max_frame_age=max_frame_age,
+                                 sync_slop=sync_slop, camera_config=camera_config, capture_process=capture_process,
+                                 camera_source=camera_source, image_encoding=image_encoding,
+                                 roi_refinement=roi_refinement, response_cache=response_cache,
+                                 upload_prompt_images=upload_prompt_images, mllm_backend=mllm_backend,
+                                 hedging=hedging, max_parse_retries=max_parse_retries,
+                                 stream_response=stream_response, conversation_history=conversation_history,
+                                 example_selection=example_selection, intent_routing=intent_routing)
\ No newline at end of file
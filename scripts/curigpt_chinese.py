@@ -5,64 +5,53 @@ High-level task reasoning for CURI manipulation via Multimodal Large Language Mo
 """
 
 from http import HTTPStatus
-import dashscope
 from dashscope import MultiModalConversation
 from curigpt_ros.models.audio_assistant import AudioAssistant
-from curigpt_ros.utils.vis_utils import save_color_image_rs, save_images_gemini, plot_image_with_bbox, get_spatial_coordinates
-from curigpt_ros.utils.action_utils import process_robot_actions
+from curigpt_ros.models.response_cache import ResponseCache, prompt_hash
+from curigpt_ros.models.conversation import ConversationHistory
+from curigpt_ros.models.prompt_library import PromptRegistry
+from curigpt_ros.models.example_selector import ExampleSelector
+from curigpt_ros.models.intent_router import IntentRouter, CHAT, SCENE
+from curigpt_ros.models.prompt_compiler import PromptCompiler
+from curigpt_ros.models.mllm_backends import create_backend
+from curigpt_ros.models.hedging import HedgedBackend
+from curigpt_ros.utils.vis_utils import save_images_gemini
+from curigpt_ros.utils.frame_store import FrameStore
+from curigpt_ros.utils.shm_frames import CaptureProcess
+from curigpt_ros.utils.realsense_utils import RealSenseSource
+from curigpt_ros.utils.scene_utils import SceneChangeDetector, SceneCache
+from curigpt_ros.utils.image_encoding import ImageEncoder
 import json
 import rospy
 import threading
 
 
-def single_multimodal_call(model_name, base_prompt, query, prompt_img_path, log=True, return_response=True):
+def single_multimodal_call(backend, base_prompt, query, prompt_img_path, log=True, return_response=True):
     """
     Single round multimodal conversation call with CuriGPT.
 
     Parameters:
+        backend (MLLMBackend): The reasoning backend, see `create_backend`.
         base_prompt (list): The base prompt for multimodal reasoning.
         query (str): The user query.
-        rgb_img_path (str): The path to the real-time image.
+        rgb_img_path (str): The path to the real-time image, None for a text-only turn.
         log (bool): Whether to log the response.
         return_response (bool): Whether to return the response.
     """
     # make a copy of the base prompt to create a new prompt
     new_prompt = base_prompt.copy()
-    prompt_img_path = prompt_img_path
-    new_prompt.append({"role": "user", "content": [{"image": prompt_img_path}, {"text": query}]})
-
-    # check if the model name belongs to qwen-vl-max or qwen-vl-chat-v1
-    if model_name not in ['qwen-vl-max', 'qwen-vl-chat-v1']:
-        raise ValueError("Model name must be either 'qwen-vl-max' or 'qwen-vl-chat-v1'.")
-
-    # get the response from qwen_vl_max
-    if model_name == 'qwen-vl-max':
-        response_dict = dashscope.MultiModalConversation.call(model='qwen-vl-max',
-                                                     messages=new_prompt)
-
-        if response_dict.status_code == HTTPStatus.OK:
-            response = response_dict[
-                "output"]["choices"][0]["message"]["content"][0]["text"]
-            print("CURI response:\n", response)
-
-        else:
-            print(response_dict.code)  # The error code.
-            print(response_dict.message)  # The error message.
-
-    # get the response from qwen-vl-chat-v1
-    elif model_name == 'qwen-vl-chat-v1':
-        response_dict = MultiModalConversation.call(model=MultiModalConversation.Models.qwen_vl_chat_v1,
-                                                                                               messages=new_prompt, top_p=0.9, top_k=100)
-
-        if response_dict.status_code == HTTPStatus.OK:
-            response = response_dict[
-                "output"]["choices"][0]["message"]["content"]
-            print("CURI response:\n", response)
-
-        else:
-            print(response_dict.code)  # The error code.
-            print(response_dict.message)  # The error message.
-
+    image_content = [{"image": prompt_img_path}] if prompt_img_path is not None else []
+    new_prompt.append({"role": "user", "content": image_content + [{"text": query}]})
+
+    # get the response from the configured reasoning backend
+    result = backend.call(new_prompt)
+    if result.ok:
+        response = result.text
+        print("CURI response:\n", response)
+    else:
+        response = None
+        print(result.status_code)  # The error code.
+        print(result.error)  # The error message.
 
     # plot the image with bounding boxes if the response contains actions.
     # plot_image_with_bbox(prompt_img_path, response)
@@ -84,7 +73,6 @@ def multiple_multimodal_call(base_prompt, query, prompt_img_path, rounds=10, log
     """
 
     new_prompt = base_prompt.copy()
-    prompt_img_path = prompt_img_path
 
     for i in range(rounds):
         new_prompt.append({"role": "user", "content": [{"image": prompt_img_path}, {"text": query}]})
@@ -114,46 +102,37 @@ def multiple_multimodal_call(base_prompt, query, prompt_img_path, rounds=10, log
             return response
 
 
-def get_curi_response(base_multimodal_prompt, rounds=10, prompt_append=False):
-
-    """Get CURI response for a given number of rounds."""
-    inference_results = None
-    if not prompt_append:
-        print("without prompt append")
-        for i in range(rounds):
-            instruction = input("Please input your instruction: ")
-            inference_results = single_multimodal_call(base_multimodal_prompt, instruction, log=True, return_response=False)
-
-    else:
-        if rounds < 1:
-            raise ValueError("Number of rounds must be at least 1.")
-
-        for i in range(rounds):
-            instruction = input("Please input your instruction: ")
-
-            # Single call for each round
-            if i == 1:
-                # For the first round or if not returning response, just update the prompt
-                inference_results = single_multimodal_call(base_multimodal_prompt, instruction, log=True,
-                                                           return_response=False)
+def get_curi_response(backend, base_multimodal_prompt, prompt_img_path, rounds=10, prompt_append=False):
+    """
+    Get CURI responses to typed instructions for a given number of rounds.
 
-            else:
-                # For subsequent rounds, get the response as well to append to the prompt
-                new_prompt, response_dict = single_multimodal_call(base_multimodal_prompt, instruction, log=True,
-                                                                   return_response=True)
-                if 'output' in response_dict and 'choices' in response_dict['output'] and len(
-                        response_dict['output']['choices']) > 0:
-                    # Append the model's response to the prompt for the next round
-                    response_content = response_dict['output']['choices'][0]['message']['content']
-                    response_role = response_dict['output']['choices'][0]['message']['role']
-                    new_prompt.append({'role': response_role, 'content': [{'text': response_content}]})
-                base_multimodal_prompt = new_prompt
+    Parameters:
+        backend (MLLMBackend): The reasoning backend, see `create_backend`.
+        base_multimodal_prompt (list): The base prompt for multimodal reasoning.
+        prompt_img_path (str): The path or URL of the image of the scene.
+        rounds (int): The number of rounds.
+        prompt_append (bool): Whether to send the previous turns with each request.
+    """
+    history = ConversationHistory(language="zh") if prompt_append else None
+    for i in range(rounds):
+        instruction = input("Please input your instruction: ")
+        prompt = base_multimodal_prompt + history.messages() if history is not None else base_multimodal_prompt
+        response = single_multimodal_call(backend, prompt, instruction, prompt_img_path, log=True,
+                                          return_response=True)
+        if history is not None and response is not None:
+            history.add_turn(instruction, prompt_img_path, response)
 
 
 def get_curi_response_with_audio(model_name, api_key, base_url, user_input, curigpt_output, rgb_img_path,
                                  depth_img_path,
                                  local_img_path,
-                                 base_multimodal_prompt, rounds=10, realtime_flag=True, prompt_append=False):
+                                 base_multimodal_prompt, rounds=10, realtime_flag=True, prompt_append=False,
+                                 max_frame_age=1.0, sync_slop=0.05, camera_config=None, capture_process=False,
+                                 camera_source="gemini", image_encoding=None,
+                                 roi_refinement=None, response_cache=None,
+                                 upload_prompt_images=True, mllm_backend=None,
+                                 hedging=None, conversation_history=None,
+                                 example_selection=None, intent_routing=None):
     """
     Get CURI response with audio input and output.
 
@@ -162,13 +141,37 @@ def get_curi_response_with_audio(model_name, api_key, base_url, user_input, curi
         base_url (str): The base URL for the OpenAI API.
         user_input (str): The path to the user audio input file.
         curigpt_output (str): The path to the CuriGPT audio output file.
-        rgb_img_path (str): The path to the real-time image.
+        rgb_img_path (str): The path to the real-time image (unused, the upload image is written to the encoder cache).
         depth_img_path (str): The path to the depth image.
         local_img_path (str): The path to the local image.
         base_multimodal_prompt (list): The base prompt for multimodal reasoning.
         rounds (int): The number of rounds.
         realtime_flag (bool): Whether to enable interactive reasoning in real-time.
-        prompt_append (bool): Whether to append the model's current response to the next prompt.
+        prompt_append (bool): Whether to keep a multi-turn conversation, with the previous turns appended to the next
+            prompt within the `conversation_history` budget.
+        max_frame_age (float): The maximum age in seconds of the RGB-D frame used for a turn.
+        sync_slop (float): The maximum capture time difference in seconds between the paired RGB and depth frames.
+        camera_config (dict): The camera intrinsics and depth-to-color extrinsics, ignored since this script executes
+            no actions.
+        capture_process (bool): Whether to capture images in a separate process and share them via shared memory.
+        camera_source (str): The camera to use, "gemini" (ROS topics) or "realsense" (persistent pyrealsense2
+            pipeline).
+        image_encoding (dict): The pixel budget, format and quality of the uploaded images, see `ImageEncoder`.
+        roi_refinement (dict): The two-stage grounding settings, ignored since this script executes no actions.
+        response_cache (dict): The response cache settings: "enabled", "bypass", "ttl", "max_entries" and
+            "cache_dir", see `ResponseCache`.
+        upload_prompt_images (bool): Whether to upload each distinct prompt image once and reference it by URL,
+            instead of sending the local files with every request.
+        mllm_backend (dict): The reasoning backend settings, see `create_backend`; the model defaults to `model_name`.
+        hedging (dict): The hedging settings: "enabled", the "secondary" backend settings, and the deadline
+            "percentile", "min_samples" and "default_deadline", see `HedgedBackend`.
+        conversation_history (dict): The multi-turn history budget: "max_turns", "max_tokens",
+            "keep_images" and "image_tokens", see `ConversationHistory`.
+        example_selection (dict): The few-shot example selection, off by default so that every example is sent:
+            "enabled", the number "k" of examples and their "max_tokens" budget, see `ExampleSelector`.
+        intent_routing (dict): The intent routing settings: "enabled", the classifier "examples", "min_confidence",
+            "chat_min_confidence", "overrides", "force" and "log_path" (see `IntentRouter`), and the "chat_model" and
+            "chat_system_prompt" of the text-only chat path.
     """
 
     rospy.init_node('curigpt_response', anonymous=True)
@@ -176,76 +179,174 @@ def get_curi_response_with_audio(model_name, api_key, base_url, user_input, curi
     # Create an instance of the AudioAssistant class
     assistant = AudioAssistant(api_key, base_url, user_input, curigpt_output)
 
-    # check if the CuriGPT need to work in the real-time mode
-    prompt_img_path = rgb_img_path if realtime_flag else local_img_path
-
-    # Start the image saving thread
-    image_thread = threading.Thread(target=save_images_gemini)
-    image_thread.start()
+    # Downsize and compress the uploaded images to a pixel budget; the encoded files are cached by image content
+    image_encoder = ImageEncoder.from_config(image_encoding or {})
 
-    if not prompt_append:
-        try:
-            for i in range(rounds):
-                # save_images_gemini()
-                assistant.record_audio()
-                transcription = assistant.transcribe_audio()
-
-                response = single_multimodal_call(model_name, base_multimodal_prompt, transcription,
-                                                  prompt_img_path,
-                                                  log=True, return_response=True)
-
-                # play the audio response
-                if response is not None:
-                    assistant.text_to_speech(response)
-
-                # parse the JSON string of response.
-                # try:
-                #     output_data = json.loads(response)
-                # except json.JSONDecodeError as e:
-                #     print(f"Error decoding JSON: {e}")
-                #     return
-                #
-                # if output_data['robot_response']:
-                #     verbal_response = output_data['robot_response']
-                #     assistant.text_to_speech(verbal_response)
-                #     print("CURI audio response:\n", verbal_response)
-                #
-                # if output_data['robot_actions']:
-                #     action_response = output_data['robot_actions']
-                #     print("CURI action response:\n", action_response)
-                #     process_robot_actions(action_response, rgb_img_path, depth_img_path)
-
-
-        finally:
-            # Ensure all threads are cleaned up properly
-            rospy.signal_shutdown("Shutting down ROS node.")
-            image_thread.join()  # Wait for the image saving thread to finish
-            print("Processing complete.")
+    # The two-stage grounding refines the bboxes of executed actions, and this script only speaks the responses, so
+    # the scene image is not downscaled for it
+    if (roi_refinement or {}).get("enabled", False):
+        print("roi_refinement is ignored: the Chinese prompt answers in plain text, without robot actions.")
 
+    # check if the CuriGPT need to work in the real-time mode
+    encoded_image = None if realtime_flag else image_encoder.encode_file(local_img_path)
+
+    # Create the reasoning backend, which keeps its HTTP connections alive across turns
+    backend = create_backend(dict({"model": model_name}, **(mllm_backend or {})))
+
+    # Optionally hedge slow calls with a secondary model, the first valid response wins
+    hedging = hedging or {}
+    if hedging.get("enabled", False):
+        # the Chinese prompt answers in plain text
+        backend = HedgedBackend.from_config(backend, hedging, validate=lambda result: result.ok and bool(result.text))
+
+    # Compile the few-shot prompt once, with each distinct example image encoded and uploaded once
+    prompt_compiler = PromptCompiler(image_encoder, backend.upload_image if upload_prompt_images else None)
+    compiled_prompt = prompt_compiler.compile(base_multimodal_prompt)
+    base_multimodal_prompt = compiled_prompt.messages
+
+    # Optionally send only the few-shot examples most similar to each query
+    example_selection = example_selection or {}
+    example_selector = None
+    if example_selection.get("enabled", False):
+        example_selector = ExampleSelector.from_config(base_multimodal_prompt, example_selection)
+
+    # Reuse the responses to the same question on the same scene with the same prompt
+    response_cache = ResponseCache.from_config(response_cache or {})
+
+    # Route each query by intent: conversation to the text-only chat model, scene questions to the vision model
+    # without the grounding examples, and action requests to the full grounding prompt
+    intent_routing = intent_routing or {}
+    intent_router = IntentRouter.from_config(intent_routing) if intent_routing.get("enabled", False) else None
+
+    # In multi-turn mode, the previous turns are sent with each request, as a window bounded by turns and tokens
+    history = ConversationHistory.from_config(conversation_history or {}, language="zh") if prompt_append else None
+
+    # This script executes no actions, so the camera intrinsics, the depth registration and the depth scale that
+    # curigpt.py sets up for the deprojection are not needed here
+
+    # Start the image capture, either from a persistent RealSense pipeline, in a separate process writing to shared
+    # memory or in a thread feeding the in-memory frame store; all provide the same snapshot API
+    if camera_source == "realsense":
+        realsense = RealSenseSource()
+        realsense.start()
+        frame_store = realsense.frame_store
+    elif capture_process:
+        capture = CaptureProcess()
+        capture.start()
+        frame_store = capture.reader
     else:
-        if rounds < 1:
-            raise ValueError("Number of rounds must be at least 1.")
-
-        for i in range(rounds):
-            instruction = input("Please input your instruction: ")
+        frame_store = FrameStore()
+        image_thread = threading.Thread(target=save_images_gemini, args=(frame_store,))
+        image_thread.start()
 
-            # Single call for each round
-            if i == 1:
-                # for the first round or if not returning response, just update the prompt
-                inference_results = single_multimodal_call(base_multimodal_prompt, instruction, log=True,
-                                                           return_response=False)
+    # Track scene changes between turns so that results for an unchanged scene can be reused
+    scene_detector = SceneChangeDetector()
+    scene_cache = SceneCache()
 
+    try:
+        for i in range(rounds):
+            assistant.record_audio()
+            transcription = assistant.transcribe_audio()
+
+            # pure conversation needs neither the camera image nor the grounding prompt
+            route = intent_router.route(transcription) if intent_router is not None else None
+            if route is not None and route.intent == CHAT:
+                verbal_response = assistant.generate_response(
+                    transcription, model=intent_routing.get("chat_model", "gpt-3.5-turbo"),
+                    system_prompt=intent_routing.get("chat_system_prompt"))
+                print("CURI audio response:\n", verbal_response)
+                assistant.text_to_speech(verbal_response)
+                if history is not None:
+                    history.add_turn(transcription, None, verbal_response)
+                continue
+
+            # grab one synchronized RGB-D frame per turn, shared by the reasoning and the action execution
+            rgbd_frame = frame_store.snapshot_rgbd(max_age=max_frame_age, slop=sync_slop)
+            if rgbd_frame is None:
+                print(f"No synchronized RGB-D frame newer than {max_frame_age}s, skipping this turn.")
+                continue
+            rgbd_frame = rgbd_frame._replace(scene_version=scene_detector.update(rgbd_frame.rgb))
+
+            # the image is only encoded for the upload once per scene version
+            if realtime_flag:
+                encoded_image = scene_cache.get(rgbd_frame.scene_version, "prompt_image")
+                if encoded_image is None:
+                    encoded_image = image_encoder.encode(rgbd_frame.rgb)
+                    scene_cache.put(rgbd_frame.scene_version, "prompt_image", encoded_image)
+            prompt_img_path = prompt_compiler.reference(encoded_image)
+            prompt = base_multimodal_prompt
+            prompt_version = compiled_prompt.version
+            if route is not None and route.intent == SCENE:
+                # a question about the scene needs the image, but not the grounding examples
+                prompt = [message for message in base_multimodal_prompt if message["role"] == "system"]
+                prompt_version = prompt_hash([prompt_version, SCENE])
+            elif example_selector is not None:
+                selection = example_selector.select_indices(transcription)
+                print("Few-shot examples {} of {}".format(selection, len(example_selector.examples)))
+                prompt = example_selector.messages(selection)
+                prompt_version = prompt_hash([prompt_version, selection])
+            if history is not None and history.turns:
+                # the same question can have another answer later in the conversation
+                prompt = prompt + history.messages()
+                prompt_version = prompt_hash([prompt_version, history.messages()])
+            cache_key = response_cache.make_key(backend.model, prompt_version, encoded_image.content_hash,
+                                                transcription)
+            response = response_cache.get(cache_key)
+            if response is None:
+                payload_size = prompt_compiler.payload_size(compiled_prompt, prompt_img_path, transcription, prompt)
+                if history is not None:
+                    print("Request payload: {} bytes, with a history of {} turns: {} bytes, ~{} tokens".format(
+                        payload_size, len(history.turns), history.size_bytes(), history.tokens()))
+                else:
+                    print("Request payload: {} bytes".format(payload_size))
+
+            if response is None:
+                response = single_multimodal_call(backend, prompt, transcription,
+                                                  prompt_img_path,
+                                                  log=True, return_response=True)
+                response_cache.put(cache_key, response)
             else:
-                # For subsequent rounds, get the response as well to append to the prompt
-                new_prompt, response_dict = single_multimodal_call(base_multimodal_prompt, instruction, log=True,
-                                                                   return_response=True)
-                if 'output' in response_dict and 'choices' in response_dict['output'] and len(
-                        response_dict['output']['choices']) > 0:
-                    # Append the model's response to the prompt for the next round
-                    response_content = response_dict['output']['choices'][0]['message']['content']
-                    response_role = response_dict['output']['choices'][0]['message']['role']
-                    new_prompt.append({'role': response_role, 'content': [{'text': response_content}]})
-                base_multimodal_prompt = new_prompt
+                print("CURI response (cached):\n", response)
+
+            # play the audio response
+            if response is not None:
+                assistant.text_to_speech(response)
+                if history is not None:
+                    history.add_turn(transcription, prompt_img_path, response)
+
+            # parse the JSON string of response; executing the actions needs the camera setup of curigpt.py
+            # try:
+            #     output_data = json.loads(response)
+            # except json.JSONDecodeError as e:
+            #     print(f"Error decoding JSON: {e}")
+            #     return
+            #
+            # if output_data['robot_response']:
+            #     verbal_response = output_data['robot_response']
+            #     assistant.text_to_speech(verbal_response)
+            #     print("CURI audio response:\n", verbal_response)
+            #
+            # if output_data['robot_actions']:
+            #     action_response = output_data['robot_actions']
+            #     print("CURI action response:\n", action_response)
+            #     process_robot_actions(action_response, rgbd_frame.rgb, rgbd_frame.depth, cam_intrinsics,
+            #                           depth_registration, depth_scale=depth_scale)
+
+
+    finally:
+        # Ensure all threads are cleaned up properly
+        rospy.signal_shutdown("Shutting down ROS node.")
+        if camera_source == "realsense":
+            realsense.stop()
+        elif capture_process:
+            capture.stop()
+        else:
+            image_thread.join()  # Wait for the image saving thread to finish
+        print(response_cache.stats())
+        if isinstance(backend, HedgedBackend):
+            print(backend.stats())
+        backend.close()
+        print("Processing complete.")
 
 
 if __name__ == '__main__':
@@ -262,49 +363,34 @@ if __name__ == '__main__':
     depth_img_path = config['depth_img_path']
     rgb_img_path = config['rgb_img_path']
     local_img_path = config['local_img_path']
-    local_img_path_chinese = "assets/img/curigpt_demo_huawei.png"
     model_name = config['model_name']
-
-    base_multimodal_prompt = [
-        # Example 1: Speech-to-Speech Reasoning
-        {
-            "role": "user",
-            "content": [
-                {"image": local_img_path_chinese},
-                {"text": "下午好, 你能描述下你现在看到的场景吗?"},
-            ]
-        },
-        {
-            "role": "assistant",
-            "content": [{
-                "text": "好的，我看到一个白色的桌子上放着一些物品。左上角有一个橙色的洗涤剂，中间有一个绿色的绿茶罐子，一个蓝色的午餐肉罐头和一个红色的盘子，盘子里放着一根香蕉。"}]
-        },
-        {
-            "role": "user",
-            "content": [
-                {"image": local_img_path_chinese},
-                {"text": "你面前的桌子上是否呢？"},
-            ]
-        },
-        {
-            "role": "assistant",
-            "content": [{
-                            "text": "我认为午餐肉罐头适合作为吃火锅时的配菜，因为它易于烹饪，可以在火锅中快速煮熟，并可以与其他食材搭配，增加火锅的多样性"}]
-        },
-        {
-            "role": "user",
-            "content": [
-                {"image": local_img_path_chinese},
-                {"text": "我想清洗一下红色盘子，你可以把洗涤剂递给我吗"},
-            ]
-        },
-        {
-            "role": "assistant",
-            "content": [{"text": "好的，没问题。我将把洗涤剂瓶子递给你。"}]
-        },
-    ]
+    max_frame_age = config.get('max_frame_age', 1.0)
+    sync_slop = config.get('rgbd_sync_slop', 0.05)
+    camera_config = config['camera']
+    capture_process = config.get('capture_process', False)
+    camera_source = config.get('camera_source', 'gemini')
+    image_encoding = config.get('image_encoding', {})
+    roi_refinement = config.get('roi_refinement', {})
+    response_cache = config.get('response_cache', {})
+    upload_prompt_images = config.get('upload_prompt_images', True)
+    mllm_backend = config.get('mllm_backend', {})
+    hedging = config.get('hedging', {})
+    prompt_append = config.get('prompt_append', False)
+    conversation_history = config.get('conversation_history', {})
+    example_selection = config.get('example_selection', {})
+    intent_routing = config.get('intent_routing', {})
+
+    # load the few-shot prompt from the prompt library shared by the entry points
+    prompt_registry = PromptRegistry(config.get('prompt_dir', 'prompt'))
+    base_multimodal_prompt = prompt_registry.messages(config.get('prompt_name_chinese', 'tabletop_zh'))
 
     get_curi_response_with_audio(model_name, api_key, base_url, user_input_filename, curigpt_output_filename,
                                  rgb_img_path,
                                  depth_img_path, local_img_path, base_multimodal_prompt, rounds=10,
-                                 realtime_flag=True, prompt_append=False)
\ No newline at end of file
+                                 realtime_flag=True, prompt_append=prompt_append, max_frame_age=max_frame_age,
+                                 sync_slop=sync_slop, camera_config=camera_config, capture_process=capture_process,
+                                 camera_source=camera_source, image_encoding=image_encoding,
+                                 roi_refinement=roi_refinement, response_cache=response_cache,
+                                 upload_prompt_images=upload_prompt_images, mllm_backend=mllm_backend,
+                                 hedging=hedging, conversation_history=conversation_history,
+                                 example_selection=example_selection, intent_routing=intent_routing)
\ No newline at end of file
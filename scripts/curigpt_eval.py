@@ -0,0 +1,206 @@
+"""
+CuriGPT Evaluation
+===========================
+Offline evaluation of the reasoning over a JSONL dataset of (image, instruction, expected action) records, with the
+requests run concurrently through a bounded, rate-limited pool.
+
+Each dataset record is a JSON object:
+    {"id": "give_apple", "image": "assets/img/curigpt_img_prompt.png",
+     "instruction": "Could you pass me the red apple?",
+     "expected_action": "grasp_and_give", "expected_bboxes": {"arg1": [431, 314, 491, 428]}}
+with "expected_action": null for queries that need no robot action. The images and instructions must be held out
+from the few-shot examples of the prompt, otherwise the evaluation measures how well the prompt is recalled rather
+than the grounding.
+
+The per-record results (latency, payload size, tokens, JSON validity, action correctness and bbox IoU) are written as
+JSONL to --output, and the aggregate with the latency percentiles is printed.
+"""
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from curigpt_ros.models.example_selector import ExampleSelector
+from curigpt_ros.models.mllm_backends import create_backend
+from curigpt_ros.models.prompt_compiler import PromptCompiler
+from curigpt_ros.models.prompt_library import PromptRegistry
+from curigpt_ros.models.response_parser import parse_response, ResponseError
+from curigpt_ros.utils.image_encoding import ImageEncoder
+from curigpt_ros.utils.roi_utils import bbox_iou
+
+
+class RateLimiter(object):
+    """Token bucket limiting the request rate across threads, allowing bursts of `burst` requests."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def load_dataset(path):
+    with open(path, "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def token_usage(raw):
+    """Return the (input, output) token counts reported by the server, DashScope or OpenAI format, or Nones."""
+    usage = raw.get("usage", {}) if isinstance(raw, dict) else {}
+    return (usage.get("input_tokens", usage.get("prompt_tokens")),
+            usage.get("output_tokens", usage.get("completion_tokens")))
+
+
+def score_response(text, record, iou_threshold=0.5):
+    """
+    Score a response against the expected action of a record.
+
+    Returns:
+        dict: "valid" and "repairs" of the JSON response, "action_correct", the "iou" per expected bbox argument,
+            and "success" (correct action with all the IoUs above the threshold).
+    """
+    scores = {"valid": False, "repairs": [], "parse_error": None, "action": None, "action_correct": False,
+              "iou": {}, "success": False}
+    try:
+        plan = parse_response(text)
+    except ResponseError as e:
+        scores["parse_error"] = str(e)
+        return scores
+    scores.update(valid=True, repairs=plan.repairs)
+
+    action = plan.actions[0] if plan.actions else None
+    scores["action"] = action.action if action else None
+    scores["action_correct"] = scores["action"] == record.get("expected_action")
+    for arg, expected_bbox in (record.get("expected_bboxes") or {}).items():
+        argument = action.arguments.get(arg) if action else None
+        scores["iou"][arg] = bbox_iou(argument.bbox, expected_bbox) if argument else 0.0
+    scores["success"] = scores["action_correct"] and all(iou >= iou_threshold for iou in scores["iou"].values())
+    return scores
+
+
+def evaluate_record(backend, compiled_prompt, prompt_compiler, rate_limiter, record, image_reference,
+                    iou_threshold, example_selector=None):
+    """Run one record, the equivalent of `single_multimodal_call`, and return its result."""
+    prompt = compiled_prompt.messages
+    if example_selector is not None:
+        prompt = example_selector.select(record["instruction"])
+    messages = prompt + [{"role": "user", "content": [{"image": image_reference}, {"text": record["instruction"]}]}]
+    rate_limiter.acquire()
+    start = time.monotonic()
+    response = backend.call(messages)
+    latency = time.monotonic() - start
+
+    input_tokens, output_tokens = token_usage(response.raw)
+    result = {"id": record.get("id"), "instruction": record["instruction"], "latency": latency,
+              "payload_bytes": prompt_compiler.payload_size(compiled_prompt, image_reference, record["instruction"],
+                                                            prompt),
+              "input_tokens": input_tokens, "output_tokens": output_tokens, "error": response.error,
+              "response": response.text}
+    if response.ok:
+        result.update(score_response(response.text, record, iou_threshold))
+    return result
+
+
+def summarize(results):
+    """Aggregate the per-record results."""
+    completed = [result for result in results if result["error"] is None]
+    latencies = np.array([result["latency"] for result in completed]) if completed else np.zeros(1)
+    ious = [iou for result in completed for iou in result["iou"].values()]
+
+    def rate(key):
+        return sum(1 for result in completed if result[key]) / len(completed) if completed else 0.0
+
+    return {
+        "records": len(results),
+        "errors": len(results) - len(completed),
+        "json_valid": rate("valid"),
+        "repaired": sum(1 for result in completed if result["repairs"]) / len(completed) if completed else 0.0,
+        "action_accuracy": rate("action_correct"),
+        "success": rate("success"),
+        "mean_iou": float(np.mean(ious)) if ious else None,
+        "latency_p50": float(np.percentile(latencies, 50)),
+        "latency_p95": float(np.percentile(latencies, 95)),
+        "latency_p99": float(np.percentile(latencies, 99)),
+        "mean_payload_bytes": float(np.mean([result["payload_bytes"] for result in results])) if results else 0.0,
+        "mean_output_tokens": float(np.mean([result["output_tokens"] for result in completed
+                                             if result["output_tokens"] is not None] or [0])),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset", help="JSONL dataset of (image, instruction, expected action) records")
+    parser.add_argument("--prompt", default=None, help="prompt library name, by default the configured prompt_name")
+    parser.add_argument("--config", default="config/config.json")
+    parser.add_argument("--output", default="eval_results.jsonl")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum number of requests in flight")
+    parser.add_argument("--rate", type=float, default=2.0, help="maximum requests per second")
+    parser.add_argument("--iou-threshold", type=float, default=0.5)
+    parser.add_argument("--limit", type=int, default=None, help="only evaluate the first records")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as config_file:
+        config = json.load(config_file)
+    prompt_registry = PromptRegistry(config.get("prompt_dir", "prompt"))
+    base_prompt = prompt_registry.messages(args.prompt or config.get("prompt_name", "tabletop_en"))
+    records = load_dataset(args.dataset)[:args.limit]
+
+    backend = create_backend(dict({"model": config["model_name"], "pool_size": args.concurrency},
+                                  **config.get("mllm_backend", {})))
+    image_encoder = ImageEncoder.from_config(config.get("image_encoding", {}))
+    prompt_compiler = PromptCompiler(image_encoder,
+                                     backend.upload_image if config.get("upload_prompt_images", True) else None)
+    compiled_prompt = prompt_compiler.compile(base_prompt)
+    example_selector = None
+    if config.get("example_selection", {}).get("enabled", False):
+        example_selector = ExampleSelector.from_config(compiled_prompt.messages, config["example_selection"])
+
+    # encode (and upload) each distinct image once, before the timed requests
+    image_references = {}
+    for record in records:
+        if record["image"] not in image_references:
+            image_references[record["image"]] = prompt_compiler.reference(image_encoder.encode_file(record["image"]))
+
+    rate_limiter = RateLimiter(args.rate, burst=args.concurrency)
+    results = []
+    start = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor, open(args.output, "w") as output:
+            futures = [executor.submit(evaluate_record, backend, compiled_prompt, prompt_compiler, rate_limiter,
+                                       record, image_references[record["image"]], args.iou_threshold,
+                                       example_selector)
+                       for record in records]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                print("[{}/{}] {} {:.2f}s {}".format(len(results), len(records), result["id"], result["latency"],
+                                                     "error" if result["error"] else
+                                                     "success" if result["success"] else "fail"))
+    finally:
+        backend.close()
+
+    summary = summarize(results)
+    summary["wall_time"] = time.monotonic() - start
+    print(json.dumps(summary, indent=4))
+
+
+if __name__ == '__main__':
+    main()
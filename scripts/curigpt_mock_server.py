@@ -0,0 +1,449 @@
+"""
+CuriGPT Mock Server
+===========================
+Local stand-in for the remote endpoints of the CuriGPT loop, for offline load and latency testing on one machine:
+
+- the DashScope multimodal generation API (/api/v1/services/aigc/multimodal-generation/generation), with SSE,
+- the OpenAI chat completions (/v1/chat/completions, with SSE), audio transcription (/v1/audio/transcriptions) and
+  speech (/v1/audio/speech) APIs.
+
+Each endpoint has a configurable latency distribution and error injection. The MLLM answers are scene-aware: the
+image of the request is matched to the closest scene of config/mock_scenes.json by perceptual hash, and the answer
+grounds the objects named in the query with the bboxes of that scene. GET /stats returns the counts and latencies.
+
+To run the loop against the server, set in config/config.json:
+    "base_url": "http://127.0.0.1:8000/v1",
+    "mllm_backend": {"type": "dashscope", "base_url": "http://127.0.0.1:8000/api/v1", "api_key": "mock"},
+    "upload_prompt_images": false
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+from curigpt_ros.utils.scene_utils import difference_hash
+
+
+# Queries of the second grounding stage, see `locate_object`
+LOCATE_PATTERN = re.compile(r"Locate the (.+?) in the image")
+PLACE_VERBS = ("put", "place", "move", "放")
+# Roughly four characters per token, for the generation time and the usage counts
+CHARS_PER_TOKEN = 4
+
+
+class LatencyModel(object):
+    """Random latency in seconds.
+
+    The distribution is "fixed" (`median`), "uniform" (between `low` and `high`) or "lognormal" (`median` and the
+    log-space `sigma`, which gives the long tail of real endpoints); samples are clipped to [`low`, `high`].
+    """
+
+    def __init__(self, distribution="lognormal", median=0.5, sigma=0.3, low=0.0, high=None, rng=None):
+        if distribution not in ("fixed", "uniform", "lognormal"):
+            raise ValueError("Latency distribution must be one of fixed, uniform or lognormal.")
+        self.distribution = distribution
+        self.median = median
+        self.sigma = sigma
+        self.low = low
+        self.high = high
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def from_config(cls, config, rng=None):
+        return cls(distribution=config.get("distribution", "lognormal"), median=config.get("median", 0.5),
+                   sigma=config.get("sigma", 0.3), low=config.get("low", 0.0), high=config.get("high"), rng=rng)
+
+    def sample(self):
+        if self.distribution == "fixed":
+            latency = self.median
+        elif self.distribution == "uniform":
+            latency = self.rng.uniform(self.low, self.high if self.high is not None else 2 * self.median)
+        else:
+            latency = self.median * np.exp(self.rng.gauss(0.0, self.sigma))
+        latency = max(latency, self.low)
+        return min(latency, self.high) if self.high is not None else latency
+
+
+class Endpoint(object):
+    """Latency, error injection and statistics of one mocked endpoint.
+
+    Attributes:
+        latency (LatencyModel): The time to the first byte of the response.
+        tokens_per_second (float): The generation speed of the text responses, 0 for no generation time.
+        error_rate (float): The fraction of requests failed with one of the `error_status` codes.
+        malformed_rate (float): The fraction of JSON responses broken the way models do (MLLM endpoints only).
+    """
+
+    def __init__(self, name, latency, tokens_per_second=0.0, error_rate=0.0, error_status=(429, 500, 503),
+                 malformed_rate=0.0, rng=None, window=10000):
+        self.name = name
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.error_status = tuple(error_status)
+        self.malformed_rate = malformed_rate
+        self.rng = rng or random.Random()
+
+        self.requests = 0
+        self.errors = 0
+        self.malformed = 0
+        self._durations = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, name, config, rng=None):
+        return cls(name, LatencyModel.from_config(config.get("latency", {}), rng),
+                   tokens_per_second=config.get("tokens_per_second", 0.0), error_rate=config.get("error_rate", 0.0),
+                   error_status=config.get("error_status", (429, 500, 503)),
+                   malformed_rate=config.get("malformed_rate", 0.0), rng=rng)
+
+    def injected_error(self):
+        """Return the status code of an injected error for this request, or None."""
+        if self.rng.random() < self.error_rate:
+            return self.rng.choice(self.error_status)
+        return None
+
+    def generation_time(self, text):
+        if not self.tokens_per_second:
+            return 0.0
+        return len(text) / CHARS_PER_TOKEN / self.tokens_per_second
+
+    def record(self, duration, error=False, malformed=False):
+        with self._lock:
+            self.requests += 1
+            self.errors += error
+            self.malformed += malformed
+            self._durations.append(duration)
+
+    def stats(self):
+        with self._lock:
+            durations = np.array(self._durations) if self._durations else np.zeros(1)
+            return {"requests": self.requests, "errors": self.errors, "malformed": self.malformed,
+                    "p50": round(float(np.percentile(durations, 50)), 4),
+                    "p95": round(float(np.percentile(durations, 95)), 4),
+                    "p99": round(float(np.percentile(durations, 99)), 4)}
+
+
+def decode_image(reference):
+    """Decode the image of a request (a data URI or a local file) to grayscale, or None for remote URLs."""
+    if reference.startswith("data:"):
+        data = np.frombuffer(base64.b64decode(reference.split(",", 1)[1]), dtype=np.uint8)
+        return cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+    if reference.startswith(("http://", "https://", "oss://")):
+        return None
+    if reference.startswith("file://"):
+        reference = reference[len("file://"):]
+    return cv2.imread(reference, cv2.IMREAD_GRAYSCALE)
+
+
+def load_scenes(path):
+    """Load the mock scenes and the perceptual hash of their reference images."""
+    with open(path, "r") as file:
+        scenes = json.load(file)
+    for scene in scenes.values():
+        image = cv2.imread(scene["image"], cv2.IMREAD_GRAYSCALE) if scene.get("image") else None
+        scene["hash"] = difference_hash(image) if image is not None else None
+    return scenes
+
+
+class SceneResponder(object):
+    """Canned, scene-aware answers in the CuriGPT response format.
+
+    A query naming one object of the scene is answered with `grasp_and_give` on its bbox, a query naming two objects
+    with a placing verb with `grasp_and_place`, any other query with the scene description. A second-stage grounding
+    query gets the centered bbox of the crop, which the first stage centered on the object.
+    """
+
+    def __init__(self, scenes, default_scene=None, fixed_scene=None):
+        self.scenes = scenes
+        self.default_scene = default_scene or next(iter(scenes))
+        self.fixed_scene = fixed_scene
+
+    def match_scene(self, image_reference):
+        """Return the name of the scene closest to the image of the request."""
+        if self.fixed_scene is not None:
+            return self.fixed_scene
+        image = decode_image(image_reference) if image_reference else None
+        if image is None:
+            return self.default_scene
+        image_hash = difference_hash(image)
+        candidates = [(np.count_nonzero(image_hash != scene["hash"]), name)
+                      for name, scene in self.scenes.items() if scene["hash"] is not None]
+        return min(candidates)[1] if candidates else self.default_scene
+
+    @staticmethod
+    def find_objects(scene, query):
+        """Return the scene objects named in the query, in the order they are mentioned."""
+        lowered = query.lower()
+        mentions = []
+        for name, description in scene["objects"].items():
+            positions = [lowered.find(alias.lower()) for alias in [name] + description.get("aliases", [])]
+            positions = [position for position in positions if position >= 0]
+            if positions:
+                mentions.append((min(positions), name))
+        return [name for _, name in sorted(mentions)]
+
+    def answer(self, query, image_reference):
+        if LOCATE_PATTERN.search(query):
+            return json.dumps({"bbox_coordinates": [333, 333, 667, 667]})
+
+        scene = self.scenes[self.match_scene(image_reference)]
+        objects = self.find_objects(scene, query)
+        actions = None
+        if len(objects) >= 2 and any(verb in query.lower() for verb in PLACE_VERBS):
+            robot_response = scene["place"].format(object=objects[0], target=objects[-1])
+            actions = [{"action": "grasp_and_place", "parameters": {
+                "arg1": {"description": objects[0], "bbox_coordinates": scene["objects"][objects[0]]["bbox"]},
+                "arg2": {"description": objects[-1], "bbox_coordinates": scene["objects"][objects[-1]]["bbox"]}}}]
+        elif objects:
+            # the object to hand over is usually named last ("to clean the plate, give me the detergent")
+            robot_response = scene["give"].format(object=objects[-1])
+            actions = [{"action": "grasp_and_give", "parameters": {
+                "arg1": {"description": objects[-1], "bbox_coordinates": scene["objects"][objects[-1]]["bbox"]}}}]
+        else:
+            robot_response = scene["description"]
+
+        if scene.get("response_format", "json") == "text":
+            return robot_response
+        return json.dumps({"robot_response": robot_response, "robot_actions": actions}, indent=4,
+                          ensure_ascii=False)
+
+
+def malform(text, rng):
+    """Break a JSON response the way models do: a markdown code fence, a trailing comma, or a truncation."""
+    kind = rng.choice(["code_fence", "trailing_comma", "truncated"])
+    if kind == "code_fence":
+        return "```json\n{}\n```".format(text)
+    if kind == "trailing_comma":
+        return re.sub(r"(\S)(\s*)}$", r"\1,\2}", text)
+    return text[:len(text) * 2 // 3]
+
+
+def last_user_turn(messages):
+    """Return the text and the first image of the last user message, in the DashScope or the OpenAI format."""
+    for message in reversed(messages):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            return content, None
+        texts, image = [], None
+        for item in content or []:
+            if "text" in item:
+                texts.append(item["text"])
+            elif "image" in item and image is None:
+                image = item["image"]
+            elif "image_url" in item and image is None:
+                image = item["image_url"]["url"]
+        return "".join(texts), image
+    return "", None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoints
+    server_version = "CuriGPTMock/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(MockHandler, self).log_message(format, *args)
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/stats":
+            self._send_json(200, {name: endpoint.stats() for name, endpoint in self.server.endpoints.items()})
+        else:
+            self._send_json(404, {"error": {"code": "NotFound", "message": self.path}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0]
+        routes = [
+            ("/services/aigc/multimodal-generation/generation", "mllm", self._dashscope_generation),
+            ("/chat/completions", "chat", self._chat_completion),
+            ("/audio/transcriptions", "transcription", self._transcription),
+            ("/audio/speech", "speech", self._speech),
+        ]
+        for suffix, name, handle in routes:
+            if path.endswith(suffix):
+                break
+        else:
+            self._send_json(404, {"error": {"code": "NotFound", "message": path}})
+            return
+
+        endpoint = self.server.endpoints[name]
+        start = time.monotonic()
+        status = endpoint.injected_error()
+        if status is not None:
+            error = {"code": "MockError", "message": "Injected error {}".format(status)}
+            # the DashScope error body is flat, the OpenAI one is wrapped
+            self._send_json(status, error if name == "mllm" else {"error": error})
+            endpoint.record(time.monotonic() - start, error=True)
+            return
+        malformed = handle(endpoint, body)
+        endpoint.record(time.monotonic() - start, malformed=bool(malformed))
+
+    def _respond_text(self, endpoint, query, image):
+        """Return the answer to a query, maybe malformed, and whether it was malformed."""
+        text = self.server.responder.answer(query, image)
+        if text.startswith("{") and endpoint.rng.random() < endpoint.malformed_rate:
+            return malform(text, endpoint.rng), True
+        return text, False
+
+    def _dashscope_generation(self, endpoint, body):
+        request = json.loads(body)
+        query, image = last_user_turn(request["input"]["messages"])
+        text, malformed = self._respond_text(endpoint, query, image)
+        request_id = str(uuid.uuid4())
+        usage = {"input_tokens": len(body) // CHARS_PER_TOKEN, "output_tokens": len(text) // CHARS_PER_TOKEN}
+
+        def output(chunk, finish_reason):
+            return {"output": {"choices": [{"finish_reason": finish_reason, "message": {
+                "role": "assistant", "content": [{"text": chunk}]}}]}, "usage": usage, "request_id": request_id}
+
+        time.sleep(endpoint.latency.sample())
+        if self.headers.get("X-DashScope-SSE") == "enable":
+            events = ["id:{}\nevent:result\ndata:{}\n\n".format(index, json.dumps(output(chunk, "null"),
+                                                                                   ensure_ascii=False))
+                      for index, chunk in enumerate(self._chunks(text))]
+            events.append("id:{}\nevent:result\ndata:{}\n\n".format(len(events), json.dumps(output("", "stop"))))
+            self._send_events(endpoint, events)
+        else:
+            time.sleep(endpoint.generation_time(text))
+            self._send_json(200, output(text, "stop"))
+        return malformed
+
+    def _chat_completion(self, endpoint, body):
+        request = json.loads(body)
+        query, image = last_user_turn(request["messages"])
+        text, malformed = self._respond_text(endpoint, query, image)
+        completion_id = "chatcmpl-{}".format(uuid.uuid4().hex)
+        model = request.get("model", "mock")
+
+        time.sleep(endpoint.latency.sample())
+        if request.get("stream"):
+            def chunk(delta, finish_reason):
+                return "data: {}\n\n".format(json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]},
+                    ensure_ascii=False))
+            events = [chunk({"role": "assistant", "content": piece}, None) for piece in self._chunks(text)]
+            events += [chunk({}, "stop"), "data: [DONE]\n\n"]
+            self._send_events(endpoint, events)
+        else:
+            time.sleep(endpoint.generation_time(text))
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(body) // CHARS_PER_TOKEN,
+                          "completion_tokens": len(text) // CHARS_PER_TOKEN,
+                          "total_tokens": (len(body) + len(text)) // CHARS_PER_TOKEN}})
+        return malformed
+
+    def _transcription(self, endpoint, body):
+        # the uploaded audio is ignored, the transcripts are replayed in turn
+        with self.server.lock:
+            transcript = self.server.transcripts[self.server.transcript_index % len(self.server.transcripts)]
+            self.server.transcript_index += 1
+        time.sleep(endpoint.latency.sample())
+        self._send_json(200, {"text": transcript})
+
+    def _speech(self, endpoint, body):
+        time.sleep(endpoint.latency.sample() + endpoint.generation_time(json.loads(body).get("input", "")))
+        self._send_bytes(200, self.server.speech_audio, "audio/mpeg")
+
+    @staticmethod
+    def _chunks(text, size=CHARS_PER_TOKEN * 2):
+        return [text[start:start + size] for start in range(0, len(text), size)] or [""]
+
+    def _send_bytes(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status, data):
+        self._send_bytes(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def _send_events(self, endpoint, events):
+        """Send server-sent events with chunked transfer encoding, paced at the generation speed."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in events:
+            data = event.encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+            time.sleep(endpoint.generation_time(" " * CHARS_PER_TOKEN * 2))
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, endpoints, responder, transcripts, speech_audio, verbose=False):
+        super(MockServer, self).__init__(address, MockHandler)
+        self.endpoints = endpoints
+        self.responder = responder
+        self.transcripts = transcripts
+        self.speech_audio = speech_audio
+        self.verbose = verbose
+        self.transcript_index = 0
+        self.lock = threading.Lock()
+
+
+# Endpoint defaults in the range of the remote services
+DEFAULT_ENDPOINTS = {
+    "mllm": {"latency": {"distribution": "lognormal", "median": 1.5, "sigma": 0.4}, "tokens_per_second": 40},
+    "chat": {"latency": {"distribution": "lognormal", "median": 0.6, "sigma": 0.3}, "tokens_per_second": 60},
+    "transcription": {"latency": {"distribution": "lognormal", "median": 0.8, "sigma": 0.3}},
+    "speech": {"latency": {"distribution": "lognormal", "median": 0.5, "sigma": 0.3}, "tokens_per_second": 200},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config/config.json", help="config file with a mock_server section")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--scene", default=None, help="always answer for this scene instead of matching the image")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as config_file:
+        config = json.load(config_file).get("mock_server", {})
+
+    rng = random.Random(args.seed)
+    endpoints = {name: Endpoint.from_config(name, dict(defaults, **config.get("endpoints", {}).get(name, {})), rng)
+                 for name, defaults in DEFAULT_ENDPOINTS.items()}
+    scenes = load_scenes(config.get("scenes", "config/mock_scenes.json"))
+    responder = SceneResponder(scenes, config.get("default_scene"), args.scene)
+    transcripts = config.get("transcripts", ["hey CURI, what do you see right now?"])
+    with open(config.get("speech_file", "assets/chat_audio/curigpt_output.mp3"), "rb") as file:
+        speech_audio = file.read()
+
+    address = (args.host or config.get("host", "127.0.0.1"), args.port or config.get("port", 8000))
+    server = MockServer(address, endpoints, responder, transcripts, speech_audio, verbose=args.verbose)
+    print("Mock server listening on http://{}:{} with scenes {}".format(address[0], address[1], sorted(scenes)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps({name: endpoint.stats() for name, endpoint in endpoints.items()}, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -70,13 +70,14 @@ class AudioAssistant:
         print("Transcription:", transcription.text)
         return transcription.text
 
-    def generate_response(self, text):
+    def generate_response(self, text, model="gpt-3.5-turbo", system_prompt=None):
         '''
-        Generate a response using OpenAI's GPT-3.5 model
+        Generate a text-only response using OpenAI's chat models (GPT-3.5 by default)
         '''
+        messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
         response = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": text}]
+            model=model,
+            messages=messages + [{"role": "user", "content": text}]
         )
         print(response)
         return response.choices[0].message.content.strip()
@@ -0,0 +1,108 @@
+"""
+Conversation History
+===========================
+Bounded multi-turn history for the multimodal reasoning prompt: a sliding window of past turns under a token budget,
+where only the latest images are resent and older ones are replaced by short text summaries.
+"""
+
+import json
+from collections import deque, namedtuple
+
+from curigpt_ros.models.response_parser import parse_response, ResponseError
+
+
+# A past turn: the user query, the reference of its image, and the response text.
+Turn = namedtuple("Turn", ["query", "image", "response"])
+
+
+def estimate_tokens(text):
+    """Rough token count of a text: one token per CJK character, one per four other characters."""
+    cjk = sum(1 for char in text if "\u2e80" <= char <= "\u9fff" or "\uf900" <= char <= "\ufaff")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def summarize_response(response):
+    """Summarize a response for an old turn: the verbal response and the names and objects of the actions."""
+    try:
+        plan = parse_response(response)
+    except ResponseError:
+        return response
+    actions = ["{}({})".format(action.action, ", ".join(str(argument.description)
+                                                         for argument in action.arguments.values()))
+               for action in plan.actions]
+    return json.dumps({"robot_response": plan.robot_response, "robot_actions": actions or None}, ensure_ascii=False)
+
+
+class ConversationHistory(object):
+    """Sliding window of past turns appended to the base prompt in multi-turn mode.
+
+    The window holds at most `max_turns` turns and is trimmed from the oldest turn until its estimated size is below
+    `max_tokens`. Only the images of the latest `keep_images` turns with an image are sent; the older ones refer to
+    their image in text, in the `language` of the prompt, and their responses are summarized (actions without bboxes),
+    since the current image supersedes them anyway. Text-only turns (e.g. routed to the chat model) are sent as they
+    were.
+    """
+
+    # the text replacing the image of an old turn, by prompt language
+    IMAGE_OMITTED = {
+        "en": "(earlier camera image omitted)",
+        "zh": "（之前的相机图像已省略）",
+    }
+
+    def __init__(self, max_turns=6, max_tokens=4000, keep_images=1, image_tokens=1000, language="en"):
+        if language not in self.IMAGE_OMITTED:
+            raise ValueError("Language must be one of {}.".format(sorted(self.IMAGE_OMITTED)))
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.keep_images = keep_images
+        self.image_tokens = image_tokens
+        self.language = language
+        self.turns = deque()
+
+    @classmethod
+    def from_config(cls, config, language="en"):
+        """Create a history for a prompt language from the "conversation_history" section of the config."""
+        return cls(max_turns=config.get("max_turns", 6), max_tokens=config.get("max_tokens", 4000),
+                   keep_images=config.get("keep_images", 1), image_tokens=config.get("image_tokens", 1000),
+                   language=language)
+
+    def add_turn(self, query, image, response):
+        """Append a completed turn and trim the window to the budget."""
+        self.turns.append(Turn(query, image, response))
+        while len(self.turns) > self.max_turns:
+            self.turns.popleft()
+        while self.turns and self.tokens() > self.max_tokens:
+            self.turns.popleft()
+
+    def clear(self):
+        self.turns.clear()
+
+    def messages(self):
+        """Return the history as prompt messages, oldest turn first."""
+        messages = []
+        image_turns = [index for index, turn in enumerate(self.turns) if turn.image is not None]
+        kept_images = set(image_turns[len(image_turns) - self.keep_images:]) if self.keep_images > 0 else set()
+        for index, turn in enumerate(self.turns):
+            if turn.image is None:
+                messages.append({"role": "user", "content": [{"text": turn.query}]})
+                messages.append({"role": "assistant", "content": [{"text": turn.response}]})
+            elif index in kept_images:
+                messages.append({"role": "user", "content": [{"image": turn.image}, {"text": turn.query}]})
+                messages.append({"role": "assistant", "content": [{"text": turn.response}]})
+            else:
+                query = "{} {}".format(self.IMAGE_OMITTED[self.language], turn.query)
+                messages.append({"role": "user", "content": [{"text": query}]})
+                messages.append({"role": "assistant", "content": [{"text": summarize_response(turn.response)}]})
+        return messages
+
+    def tokens(self):
+        """Return the estimated token count of the history messages."""
+        tokens = 0
+        for message in self.messages():
+            for item in message["content"]:
+                tokens += self.image_tokens if "image" in item else estimate_tokens(item["text"])
+        return tokens
+
+    def size_bytes(self):
+        """Return the size in bytes of the serialized history messages, without the image data."""
+        return len(json.dumps(self.messages(), ensure_ascii=False).encode("utf-8"))
@@ -0,0 +1,90 @@
+"""
+Example Selector
+===========================
+Retrieval-based few-shot example selection: index the example turns of the prompt with TF-IDF vectors of character
+n-grams (which work for English and Chinese alike) and send only the examples most similar to the current query,
+within a token budget, instead of all of them with every request.
+"""
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from curigpt_ros.models.conversation import estimate_tokens
+
+
+def _text(message):
+    return " ".join(item["text"] for item in message["content"] if "text" in item)
+
+
+def _tokens(message, image_tokens):
+    return sum(image_tokens if "image" in item else estimate_tokens(item.get("text", ""))
+               for item in message["content"])
+
+
+class ExampleSelector(object):
+    """Select the few-shot examples of a prompt by similarity to the query.
+
+    The prompt is split into the messages always sent (the system message and any unpaired message) and the examples,
+    each a user message with the assistant response after it. An example is indexed by the text of its user message.
+    The `k` most similar examples are selected, most similar first, as long as they fit in `max_tokens`, but at least
+    the most similar one, so that the model always sees the response format. They are sent in their prompt order.
+    """
+
+    def __init__(self, messages, k=2, max_tokens=3000, image_tokens=1000, ngram_range=(2, 4)):
+        self.k = k
+        self.max_tokens = max_tokens
+        self.fixed = []
+        self.examples = []
+        index = 0
+        while index < len(messages):
+            message = messages[index]
+            if (message["role"] == "user" and index + 1 < len(messages)
+                    and messages[index + 1]["role"] == "assistant"):
+                self.examples.append((message, messages[index + 1]))
+                index += 2
+            else:
+                self.fixed.append(message)
+                index += 1
+        self.example_tokens = [_tokens(user, image_tokens) + _tokens(assistant, image_tokens)
+                               for user, assistant in self.examples]
+
+        self.vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=tuple(ngram_range), sublinear_tf=True,
+                                          lowercase=True)
+        self.vectors = self.vectorizer.fit_transform([_text(user) for user, _ in self.examples]) \
+            if self.examples else None
+
+    @classmethod
+    def from_config(cls, messages, config):
+        """Create a selector for the prompt messages from the "example_selection" section of the config."""
+        return cls(messages, k=config.get("k", 2), max_tokens=config.get("max_tokens", 3000),
+                   image_tokens=config.get("image_tokens", 1000))
+
+    def select_indices(self, query):
+        """Return the indices of the selected examples, in prompt order."""
+        similarity = self.similarities(query)
+        ranking = sorted(range(len(self.examples)), key=lambda index: (-similarity[index], index))
+
+        selected = []
+        tokens = 0
+        for index in ranking[:self.k]:
+            if selected and tokens + self.example_tokens[index] > self.max_tokens:
+                continue
+            selected.append(index)
+            tokens += self.example_tokens[index]
+        return sorted(selected)
+
+    def messages(self, indices):
+        """Return the prompt messages with only the given examples."""
+        selected = [message for index in indices for message in self.examples[index]]
+        return self.fixed + selected
+
+    def select(self, query):
+        """Return the prompt messages with the examples selected for the query."""
+        return self.messages(self.select_indices(query))
+
+    def similarities(self, query):
+        """Return the cosine similarity of the query to each example."""
+        if not self.examples:
+            return np.zeros(0)
+        # the rows are L2-normalized, so the dot product is the cosine similarity
+        return (self.vectors @ self.vectorizer.transform([query]).T).toarray().ravel()
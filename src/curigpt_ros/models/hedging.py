@@ -0,0 +1,123 @@
+"""
+Hedged Requests
+===========================
+Hedge slow reasoning calls: if the primary model has not answered by a latency percentile deadline, send the same
+request to a secondary model and take whichever valid response arrives first.
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from curigpt_ros.models.mllm_backends import create_backend
+from curigpt_ros.models.response_parser import parse_response, ResponseError
+
+
+def is_valid_response(response):
+    """Default response validation: the response is a valid CuriGPT plan, see `parse_response`."""
+    if not response.ok:
+        return False
+    try:
+        parse_response(response.text)
+    except ResponseError:
+        return False
+    return True
+
+
+class HedgedBackend(object):
+    """Reasoning backend hedging a primary backend with a secondary one, with the `MLLMBackend` call interface.
+
+    The hedge deadline is the `percentile` of the recent primary latencies (`default_deadline` until `min_samples`
+    latencies were observed). A primary response that fails or does not validate triggers the hedge immediately.
+    The first valid response wins; the other request is abandoned and its result discarded (a blocking HTTP request
+    cannot be interrupted, but it no longer delays the turn). Streaming calls are not hedged.
+
+    Attributes:
+        metrics (dict): Counts of the calls, the hedged calls, the wins of either backend and the failures.
+    """
+
+    def __init__(self, primary, secondary, percentile=95, min_samples=20, default_deadline=4.0, window=100,
+                 validate=is_valid_response):
+        self.primary = primary
+        self.secondary = secondary
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_deadline = default_deadline
+        self.validate = validate
+
+        self.metrics = {"calls": 0, "hedged": 0, "primary_wins": 0, "secondary_wins": 0, "failed": 0}
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hedged_call")
+
+    @classmethod
+    def from_config(cls, primary, config, validate=is_valid_response):
+        """Create a hedged backend from the "hedging" section of the config, with the "secondary" backend settings."""
+        return cls(primary, create_backend(config["secondary"]), percentile=config.get("percentile", 95),
+                   min_samples=config.get("min_samples", 20), default_deadline=config.get("default_deadline", 4.0),
+                   validate=validate)
+
+    @property
+    def model(self):
+        return self.primary.model
+
+    @property
+    def deadline(self):
+        """The current hedge deadline in seconds."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.default_deadline
+            return float(np.percentile(self._latencies, self.percentile))
+
+    def _record_primary(self, future):
+        response = future.result()
+        if response.ok:
+            with self._lock:
+                self._latencies.append(response.latency)
+
+    def call(self, messages, **parameters):
+        """Run one multimodal completion, hedged. See `MLLMBackend.call`."""
+        self.metrics["calls"] += 1
+        primary = self._executor.submit(self.primary.call, messages, **parameters)
+        primary.add_done_callback(self._record_primary)
+
+        done, _ = wait([primary], timeout=self.deadline)
+        if done and self.validate(primary.result()):
+            self.metrics["primary_wins"] += 1
+            return primary.result()
+
+        self.metrics["hedged"] += 1
+        print("Hedging the reasoning call with {}".format(self.secondary.model))
+        secondary = self._executor.submit(self.secondary.call, messages, **parameters)
+        pending = {primary, secondary}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if self.validate(future.result()):
+                    for other in pending:
+                        other.cancel()
+                    self.metrics["primary_wins" if future is primary else "secondary_wins"] += 1
+                    return future.result()
+
+        self.metrics["failed"] += 1
+        return primary.result()
+
+    def stream(self, messages, **parameters):
+        return self.primary.stream(messages, **parameters)
+
+    def upload_image(self, path):
+        # the uploaded image must be usable by both backends, e.g. two models of the same provider
+        return self.primary.upload_image(path)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.primary.close()
+        self.secondary.close()
+
+    def stats(self):
+        """Return the hedging metrics as a printable string."""
+        metrics = self.metrics
+        return ("hedging: {calls} calls, {hedged} hedged, {primary_wins} primary wins, {secondary_wins} secondary "
+                "wins, {failed} failed, deadline {deadline:.2f}s").format(deadline=self.deadline, **metrics)
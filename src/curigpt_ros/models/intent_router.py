@@ -0,0 +1,111 @@
+"""
+Intent Router
+===========================
+Fast on-device routing of a transcribed query: pure conversation goes to a text-only chat model, questions about the
+scene go to the vision model without the grounding examples, and action requests go to the full grounding prompt.
+"""
+
+import json
+import os
+import re
+import time
+from collections import namedtuple
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+
+
+CHAT = "chat"
+SCENE = "scene"
+ACTION = "action"
+INTENTS = (CHAT, SCENE, ACTION)
+
+# A routing decision: the intent, the classifier confidence, and what decided it ("force", "override",
+# "classifier" or "fallback").
+Route = namedtuple("Route", ["intent", "confidence", "source"])
+
+
+class IntentRouter(object):
+    """Classify queries into `INTENTS` with a small TF-IDF + logistic regression model trained at startup.
+
+    The model is trained on labeled example queries; character n-grams make it work for English and Chinese alike.
+    A decision below `min_confidence` falls back to `default` (the full grounding prompt, which handles every intent,
+    only slower). A CHAT decision needs `chat_min_confidence`, since the chat path sends no camera image: a question
+    about the scene misrouted to it gets a wrong answer without any error. `overrides` are (regex, intent) pairs
+    checked before the classifier, and `force` routes every query to one intent. Each decision is printed and, with
+    `log_path`, appended to a JSONL log.
+    """
+
+    def __init__(self, examples, min_confidence=0.5, default=ACTION, overrides=None, force=None, log_path=None,
+                 chat_min_confidence=0.8):
+        for intent in [default, force] + [intent for _, intent in overrides or []]:
+            if intent is not None and intent not in INTENTS:
+                raise ValueError("Intent must be one of {}, got {!r}.".format(INTENTS, intent))
+        self.min_confidence = min_confidence
+        self.chat_min_confidence = chat_min_confidence
+        self.default = default
+        self.overrides = [(re.compile(pattern, re.IGNORECASE), intent) for pattern, intent in overrides or []]
+        self.force = force
+        self.log_path = log_path
+
+        queries = [query for intent in INTENTS for query in examples.get(intent, [])]
+        labels = [intent for intent in INTENTS for _ in examples.get(intent, [])]
+        self.model = make_pipeline(TfidfVectorizer(analyzer="char_wb", ngram_range=(1, 3), sublinear_tf=True),
+                                   LogisticRegression(C=10.0, max_iter=1000))
+        self.model.fit(queries, labels)
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a router from the "intent_routing" section of the config."""
+        with open(config.get("examples", "config/intent_examples.json"), "r", encoding="utf-8") as file:
+            examples = json.load(file)
+        return cls(examples, min_confidence=config.get("min_confidence", 0.5), default=config.get("default", ACTION),
+                   overrides=config.get("overrides"), force=config.get("force"), log_path=config.get("log_path"),
+                   chat_min_confidence=config.get("chat_min_confidence", 0.8))
+
+    def classify(self, query):
+        """Return the probability of each intent for a query."""
+        probabilities = self.model.predict_proba([query])[0]
+        return dict(zip(self.model.classes_, probabilities))
+
+    def route(self, query):
+        """
+        Route a query.
+
+        Parameters:
+            query (str): The transcribed query.
+
+        Returns:
+            Route: The routing decision.
+        """
+        scores = {}
+        if self.force is not None:
+            route = Route(self.force, 1.0, "force")
+        else:
+            for pattern, intent in self.overrides:
+                if pattern.search(query):
+                    route = Route(intent, 1.0, "override")
+                    break
+            else:
+                scores = self.classify(query)
+                intent = str(max(scores, key=scores.get))
+                threshold = self.chat_min_confidence if intent == CHAT else self.min_confidence
+                if scores[intent] >= threshold:
+                    route = Route(intent, float(scores[intent]), "classifier")
+                else:
+                    route = Route(self.default, float(scores[intent]), "fallback")
+        self._log(query, route, scores)
+        return route
+
+    def _log(self, query, route, scores):
+        print("Intent: {} ({}, confidence {:.2f})".format(route.intent, route.source, route.confidence))
+        if self.log_path is None:
+            return
+        directory = os.path.dirname(self.log_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        entry = {"time": time.time(), "query": query, "intent": route.intent, "confidence": route.confidence,
+                 "source": route.source, "scores": {intent: round(float(score), 4) for intent, score in scores.items()}}
+        with open(self.log_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(entry, ensure_ascii=False) + "\n")
@@ -0,0 +1,331 @@
+"""
+MLLM Backends
+===========================
+Pluggable multimodal reasoning backends (DashScope, OpenAI-compatible servers, a local stand-in) behind one
+interface, each owning a persistent keep-alive HTTP session so that consecutive turns reuse the TLS connection.
+
+Messages use the DashScope multimodal format, a list of {"role": ..., "content": [{"image": ...}, {"text": ...}]},
+where an image is a URL (http(s):// or oss://) or a local file path, which is sent inline base64-encoded.
+"""
+
+import base64
+import json
+import mimetypes
+import os
+import time
+from collections import namedtuple
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class MLLMResponse(namedtuple("MLLMResponse", ["text", "model", "status_code", "error", "latency", "raw"])):
+    """Uniform response of a backend call: the response text, or the error if the call failed."""
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+@lru_cache(maxsize=32)
+def _data_uri(path, mtime):
+    mime_type = mimetypes.guess_type(path)[0] or "image/png"
+    with open(path, "rb") as file:
+        return "data:{};base64,{}".format(mime_type, base64.b64encode(file.read()).decode("ascii"))
+
+
+def image_to_data_uri(path):
+    """Return a local image as a base64 data URI, cached until the file changes."""
+    if path.startswith("file://"):
+        path = path[len("file://"):]
+    return _data_uri(path, os.path.getmtime(path))
+
+
+def _is_url(image):
+    return image.startswith(("http://", "https://", "oss://", "data:"))
+
+
+def inline_local_images(messages):
+    """Return a copy of DashScope multimodal messages with the local image files replaced by data URIs."""
+    inlined = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, list):
+            content = [dict(item, image=image_to_data_uri(item["image"]))
+                       if "image" in item and not _is_url(item["image"]) else item for item in content]
+        inlined.append(dict(message, content=content))
+    return inlined
+
+
+def _content_text(content):
+    """Join the text items of a DashScope or OpenAI message content."""
+    if isinstance(content, str):
+        return content
+    return "".join(item.get("text", "") for item in content or [] if isinstance(item, dict))
+
+
+def iter_sse_data(response):
+    """Yield the data payloads of a server-sent events response."""
+    for line in response.iter_lines(decode_unicode=True):
+        if line and line.startswith("data:"):
+            yield line[len("data:"):].strip()
+
+
+class MLLMBackend(object):
+    """Base class of the reasoning backends.
+
+    Subclasses implement `_request` (build the URL, headers and JSON body of a call) and `_parse` / `_parse_chunk`
+    (extract the text of a response / stream event). The backend keeps a `requests.Session` with a pooled,
+    keep-alive `HTTPAdapter` for all of its calls.
+
+    Attributes:
+        model (str): The model name sent to the server.
+        timeout (tuple): The (connect, read) timeouts in seconds.
+    """
+
+    def __init__(self, model, api_key=None, base_url=None, timeout=(5.0, 60.0), pool_size=4, max_retries=2,
+                 parameters=None):
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/") if base_url else base_url
+        self.timeout = tuple(timeout) if isinstance(timeout, (list, tuple)) else timeout
+        self.parameters = parameters or {}
+
+        # retry only failed connections and throttling/unavailable responses, never a completed generation
+        retry = Retry(total=max_retries, connect=max_retries, read=0, backoff_factor=0.5,
+                      status_forcelist=(429, 502, 503), allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def call(self, messages, **parameters):
+        """
+        Run one multimodal completion.
+
+        Parameters:
+            messages (list): The messages in the DashScope multimodal format.
+            **parameters: Sampling parameters overriding the configured ones (e.g. top_p, top_k).
+
+        Returns:
+            MLLMResponse: The response.
+        """
+        url, headers, body = self._request(messages, dict(self.parameters, **parameters), stream=False)
+        start = time.monotonic()
+        try:
+            http_response = self.session.post(url, headers=headers, json=body, timeout=self.timeout)
+            data = http_response.json()
+        except (requests.RequestException, ValueError) as e:
+            return MLLMResponse(None, self.model, None, str(e), time.monotonic() - start, None)
+
+        latency = time.monotonic() - start
+        if http_response.status_code != 200:
+            return MLLMResponse(None, self.model, http_response.status_code, self._error_message(data), latency, data)
+        try:
+            text = self._parse(data)
+        except (KeyError, IndexError, TypeError) as e:
+            return MLLMResponse(None, self.model, http_response.status_code, "Malformed response: {}".format(e),
+                                latency, data)
+        return MLLMResponse(text, self.model, http_response.status_code, None, latency, data)
+
+    def stream(self, messages, **parameters):
+        """
+        Run one multimodal completion as a stream.
+
+        Yields:
+            str: The text chunks as they are generated.
+
+        Raises:
+            RuntimeError: If the call fails.
+        """
+        url, headers, body = self._request(messages, dict(self.parameters, **parameters), stream=True)
+        try:
+            with self.session.post(url, headers=headers, json=body, timeout=self.timeout, stream=True) as response:
+                if response.status_code != 200:
+                    raise RuntimeError("{} {}".format(response.status_code, response.text))
+                for data in iter_sse_data(response):
+                    if data == "[DONE]":
+                        return
+                    try:
+                        chunk = self._parse_chunk(json.loads(data))
+                    except (ValueError, KeyError, IndexError, TypeError) as e:
+                        raise RuntimeError("Malformed stream event {!r}: {}".format(data, e))
+                    if chunk:
+                        yield chunk
+        except requests.RequestException as e:
+            raise RuntimeError(str(e))
+
+    def upload_image(self, path):
+        """Upload a local image and return a URL referencing it, or None if the backend has no image storage."""
+        return None
+
+    def close(self):
+        self.session.close()
+
+    def _request(self, messages, parameters, stream):
+        raise NotImplementedError
+
+    def _parse(self, data):
+        raise NotImplementedError
+
+    def _parse_chunk(self, data):
+        raise NotImplementedError
+
+    @staticmethod
+    def _error_message(data):
+        if isinstance(data, dict):
+            error = data.get("error", data)
+            if isinstance(error, dict):
+                return "{}: {}".format(error.get("code"), error.get("message"))
+        return str(data)
+
+
+class DashScopeBackend(MLLMBackend):
+    """Qwen-VL models through the native DashScope multimodal generation HTTP API.
+
+    The default sampling parameters of a model are taken from `MODEL_PARAMETERS`, and the configured "parameters"
+    override them. The API key is the configured one, or the DASHSCOPE_API_KEY environment variable.
+    """
+
+    # the per-model sampling parameters of the SDK calls this backend replaces
+    MODEL_PARAMETERS = {
+        "qwen-vl-chat-v1": {"top_p": 0.9, "top_k": 100},
+    }
+
+    def __init__(self, model="qwen-vl-max", api_key=None, base_url="https://dashscope.aliyuncs.com/api/v1", **kwargs):
+        if api_key is None:
+            api_key = os.environ.get("DASHSCOPE_API_KEY")
+        if not api_key:
+            raise ValueError("No DashScope API key: set DASHSCOPE_API_KEY or the mllm_backend api_key in the config.")
+        super(DashScopeBackend, self).__init__(model, api_key, base_url, **kwargs)
+        self.parameters = dict(self.MODEL_PARAMETERS.get(model, {}), **self.parameters)
+
+    def _request(self, messages, parameters, stream):
+        headers = {"Authorization": "Bearer {}".format(self.api_key)}
+        if any(isinstance(item, dict) and item.get("image", "").startswith("oss://")
+               for message in messages for item in message["content"]):
+            headers["X-DashScope-OssResourceResolve"] = "enable"
+        if stream:
+            headers["X-DashScope-SSE"] = "enable"
+            parameters = dict(parameters, incremental_output=True)
+
+        body = {"model": self.model, "input": {"messages": inline_local_images(messages)}, "parameters": parameters}
+        return self.base_url + "/services/aigc/multimodal-generation/generation", headers, body
+
+    def _parse(self, data):
+        return _content_text(data["output"]["choices"][0]["message"]["content"])
+
+    def _parse_chunk(self, data):
+        if "output" not in data:
+            raise RuntimeError(self._error_message(data))
+        return _content_text(data["output"]["choices"][0]["message"]["content"])
+
+    def upload_image(self, path):
+        """Upload a local image to the DashScope temporary storage (valid for 48 hours) and return its oss:// URL."""
+        from dashscope.utils.oss_utils import OssUtils
+        return OssUtils.upload(model=self.model, file_path=path, api_key=self.api_key)
+
+
+class OpenAICompatibleBackend(MLLMBackend):
+    """Vision models behind an OpenAI-compatible chat completions API (OpenAI, vLLM, Ollama, LM Studio, ...)."""
+
+    def __init__(self, model, api_key=None, base_url="https://api.openai.com/v1", **kwargs):
+        super(OpenAICompatibleBackend, self).__init__(model, api_key, base_url, **kwargs)
+
+    @staticmethod
+    def convert_messages(messages):
+        """Convert DashScope multimodal messages to OpenAI chat messages."""
+        converted = []
+        for message in inline_local_images(messages):
+            if message["role"] != "user" or isinstance(message["content"], str):
+                # system and assistant messages only carry text
+                converted.append({"role": message["role"], "content": _content_text(message["content"])})
+                continue
+            content = []
+            for item in message["content"]:
+                if "image" in item:
+                    content.append({"type": "image_url", "image_url": {"url": item["image"]}})
+                elif "text" in item:
+                    content.append({"type": "text", "text": item["text"]})
+            converted.append({"role": message["role"], "content": content})
+        return converted
+
+    def _request(self, messages, parameters, stream):
+        headers = {"Authorization": "Bearer {}".format(self.api_key)} if self.api_key else {}
+        body = dict(parameters, model=self.model, messages=self.convert_messages(messages), stream=stream)
+        return self.base_url + "/chat/completions", headers, body
+
+    def _parse(self, data):
+        return _content_text(data["choices"][0]["message"]["content"])
+
+    def _parse_chunk(self, data):
+        if "choices" not in data:
+            raise RuntimeError(self._error_message(data))
+        if not data["choices"]:
+            return ""
+        return data["choices"][0].get("delta", {}).get("content") or ""
+
+
+class LocalBackend(MLLMBackend):
+    """Offline stand-in returning canned responses, for running the pipeline without a model server.
+
+    The responses are read from a JSON file mapping query substrings to responses; the first matching entry (in file
+    order) is returned, or the "default" entry.
+    """
+
+    def __init__(self, model="local", responses_path=None, latency=0.0, **kwargs):
+        super(LocalBackend, self).__init__(model, **kwargs)
+        self.latency = latency
+        self.responses = {"default": {"robot_response": "I am running without a reasoning model.",
+                                      "robot_actions": None}}
+        if responses_path is not None:
+            with open(responses_path, "r") as file:
+                self.responses = json.load(file)
+
+    def _respond(self, messages):
+        query = _content_text(messages[-1]["content"]).lower() if messages else ""
+        for pattern, response in self.responses.items():
+            if pattern != "default" and pattern.lower() in query:
+                break
+        else:
+            response = self.responses.get("default")
+        time.sleep(self.latency)
+        return response if isinstance(response, str) else json.dumps(response, indent=4)
+
+    def call(self, messages, **parameters):
+        start = time.monotonic()
+        return MLLMResponse(self._respond(messages), self.model, 200, None, time.monotonic() - start, None)
+
+    def stream(self, messages, **parameters):
+        text = self._respond(messages)
+        for start in range(0, len(text), 16):
+            yield text[start:start + 16]
+
+
+BACKENDS = {
+    "dashscope": DashScopeBackend,
+    "openai": OpenAICompatibleBackend,
+    "local": LocalBackend,
+}
+
+
+def create_backend(config):
+    """
+    Create a reasoning backend from the "mllm_backend" section of the config.
+
+    Parameters:
+        config (dict): The backend "type" (see `BACKENDS`) and its keyword arguments, e.g. "model", "api_key",
+            "base_url", "timeout", "pool_size" and "parameters".
+
+    Returns:
+        MLLMBackend: The backend.
+    """
+    config = dict(config)
+    backend_type = config.pop("type", "dashscope")
+    if backend_type not in BACKENDS:
+        raise ValueError("Backend type must be one of {}.".format(sorted(BACKENDS)))
+    return BACKENDS[backend_type](**config)
@@ -0,0 +1,156 @@
+"""
+Prompt Compiler
+===========================
+Compile the few-shot multimodal prompt once at startup: encode and upload each distinct example image once, and
+reference it by URL in all later requests instead of resending the local files.
+"""
+
+import json
+import os
+from collections import namedtuple, OrderedDict
+
+from curigpt_ros.models.response_cache import prompt_hash
+
+
+# A compiled prompt prefix. `version` identifies the prompt text and image contents, `text_bytes` and `image_bytes`
+# are the size of the prefix payload per request, and `raw_image_bytes` the image payload before compilation.
+CompiledPrompt = namedtuple("CompiledPrompt", ["messages", "version", "text_bytes", "image_bytes", "raw_image_bytes"])
+
+
+def is_local_image(image):
+    """Whether an image reference is a local file (uploaded by the SDK on every request) rather than a URL."""
+    return not image.startswith(("http://", "https://", "oss://"))
+
+
+def _local_path(image):
+    return image[len("file://"):] if image.startswith("file://") else image
+
+
+def _map_images(messages, image_map):
+    """Return a copy of the messages with each image reference replaced by `image_map(image)`."""
+    compiled = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, list):
+            content = [dict(item, image=image_map(item["image"])) if "image" in item else item for item in content]
+        compiled.append(dict(message, content=content))
+    return compiled
+
+
+class PromptCompiler(object):
+    """Compile few-shot prompts and hand out one reference per distinct image content.
+
+    Images are encoded with `image_encoder` and passed to `upload`, a callable returning the reference (e.g. a
+    temporary storage URL) used in the messages from then on. Without `upload`, or if an upload fails, the encoded
+    local file is referenced, which the SDK still uploads with every request, but downsized and compressed.
+
+    The references of the prompt images are kept for the lifetime of the compiler, those of the live frames only for
+    the `max_references` most recently used contents, since a long-running node uploads a new frame with every scene
+    change.
+    """
+
+    def __init__(self, image_encoder, upload=None, max_references=16):
+        self.image_encoder = image_encoder
+        self.upload = upload
+        self.max_references = max_references
+        self._references = OrderedDict()
+        self._pinned = set()
+
+    def reference(self, encoded_image, pin=False):
+        """
+        Return the reference of an encoded image, uploading it on the first use of its content and encoding.
+
+        Parameters:
+            encoded_image (EncodedImage): The encoded image, see `ImageEncoder`.
+            pin (bool): Whether to keep the reference for the lifetime of the compiler, as for the prompt images.
+
+        Returns:
+            str: The URL of the uploaded image, or the path of the encoded local file.
+        """
+        # the path names both the content and the encoding parameters
+        key = encoded_image.path
+        reference = self._references.get(key)
+        if reference is None:
+            reference = encoded_image.path
+            if self.upload is not None:
+                try:
+                    reference = self.upload(encoded_image.path) or encoded_image.path
+                except Exception as e:
+                    print("Failed to upload {}, sending the local file instead: {}".format(encoded_image.path, e))
+            self._references[key] = reference
+        self._references.move_to_end(key)
+        if pin:
+            self._pinned.add(key)
+
+        unpinned = [cached for cached in self._references if cached not in self._pinned]
+        for cached in unpinned[:max(len(unpinned) - self.max_references, 0)]:
+            del self._references[cached]
+        return reference
+
+    def compile(self, messages):
+        """
+        Compile a few-shot prompt.
+
+        Parameters:
+            messages (list): The prompt messages, with local image paths.
+
+        Returns:
+            CompiledPrompt: The compiled prompt prefix.
+        """
+        encoded_images = {}
+        occurrences = []
+        raw_image_bytes = []
+
+        def encode(image):
+            if not is_local_image(image):
+                return image
+            path = _local_path(image)
+            if path not in encoded_images:
+                encoded_images[path] = self.image_encoder.encode_file(path)
+            raw_image_bytes.append(os.path.getsize(path))
+            occurrences.append(encoded_images[path])
+            return encoded_images[path]
+
+        encoded_messages = _map_images(messages, encode)
+        version = prompt_hash(_map_images(encoded_messages, lambda image: getattr(image, "content_hash", image)))
+        compiled_messages = _map_images(
+            encoded_messages,
+            lambda image: self.reference(image, pin=True) if hasattr(image, "content_hash") else image)
+
+        distinct_images = {encoded.content_hash for encoded in occurrences}
+        image_bytes = sum(len(encoded.data) for encoded in occurrences
+                          if is_local_image(self._references[encoded.content_hash]))
+        compiled = CompiledPrompt(compiled_messages, version, payload_text_bytes(compiled_messages), image_bytes,
+                                  sum(raw_image_bytes))
+
+        print("Compiled prompt {}: {} messages, {} image references to {} distinct images, {} bytes of text, "
+              "{} bytes of images per request (was {} bytes)".format(
+                  version[:8], len(compiled_messages), len(raw_image_bytes), len(distinct_images),
+                  compiled.text_bytes, compiled.image_bytes, compiled.raw_image_bytes))
+        return compiled
+
+    def payload_size(self, compiled, image_reference, query, messages=None):
+        """
+        Return the approximate payload size in bytes of a request with the compiled prefix and a new user turn.
+
+        Parameters:
+            messages (list): The messages actually sent before the new turn, if not the whole compiled prefix (e.g. a
+                selection of its examples followed by the conversation history).
+        """
+        turn = [{"role": "user", "content": [{"image": image_reference}, {"text": query}]}]
+        if messages is None:
+            size = compiled.text_bytes + compiled.image_bytes + payload_text_bytes(turn)
+            images = [image_reference]
+        else:
+            size = payload_text_bytes(messages + turn)
+            images = [item["image"] for message in messages + turn if isinstance(message["content"], list)
+                      for item in message["content"] if "image" in item]
+        for image in images:
+            if is_local_image(image) and os.path.exists(_local_path(image)):
+                size += os.path.getsize(_local_path(image))
+        return size
+
+
+def payload_text_bytes(messages):
+    """Return the size in bytes of the JSON serialized messages, without the image data."""
+    return len(json.dumps(messages, ensure_ascii=False).encode("utf-8"))
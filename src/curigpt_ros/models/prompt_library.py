@@ -0,0 +1,158 @@
+"""
+Prompt Library
+===========================
+Versioned few-shot prompts loaded from the JSON files of prompt/ at startup, validated once, and built into message
+lists on first use, so that all entry points share one source for each language and scenario.
+
+A prompt file holds one prompt:
+    {"name": "tabletop_en", "language": "en", "scenario": "tabletop", "response_format": "json",
+     "images": {"scene": "assets/img/curigpt_test_tabletop.png"},
+     "system": "You are ...",
+     "examples": [{"image": "scene", "query": "hey CURI, what do you see right now?",
+                   "response": {"robot_response": "...", "robot_actions": null}}]}
+where each example refers to one of the named `images` (or null for a text-only turn), and the responses of "json"
+prompts are CuriGPT responses, validated against the action schema.
+"""
+
+import glob
+import json
+import os
+from collections import namedtuple
+
+from curigpt_ros.models.response_cache import prompt_hash
+from curigpt_ros.models.response_parser import parse_response, ResponseError
+
+
+class PromptError(ValueError):
+    """A prompt file is invalid, or a prompt cannot be built."""
+
+
+# A validated prompt file; `version` is the content hash of the file, for the cache keys.
+PromptSpec = namedtuple("PromptSpec", ["name", "language", "scenario", "response_format", "images", "system",
+                                       "examples", "version", "path"])
+
+
+def validate_prompt(data, name):
+    """Validate the content of a prompt file, raising a `PromptError` describing the first problem."""
+    for key in ("language", "examples"):
+        if key not in data:
+            raise PromptError("{}: missing {}".format(name, key))
+    if data.get("name", name) != name:
+        raise PromptError("{}: name {!r} does not match the file name".format(name, data["name"]))
+    response_format = data.get("response_format", "json")
+    if response_format not in ("json", "text"):
+        raise PromptError("{}: response_format must be json or text".format(name))
+    if not isinstance(data["examples"], list) or not data["examples"]:
+        raise PromptError("{}: examples must be a non-empty list".format(name))
+
+    images = data.get("images", {})
+    for index, example in enumerate(data["examples"]):
+        where = "{}: examples[{}]".format(name, index)
+        if not isinstance(example.get("query"), str) or not example["query"]:
+            raise PromptError("{}: missing query".format(where))
+        if example.get("image") is not None and example["image"] not in images:
+            raise PromptError("{}: unknown image {!r}".format(where, example["image"]))
+        if "response" not in example:
+            raise PromptError("{}: missing response".format(where))
+        if response_format == "text":
+            if not isinstance(example["response"], str):
+                raise PromptError("{}: the response of a text prompt must be a string".format(where))
+            continue
+        try:
+            parse_response(json.dumps(example["response"]))
+        except ResponseError as e:
+            raise PromptError("{}: invalid response: {}".format(where, e))
+
+
+def load_prompt(path):
+    """Load and validate a prompt file."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "r", encoding="utf-8") as file:
+        try:
+            data = json.load(file)
+        except ValueError as e:
+            raise PromptError("{}: invalid JSON: {}".format(name, e))
+    validate_prompt(data, name)
+    return PromptSpec(name, data["language"], data.get("scenario"), data.get("response_format", "json"),
+                      data.get("images", {}), data.get("system"), data["examples"], prompt_hash(data), path)
+
+
+def build_messages(spec, images=None):
+    """
+    Build the message list of a prompt.
+
+    Parameters:
+        spec (PromptSpec): The prompt.
+        images (dict): Image paths overriding the named images of the prompt file.
+
+    Returns:
+        list: The messages in the DashScope multimodal format.
+    """
+    images = dict(spec.images, **(images or {}))
+    messages = []
+    if spec.system:
+        messages.append({"role": "system", "content": [{"text": spec.system}]})
+    for example in spec.examples:
+        content = [{"text": example["query"]}]
+        if example.get("image") is not None:
+            image = images.get(example["image"])
+            if image is None:
+                raise PromptError("{}: no path for the image {!r}".format(spec.name, example["image"]))
+            content.insert(0, {"image": image})
+        response = example["response"]
+        if spec.response_format == "json":
+            response = json.dumps(response, indent=4, ensure_ascii=False)
+        messages.append({"role": "user", "content": content})
+        messages.append({"role": "assistant", "content": [{"text": response}]})
+    return messages
+
+
+class PromptRegistry(object):
+    """The prompts of a directory, loaded and validated once; the message lists are built on first use.
+
+    Attributes:
+        prompts (dict): The `PromptSpec` of each prompt by name.
+    """
+
+    def __init__(self, prompt_dir="prompt"):
+        self.prompt_dir = prompt_dir
+        self.prompts = {}
+        for path in sorted(glob.glob(os.path.join(prompt_dir, "*.json"))):
+            spec = load_prompt(path)
+            self.prompts[spec.name] = spec
+        self._messages = {}
+
+    def names(self):
+        return sorted(self.prompts)
+
+    def get(self, name):
+        if name not in self.prompts:
+            raise PromptError("Unknown prompt {!r}, expected one of {}".format(name, self.names()))
+        return self.prompts[name]
+
+    def find(self, language, scenario=None):
+        """Return the name of the first prompt for a language (and scenario)."""
+        for name in self.names():
+            spec = self.prompts[name]
+            if spec.language == language and (scenario is None or spec.scenario == scenario):
+                return name
+        raise PromptError("No prompt for language {!r} and scenario {!r}".format(language, scenario))
+
+    def version(self, name):
+        return self.get(name).version
+
+    def messages(self, name, images=None):
+        """
+        Return the message list of a prompt, built on the first call.
+
+        Parameters:
+            name (str): The prompt name, the file name without extension.
+            images (dict): Image paths overriding the named images of the prompt file.
+
+        Returns:
+            list: A copy of the messages in the DashScope multimodal format.
+        """
+        key = (name, tuple(sorted((images or {}).items())))
+        if key not in self._messages:
+            self._messages[key] = build_messages(self.get(name), images)
+        return list(self._messages[key])
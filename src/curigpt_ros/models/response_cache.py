@@ -0,0 +1,158 @@
+"""
+Response Cache
+===========================
+Content-addressed LRU + TTL cache of the multimodal reasoning responses, backed by one JSON file per entry on disk,
+so repeated questions on an unchanged scene skip the remote round trip, also across sessions.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+
+def prompt_hash(prompt):
+    """Return a hex digest identifying a prompt version (the list of base prompt messages)."""
+    serialized = json.dumps(prompt, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(serialized.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def normalize_query(query):
+    """Normalize a transcribed query so that trivially different transcriptions share a cache entry."""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip(" .!?,;:。！？，；：")
+
+
+class ResponseCache(object):
+    """LRU + TTL cache of MLLM responses, keyed by (model name, prompt hash, image content hash, normalized query).
+
+    Entries are kept in memory up to `max_entries` and written to `cache_dir`; entries older than `ttl` seconds are
+    treated as missing. The files left on disk by earlier sessions are pruned to the same bounds when the cache is
+    created, see `prune`. With `enabled` False every lookup misses and nothing is stored; with `bypass` lookups are
+    skipped but fresh responses are still stored, which refreshes the cached entries.
+
+    Attributes:
+        hits (int), misses (int): Cache statistics.
+    """
+
+    def __init__(self, cache_dir="assets/cache/responses", max_entries=128, ttl=600.0, enabled=True,
+                 bypass=False):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self.bypass = bypass
+
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        if self.enabled:
+            self.prune()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a cache from the "response_cache" section of the config."""
+        return cls(cache_dir=config.get("cache_dir", "assets/cache/responses"),
+                   max_entries=config.get("max_entries", 128), ttl=config.get("ttl", 600.0),
+                   enabled=config.get("enabled", False), bypass=config.get("bypass", False))
+
+    @staticmethod
+    def make_key(model_name, prompt_version, image_hash, query):
+        """Return the cache key of a call, see `prompt_hash` for `prompt_version`."""
+        key = "\n".join([model_name, prompt_version, image_hash or "", normalize_query(query)])
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _is_fresh(self, created):
+        return self.ttl is None or time.time() - created <= self.ttl
+
+    def get(self, key, bypass=False):
+        """
+        Look up a response.
+
+        Parameters:
+            key (str): The cache key, see `make_key`.
+            bypass (bool): Whether to skip the lookup for this call.
+
+        Returns:
+            str: The cached response, or None on a miss.
+        """
+        if not self.enabled or self.bypass or bypass:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is None and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key), "r") as file:
+                    stored = json.load(file)
+                entry = (stored["created"], stored["response"])
+            except (ValueError, KeyError) as e:
+                print("Ignoring corrupt response cache entry {}: {}".format(key, e))
+
+        if entry is None or not self._is_fresh(entry[0]):
+            if entry is not None:
+                self._forget(key)
+            self.misses += 1
+            return None
+
+        self._remember(key, entry)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, response):
+        """Store a response, in memory and on disk."""
+        if not self.enabled or response is None:
+            return
+
+        entry = (time.time(), response)
+        self._remember(key, entry)
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp_path = "{}.tmp{}".format(self._path(key), os.getpid())
+        with open(tmp_path, "w") as file:
+            json.dump({"created": entry[0], "response": response}, file, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            # the disk store is bounded by the same LRU policy
+            self._forget(next(iter(self._entries)))
+
+    def _forget(self, key):
+        self._entries.pop(key, None)
+        if os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+    def prune(self):
+        """
+        Remove the expired entries from disk, and the oldest ones beyond `max_entries`.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".json")]
+        # the files are written once per stored response, so their modification time is their creation time
+        paths.sort(key=os.path.getmtime, reverse=True)
+        now = time.time()
+        removed = 0
+        for index, path in enumerate(paths):
+            if index >= self.max_entries or (self.ttl is not None and now - os.path.getmtime(path) > self.ttl):
+                os.remove(path)
+                self._entries.pop(os.path.splitext(os.path.basename(path))[0], None)
+                removed += 1
+        return removed
+
+    def stats(self):
+        """Return the cache statistics as a printable string."""
+        total = self.hits + self.misses
+        return "response cache: {} hits, {} misses ({:.0%} hit rate)".format(
+            self.hits, self.misses, self.hits / total if total else 0.0)
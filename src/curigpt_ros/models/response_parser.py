@@ -0,0 +1,237 @@
+"""
+Response Parser
+===========================
+Parse and validate the structured CuriGPT response against the robot action schema, with cheap local repairs of the
+usual formatting mistakes of the MLLM, so that a retry is only spent on responses that cannot be fixed locally.
+"""
+
+import ast
+import json
+import re
+from collections import namedtuple
+
+
+# The robot actions and the bbox arguments each of them requires
+ACTION_SCHEMA = {
+    "grasp_and_place": ("arg1", "arg2"),
+    "grasp_and_give": ("arg1",),
+    "grasp_handover_give": ("arg1",),
+}
+
+# Bbox coordinates this far outside the normalized 0-1000 range are clamped, further out they are rejected
+BBOX_TOLERANCE = 50
+
+
+class ResponseError(ValueError):
+    """The response cannot be parsed or does not match the schema, even after the local repairs."""
+
+    def __init__(self, errors):
+        self.errors = errors if isinstance(errors, list) else [errors]
+        super(ResponseError, self).__init__("; ".join(self.errors))
+
+
+# A bbox argument of an action, with the bbox [x1, y1, x2, y2] in normalized 0-1000 coordinates.
+BBoxArgument = namedtuple("BBoxArgument", ["description", "bbox"])
+
+
+class RobotAction(namedtuple("RobotAction", ["action", "arguments"])):
+    """A validated robot action, with its bbox arguments by name ("arg1", "arg2")."""
+
+    __slots__ = ()
+
+    def to_dict(self):
+        """Return the action in the response format consumed by `process_robot_actions`."""
+        return {"action": self.action, "parameters": {
+            name: {"description": argument.description, "bbox_coordinates": list(argument.bbox)}
+            for name, argument in self.arguments.items()}}
+
+
+class RobotPlan(namedtuple("RobotPlan", ["robot_response", "actions", "repairs"])):
+    """A validated response: the verbal response, the robot actions, and the names of the repairs applied."""
+
+    __slots__ = ()
+
+    def action_dicts(self):
+        return [action.to_dict() for action in self.actions]
+
+
+def _strip_code_fence(text):
+    """Keep the outermost {...} of the text, dropping markdown code fences and surrounding prose."""
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        return text
+    return text[start:end + 1]
+
+
+# A double- or single-quoted string literal, with its escapes
+_STRING_LITERAL = r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\''
+
+# The errors `json.loads` and `ast.literal_eval` raise on malformed or hostile input, e.g. TypeError for an
+# unhashable dict key or RecursionError for deeply nested brackets
+_DECODE_ERRORS = (ValueError, SyntaxError, TypeError, MemoryError, RecursionError)
+
+
+def _sub_outside_strings(pattern, replacement, text):
+    """Like `re.sub`, but leave the text inside string literals unchanged."""
+    def substitute(match):
+        if match.group("string") is not None:
+            return match.group("string")
+        return replacement(match)
+
+    return re.sub("(?P<string>{})|{}".format(_STRING_LITERAL, pattern), substitute, text)
+
+
+def _remove_trailing_commas(text):
+    return _sub_outside_strings(r",\s*(?P<close>[}\]])", lambda match: match.group("close"), text)
+
+
+def _python_literal(text):
+    """Parse a Python-style dict literal (single quotes, None/True/False, or JSON null/true/false)."""
+    try:
+        return ast.literal_eval(text)
+    except _DECODE_ERRORS:
+        return ast.literal_eval(_sub_outside_strings(
+            r"\b(?P<name>null|true|false)\b",
+            lambda match: {"null": "None", "true": "True", "false": "False"}[match.group("name")], text))
+
+
+# The local repairs, cheapest first; each one is applied on top of the previous ones
+_REPAIRS = [
+    ("code_fence", _strip_code_fence),
+    ("trailing_commas", _remove_trailing_commas),
+]
+
+
+def load_response(text):
+    """
+    Decode the JSON object of a response, applying the local repairs as needed.
+
+    Returns:
+        tuple: (data, repairs) with the decoded object and the names of the repairs applied.
+
+    Raises:
+        ResponseError: If the response cannot be decoded.
+    """
+    if not text:
+        raise ResponseError("empty response")
+
+    repairs = []
+    try:
+        return json.loads(text), repairs
+    except _DECODE_ERRORS as e:
+        json_error = e
+
+    for name, repair in _REPAIRS:
+        repaired = repair(text)
+        if repaired == text:
+            continue
+        text = repaired
+        repairs.append(name)
+        try:
+            return json.loads(text), repairs
+        except _DECODE_ERRORS:
+            pass
+
+    try:
+        return _python_literal(text), repairs + ["python_literal"]
+    except _DECODE_ERRORS:
+        raise ResponseError("invalid JSON: {}".format(json_error))
+
+
+def validate_bbox(bbox, name, repairs):
+    """Validate a normalized 0-1000 bbox, clamping slightly out-of-range values and reordering swapped corners."""
+    if not isinstance(bbox, (list, tuple)) or len(bbox) != 4 or \
+            not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in bbox):
+        raise ResponseError("{}: bbox_coordinates must be 4 numbers, got {!r}".format(name, bbox))
+    if any(value < -BBOX_TOLERANCE or value > 1000 + BBOX_TOLERANCE for value in bbox):
+        raise ResponseError("{}: bbox_coordinates {} out of the 0-1000 range".format(name, bbox))
+
+    clamped = [min(max(int(round(value)), 0), 1000) for value in bbox]
+    x1, y1, x2, y2 = clamped
+    if x1 > x2 or y1 > y2:
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        repairs.append("bbox_order")
+    elif clamped != list(bbox):
+        repairs.append("bbox_clamp")
+    if x1 == x2 or y1 == y2:
+        raise ResponseError("{}: empty bbox {}".format(name, bbox))
+    return [x1, y1, x2, y2]
+
+
+def validate_action(action, repairs=None):
+    """
+    Validate one robot action of the response.
+
+    Parameters:
+        action (dict): The action, e.g. {"action": "grasp_and_give", "parameters": {"arg1": {...}}}.
+        repairs (list): The list the names of the applied repairs are appended to.
+
+    Returns:
+        RobotAction: The validated action.
+
+    Raises:
+        ResponseError: If the action does not match the schema.
+    """
+    repairs = [] if repairs is None else repairs
+    if not isinstance(action, dict):
+        raise ResponseError("action must be an object, got {!r}".format(action))
+    name = action.get("action")
+    if name not in ACTION_SCHEMA:
+        raise ResponseError("unknown action {!r}, expected one of {}".format(name, sorted(ACTION_SCHEMA)))
+
+    parameters = action.get("parameters")
+    if not isinstance(parameters, dict):
+        raise ResponseError("{}: missing parameters".format(name))
+    arguments = {}
+    for arg in ACTION_SCHEMA[name]:
+        argument = parameters.get(arg)
+        if not isinstance(argument, dict) or "bbox_coordinates" not in argument:
+            raise ResponseError("{}: missing {} with bbox_coordinates".format(name, arg))
+        bbox = validate_bbox(argument["bbox_coordinates"], "{}.{}".format(name, arg), repairs)
+        arguments[arg] = BBoxArgument(argument.get("description"), bbox)
+    return RobotAction(name, arguments)
+
+
+def parse_response(text):
+    """
+    Parse and validate a CuriGPT response.
+
+    Parameters:
+        text (str): The response text.
+
+    Returns:
+        RobotPlan: The validated plan.
+
+    Raises:
+        ResponseError: If the response cannot be repaired into a valid plan; the errors describe what is wrong.
+    """
+    data, repairs = load_response(text)
+    if not isinstance(data, dict):
+        raise ResponseError("response must be a JSON object")
+    missing = [key for key in ("robot_response", "robot_actions") if key not in data]
+    if missing:
+        raise ResponseError("missing keys {}".format(missing))
+
+    robot_response = data["robot_response"]
+    if robot_response is not None and not isinstance(robot_response, str):
+        raise ResponseError("robot_response must be a string or null")
+
+    robot_actions = data["robot_actions"] or []
+    if isinstance(robot_actions, dict):
+        robot_actions = [robot_actions]
+        repairs.append("single_action")
+    if not isinstance(robot_actions, list):
+        raise ResponseError("robot_actions must be a list or null")
+
+    errors = []
+    actions = []
+    for index, action in enumerate(robot_actions):
+        try:
+            actions.append(validate_action(action, repairs))
+        except ResponseError as e:
+            errors.extend("robot_actions[{}]: {}".format(index, error) for error in e.errors)
+    if errors:
+        raise ResponseError(errors)
+
+    return RobotPlan(robot_response, actions, repairs)
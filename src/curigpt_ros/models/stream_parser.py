@@ -0,0 +1,133 @@
+"""
+Streaming JSON Parser
+===========================
+Incremental parsing of the structured CuriGPT response while the MLLM is still generating it, so that each
+top-level field ("robot_response", "robot_actions") can be used as soon as it is complete.
+"""
+
+import json
+
+
+class StreamingJSONParser(object):
+    """Incremental parser for the top-level fields of a JSON object streamed in text chunks.
+
+    The parser scans the chunks once, tracking strings, escapes and nesting, and calls `on_field(key, value)` as soon
+    as the value of a top-level key is complete. Text before the first "{" (such as a markdown code fence) is skipped.
+    Fields whose value is not valid JSON are skipped, the full response can still be repaired once complete.
+
+    For top-level arrays, `on_item(key, index, value)` is also called as soon as each object or array element of the
+    array is complete, so that e.g. the first of several robot actions can be used before the rest is generated. An
+    element that is not valid JSON is not skipped silently: `on_item_error(key, index, text)` is called instead, so
+    that the caller can stop using the later elements, which may depend on it.
+
+    Attributes:
+        text (str): The text received so far.
+        fields (dict): The completed top-level fields.
+        done (bool): Whether the top-level object is closed.
+    """
+
+    def __init__(self, on_field=None, on_item=None, on_item_error=None):
+        self.on_field = on_field
+        self.on_item = on_item
+        self.on_item_error = on_item_error
+        self.text = ""
+        self.fields = {}
+        self.done = False
+
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._state = "key"  # key, colon, value, in_value, after_value
+        self._token_start = None
+        self._key = None
+        self._array_key = None
+        self._item_start = None
+        self._item_index = 0
+
+    def feed(self, chunk):
+        """Append a text chunk and emit the top-level fields it completes."""
+        self.text += chunk
+        text = self.text
+        while self._pos < len(text) and not self.done:
+            self._step(text, self._pos, text[self._pos])
+            self._pos += 1
+
+    def _step(self, text, pos, char):
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 1 and self._state == "key":
+                    self._key = json.loads(text[self._token_start:pos + 1])
+                    self._state = "colon"
+                elif self._depth == 1 and self._state == "in_value":
+                    self._emit(text[self._token_start:pos + 1])
+            return
+
+        if self._depth == 0 and char != "{":
+            # before the top-level object
+            return
+
+        # a scalar value (number, true, false, null) ends at the next delimiter
+        if self._depth == 1 and self._state == "in_value" and (char in ",}" or char.isspace()):
+            self._emit(text[self._token_start:pos])
+
+        if char == '"':
+            self._in_string = True
+            if self._depth == 1 and self._state in ("key", "value"):
+                self._token_start = pos
+                self._state = "in_value" if self._state == "value" else "key"
+        elif char in "{[":
+            if self._depth == 1 and self._state == "value":
+                self._token_start = pos
+                self._state = "in_value"
+                if char == "[":
+                    self._array_key = self._key
+                    self._item_index = 0
+            elif self._depth == 2 and self._array_key is not None:
+                self._item_start = pos
+            self._depth += 1
+        elif char in "}]":
+            self._depth -= 1
+            if self._depth == 2 and self._item_start is not None:
+                self._emit_item(text[self._item_start:pos + 1])
+            elif self._depth == 1 and self._state == "in_value":
+                self._emit(text[self._token_start:pos + 1])
+            elif self._depth == 0:
+                self.done = True
+        elif self._depth == 1:
+            if char == ":" and self._state == "colon":
+                self._state = "value"
+            elif char == "," and self._state == "after_value":
+                self._state = "key"
+            elif not char.isspace() and self._state == "value":
+                self._token_start = pos
+                self._state = "in_value"
+
+    def _emit_item(self, item_text):
+        self._item_start = None
+        index = self._item_index
+        self._item_index += 1
+        try:
+            item = json.loads(item_text)
+        except ValueError:
+            if self.on_item_error is not None:
+                self.on_item_error(self._array_key, index, item_text)
+            return
+        if self.on_item is not None:
+            self.on_item(self._array_key, index, item)
+
+    def _emit(self, value_text):
+        self._state = "after_value"
+        self._array_key = None
+        try:
+            value = json.loads(value_text)
+        except ValueError:
+            return
+        self.fields[self._key] = value
+        if self.on_field is not None:
+            self.on_field(self._key, value)
@@ -1,49 +1,142 @@
+import queue
+import threading
+
 import rospy
 from curigpt_ros.actions.single_hand_grasp import grasp_and_place, grasp_and_give, grasp_handover_give
-from curigpt_ros.utils.vis_utils import plot_image_with_bbox, get_spatial_coordinates, vis_spatial_point
+from curigpt_ros.utils.vis_utils import plot_image_with_bbox, load_rgbd_arrays
+from curigpt_ros.utils.depth_utils import deproject_bboxes_robust
+from curigpt_ros.models.response_parser import ACTION_SCHEMA
 from curigpt_ros.srv import ExecuteGroupPose, ExecuteGroupPoseRequest
-import open3d as o3d
-
-def process_robot_actions(action_response, rgb_img, depth_img):
-    # Map each action to its corresponding function
-    action_map = {
-        "grasp_and_place": grasp_and_place,
-        "grasp_and_give": grasp_and_give,
-        "grasp_handover_give": grasp_handover_give
-    }
-
-    cam_intrinsics = o3d.camera.PinholeCameraIntrinsic(width=640, height=360, fx=345.9, fy=346.0, cx=322.7, cy=181.3) # Camera intrinsics: fx, fy, cx, cy
-    cam_manip_points = []
-
-    if action_response[0]["action"] in action_map:
-        action_func = action_map[action_response[0]["action"]]
-        print("Processing action:", action_response[0]["action"])
-
-        # Visualize the bounding box to check if they are correct
-        plot_image_with_bbox(rgb_img, action_response)
-
-        if action_response[0]["action"] in ["grasp_and_give", "grasp_handover_give"]:
-            grasp_bbox = action_response[0]["parameters"]["arg1"]["bbox_coordinates"]
-            spatial_grasp_point = get_spatial_coordinates(grasp_bbox, rgb_img, depth_img, cam_intrinsics)
-            cam_manip_points.append(spatial_grasp_point)
-            # vis_spatial_point(cam_manip_points, rgb_img, depth_img, cam_intrinsics)
-            action_func(spatial_grasp_point)
-
-        elif action_response[0]["action"] == 'grasp_and_place':
-            grasp_bbox = action_response[0]["parameters"]["arg1"]["bbox_coordinates"]
-            place_bbox = action_response[0]["parameters"]["arg2"]["bbox_coordinates"]
-            spatial_grasp_point = get_spatial_coordinates(grasp_bbox, rgb_img, depth_img, cam_intrinsics)
-            spatial_place_point = get_spatial_coordinates(place_bbox, rgb_img, depth_img, cam_intrinsics)
-            cam_manip_points.append(spatial_grasp_point)
-            cam_manip_points.append(spatial_place_point)
-            # Visualize the spatial points to check if they are correct
-            # vis_spatial_point(cam_manip_points, rgb_img, depth_img, cam_intrinsics)
-            action_func(spatial_grasp_point, spatial_place_point)
-
-
-
-    else:
-        print("Unknown action:", action_response['action'])
+
+
+# Map each action to its corresponding function and the arguments it needs
+ACTION_MAP = {
+    "grasp_and_place": (grasp_and_place, ACTION_SCHEMA["grasp_and_place"]),
+    "grasp_and_give": (grasp_and_give, ACTION_SCHEMA["grasp_and_give"]),
+    "grasp_handover_give": (grasp_handover_give, ACTION_SCHEMA["grasp_handover_give"])
+}
+
+
+class ActionDispatcher(object):
+    """Validate, deproject and execute robot actions one at a time, as soon as each one is available.
+
+    `submit` validates an action and deprojects its bounding boxes right away, in the calling thread (e.g. while the
+    model is still streaming the rest of the plan), and queues it for a worker thread that executes the queued actions
+    in order. Once an action is rejected or fails, the rest of the plan is dropped, since later actions may depend on
+    it. The images are loaded on the first submitted action, with integer depths converted by `depth_scale` (raw
+    units per meter).
+    """
+
+    def __init__(self, rgb_img, depth_img, cam_intrinsics, depth_registration=None, min_depth_confidence=0.2,
+                 depth_scale=1000.0):
+        self.rgb_img = rgb_img
+        self.depth_img = depth_img
+        self.cam_intrinsics = cam_intrinsics
+        self.depth_registration = depth_registration
+        self.min_depth_confidence = min_depth_confidence
+        self.depth_scale = depth_scale
+
+        self.aborted = False
+        self._depth_array = None
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def _load_depth(self):
+        color_array, depth_array = load_rgbd_arrays(self.rgb_img, self.depth_img, self.depth_scale)
+        if self.depth_registration is not None:
+            depth_array = self.depth_registration.register(depth_array)
+        if color_array.shape[:2] != depth_array.shape[:2]:
+            print("The size of color image and depth image are not the same, configure the depth registration.")
+            return None
+        return depth_array
+
+    def submit(self, action):
+        """
+        Validate and deproject a robot action, and queue it for execution.
+
+        Parameters:
+            action (dict): The robot action, with the action name and the bbox parameters.
+
+        Returns:
+            bool: Whether the action was queued.
+        """
+        if self.aborted:
+            print("Skipping action after an earlier failure:", action.get("action"))
+            return False
+
+        name = action.get("action")
+        parameters = action.get("parameters") or {}
+        if name not in ACTION_MAP:
+            print("Unknown action:", name)
+            self.aborted = True
+            return False
+        action_func, arguments = ACTION_MAP[name]
+        try:
+            bboxes = [parameters[arg]["bbox_coordinates"] for arg in arguments]
+        except (KeyError, TypeError):
+            print("Missing bounding boxes for action:", name)
+            self.aborted = True
+            return False
+
+        if self._depth_array is None:
+            self._depth_array = self._load_depth()
+            if self._depth_array is None:
+                self.aborted = True
+                return False
+
+        # deproject all bounding boxes of the action in one pass
+        spatial_points, confidences = deproject_bboxes_robust(bboxes, self._depth_array, self.cam_intrinsics)
+        print("Processing action:", name)
+        print("Camera manipulation points (X, Y, Z):\n", spatial_points)
+        print("Depth confidences:", confidences)
+
+        # Do not move the arm to a point without a trustworthy depth
+        if confidences.min() < self.min_depth_confidence:
+            print("Depth confidence below %.2f, skipping action." % self.min_depth_confidence)
+            self.aborted = True
+            return False
+
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="action_dispatcher", daemon=True)
+            self._worker.start()
+        self._queue.put((name, action_func, [point.reshape(3, 1) for point in spatial_points]))
+        return True
+
+    def _run(self):
+        failed = False
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            name, action_func, cam_manip_points = item
+            if failed:
+                print("Skipping action after an earlier failure:", name)
+                continue
+            try:
+                action_func(*cam_manip_points)
+            except Exception as e:
+                print("Action {} failed: {}".format(name, e))
+                failed = self.aborted = True
+
+    def close(self):
+        """Wait until all queued actions are executed."""
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
+
+
+def process_robot_actions(action_response, rgb_img, depth_img, cam_intrinsics, depth_registration=None,
+                          min_depth_confidence=0.2, depth_scale=1000.0):
+    # Visualize the bounding box to check if they are correct
+    plot_image_with_bbox(rgb_img, action_response)
+
+    # Execute all actions of the plan in order
+    dispatcher = ActionDispatcher(rgb_img, depth_img, cam_intrinsics, depth_registration, min_depth_confidence,
+                                  depth_scale)
+    for action in action_response:
+        dispatcher.submit(action)
+    dispatcher.close()
 
 
 def publish_waypoint_to_service(waypoint, log_info):
@@ -0,0 +1,469 @@
+"""
+Depth Utilities
+===========================
+Vectorized depth processing for CuriGPT: camera intrinsics, depth-to-color registration, robust depth sampling,
+bbox-to-3D deprojection and ray-grid point clouds.
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from curigpt_ros.utils.transform import Transform
+
+
+class CameraIntrinsics(namedtuple("CameraIntrinsics", ["width", "height", "fx", "fy", "cx", "cy"])):
+    """Pinhole camera intrinsics.
+
+    Attributes:
+        width (int), height (int): Image size in pixels.
+        fx (float), fy (float): Focal lengths in pixels.
+        cx (float), cy (float): Principal point in pixels.
+    """
+
+    __slots__ = ()
+
+    @property
+    def intrinsic_matrix(self):
+        """The 3x3 intrinsic matrix."""
+        return np.array([[self.fx, 0.0, self.cx], [0.0, self.fy, self.cy], [0.0, 0.0, 1.0]])
+
+    @property
+    def inverse_matrix(self):
+        """The cached 3x3 inverse of the intrinsic matrix."""
+        return inverse_intrinsics(self.fx, self.fy, self.cx, self.cy)
+
+    def to_dict(self):
+        return dict(self._asdict())
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        return cls(int(dictionary["width"]), int(dictionary["height"]), float(dictionary["fx"]),
+                   float(dictionary["fy"]), float(dictionary["cx"]), float(dictionary["cy"]))
+
+    @classmethod
+    def from_camera_info(cls, msg):
+        """Initialize from a sensor_msgs/CameraInfo message."""
+        return cls(int(msg.width), int(msg.height), float(msg.K[0]), float(msg.K[4]), float(msg.K[2]),
+                   float(msg.K[5]))
+
+    @classmethod
+    def from_realsense(cls, intrinsics):
+        """Initialize from the `rs.intrinsics` of a pyrealsense2 video stream profile."""
+        return cls(int(intrinsics.width), int(intrinsics.height), float(intrinsics.fx), float(intrinsics.fy),
+                   float(intrinsics.ppx), float(intrinsics.ppy))
+
+
+# The factory intrinsics of the Gemini color stream at 640x360, the default camera of CuriGPT
+GEMINI_INTRINSICS = CameraIntrinsics(width=640, height=360, fx=345.9, fy=346.0, cx=322.7, cy=181.3)
+
+
+def as_intrinsics(intrinsics):
+    """
+    Convert a supported intrinsics description to `CameraIntrinsics`.
+
+    Parameters:
+        intrinsics: A `CameraIntrinsics`, a dict with width/height/fx/fy/cx/cy, or any object exposing `width`,
+            `height` and a 3x3 `intrinsic_matrix` (e.g. `o3d.camera.PinholeCameraIntrinsic`).
+    """
+    if isinstance(intrinsics, CameraIntrinsics):
+        return intrinsics
+    if isinstance(intrinsics, dict):
+        return CameraIntrinsics.from_dict(intrinsics)
+
+    matrix = np.asarray(intrinsics.intrinsic_matrix, dtype=np.float64)
+    return CameraIntrinsics(int(intrinsics.width), int(intrinsics.height), float(matrix[0, 0]),
+                            float(matrix[1, 1]), float(matrix[0, 2]), float(matrix[1, 2]))
+
+
+@lru_cache(maxsize=16)
+def inverse_intrinsics(fx, fy, cx, cy):
+    """Closed-form inverse of a pinhole intrinsic matrix, cached per camera."""
+    inverse = np.array([[1.0 / fx, 0.0, -cx / fx], [0.0, 1.0 / fy, -cy / fy], [0.0, 0.0, 1.0]])
+    inverse.setflags(write=False)
+    return inverse
+
+
+def depth_to_meters(depth, depth_scale=1000.0, depth_trunc=3.0):
+    """
+    Convert a raw depth image to a float32 depth map in meters.
+
+    Integer depth images are divided by `depth_scale`, float depth images are assumed to be in meters already.
+    Non-finite depths and depths beyond `depth_trunc` are set to 0 (invalid), matching Open3D's RGBDImage defaults.
+    """
+    depth = np.asarray(depth)
+    if np.issubdtype(depth.dtype, np.integer):
+        depth_m = depth.astype(np.float32) / depth_scale
+    else:
+        depth_m = depth.astype(np.float32, copy=True)
+    depth_m[~np.isfinite(depth_m) | (depth_m > depth_trunc)] = 0.0
+    return depth_m
+
+
+def bboxes_to_pixels(bboxes, width, height):
+    """
+    Convert normalized (0-1000) bounding boxes to integer pixel boxes.
+
+    Parameters:
+        bboxes (array_like): Boxes [x1, y1, x2, y2] of shape (N, 4), normalized to 0-1000.
+        width (int), height (int): The image size in pixels.
+
+    Returns:
+        np.ndarray: Integer pixel boxes of shape (N, 4), clipped to the image.
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    scale = np.array([width, height, width, height], dtype=np.float64) / 1000.0
+    pixels = np.floor(bboxes * scale).astype(np.int64)
+    np.clip(pixels[:, 0::2], 0, width - 1, out=pixels[:, 0::2])
+    np.clip(pixels[:, 1::2], 0, height - 1, out=pixels[:, 1::2])
+    return pixels
+
+
+def deproject_pixels(u, v, z, intrinsics):
+    """
+    Deproject pixels with known depth to 3D points in the camera frame.
+
+    Parameters:
+        u, v (array_like): Pixel coordinates of shape (N,).
+        z (array_like): Depths in meters of shape (N,).
+        intrinsics: Camera intrinsics, see `as_intrinsics`.
+
+    Returns:
+        np.ndarray: Points of shape (N, 3) in meters.
+    """
+    intrinsics = as_intrinsics(intrinsics)
+    inverse = intrinsics.inverse_matrix
+    z = np.asarray(z, dtype=np.float64)
+    x = (np.asarray(u, dtype=np.float64) * inverse[0, 0] + inverse[0, 2]) * z
+    y = (np.asarray(v, dtype=np.float64) * inverse[1, 1] + inverse[1, 2]) * z
+    return np.stack([x, y, z], axis=-1)
+
+
+def deproject_bboxes(bboxes, depth_array, intrinsics):
+    """
+    Deproject the centers of N normalized bounding boxes to 3D in one vectorized pass.
+
+    Parameters:
+        bboxes (array_like): Boxes [x1, y1, x2, y2] of shape (N, 4), normalized to 0-1000.
+        depth_array (np.ndarray): Depth map in meters, see `depth_to_meters`.
+        intrinsics: Camera intrinsics, see `as_intrinsics`.
+
+    Returns:
+        np.ndarray: Points of shape (N, 3) in meters; a point has z = 0 if its center depth is invalid.
+    """
+    height, width = depth_array.shape[:2]
+    pixels = bboxes_to_pixels(bboxes, width, height)
+    u = (pixels[:, 0] + pixels[:, 2]) // 2
+    v = (pixels[:, 1] + pixels[:, 3]) // 2
+    z = depth_array[v, u]
+    return deproject_pixels(u, v, z, intrinsics)
+
+
+def _shrink_pixel_boxes(pixels, shrink):
+    """Shrink integer pixel boxes around their centers by `shrink` (fraction of the side kept)."""
+    centers = (pixels[:, :2] + pixels[:, 2:]) / 2.0
+    half_sizes = np.maximum((pixels[:, 2:] - pixels[:, :2]) * shrink / 2.0, 0.5)
+    lower = np.floor(centers - half_sizes).astype(np.int64)
+    upper = np.ceil(centers + half_sizes).astype(np.int64)
+    return np.hstack([lower, upper])
+
+
+def _foreground_depths(depths, bin_width, min_peak_ratio):
+    """Select the samples of the nearest significant mode of the depth histogram."""
+    lowest, highest = depths.min(), depths.max()
+    if highest - lowest <= bin_width:
+        return depths
+    edges = np.arange(lowest, highest + bin_width, bin_width)
+    counts, edges = np.histogram(depths, bins=edges)
+    significant = np.flatnonzero(counts >= min_peak_ratio * counts.max())
+    # extend the nearest significant bin by one bin on each side to keep the whole surface
+    start = edges[max(significant[0] - 1, 0)]
+    stop = edges[min(significant[0] + 2, len(edges) - 1)]
+    return depths[(depths >= start) & (depths <= stop)]
+
+
+def estimate_bbox_depths(bboxes, depth_array, shrink=0.5, percentile=50.0, foreground=False, max_samples=1024,
+                         bin_width=0.01, min_peak_ratio=0.2, inlier_tolerance=0.02):
+    """
+    Robustly estimate the depth of the object inside each normalized bounding box.
+
+    Instead of the single center pixel, the depths of a shrunken region around the box center are sampled, invalid
+    depths (0, i.e. missing or truncated) are masked out and a percentile (the median by default) of the remaining
+    samples is taken. With `foreground` the estimate is restricted to the nearest significant mode of the depth
+    histogram, which separates the object from the table behind it. The region is subsampled with a stride to at
+    most `max_samples` pixels, which keeps the estimate cheap enough to run every turn.
+
+    Parameters:
+        bboxes (array_like): Boxes [x1, y1, x2, y2] of shape (N, 4), normalized to 0-1000.
+        depth_array (np.ndarray): Depth map in meters, see `depth_to_meters`.
+        shrink (float): Fraction of the box width/height sampled around its center.
+        percentile (float): Percentile of the valid depths used as the estimate.
+        foreground (bool): Whether to restrict the estimate to the nearest depth mode.
+        max_samples (int): Maximum number of pixels sampled per box.
+        bin_width (float): Histogram bin width in meters for the foreground selection.
+        min_peak_ratio (float): Minimum bin count, relative to the highest bin, of a significant depth mode.
+        inlier_tolerance (float): Distance in meters to the estimate within which a sample counts as an inlier.
+
+    Returns:
+        tuple: (pixels, depths, confidences) where pixels (N, 2) are the region centers (u, v), depths (N,) are the
+        estimates in meters (0 if no valid depth was found) and confidences (N,) are in [0, 1], the product of the
+        valid-depth fraction and the inlier fraction of the region.
+    """
+    height, width = depth_array.shape[:2]
+    regions = _shrink_pixel_boxes(bboxes_to_pixels(bboxes, width, height), shrink)
+    np.clip(regions[:, 0::2], 0, width, out=regions[:, 0::2])
+    np.clip(regions[:, 1::2], 0, height, out=regions[:, 1::2])
+
+    centers = np.stack([(regions[:, 0] + regions[:, 2] - 1) // 2, (regions[:, 1] + regions[:, 3] - 1) // 2], axis=1)
+    centers = np.clip(centers, 0, [width - 1, height - 1])
+    depths = np.zeros(len(regions), dtype=np.float64)
+    confidences = np.zeros(len(regions), dtype=np.float64)
+
+    for i, (u1, v1, u2, v2) in enumerate(regions):
+        area = max((u2 - u1) * (v2 - v1), 1)
+        stride = max(int(np.ceil(np.sqrt(area / float(max_samples)))), 1)
+        samples = depth_array[v1:max(v2, v1 + 1):stride, u1:max(u2, u1 + 1):stride].ravel()
+        valid = samples[samples > 0]
+        if valid.size == 0:
+            continue
+
+        if foreground:
+            valid = _foreground_depths(valid, bin_width, min_peak_ratio)
+        depth = np.percentile(valid, percentile)
+        inliers = np.count_nonzero(np.abs(valid - depth) <= inlier_tolerance)
+
+        depths[i] = depth
+        confidences[i] = (valid.size / float(samples.size)) * (inliers / float(valid.size))
+
+    return centers, depths, confidences
+
+
+def deproject_bboxes_robust(bboxes, depth_array, intrinsics, **kwargs):
+    """
+    Deproject N normalized bounding boxes to 3D using the robust depth estimate of `estimate_bbox_depths`.
+
+    Parameters:
+        bboxes (array_like): Boxes [x1, y1, x2, y2] of shape (N, 4), normalized to 0-1000.
+        depth_array (np.ndarray): Depth map in meters, see `depth_to_meters`.
+        intrinsics: Camera intrinsics, see `as_intrinsics`.
+        **kwargs: Options forwarded to `estimate_bbox_depths`.
+
+    Returns:
+        tuple: (points, confidences) with points of shape (N, 3) in meters and confidences of shape (N,).
+    """
+    centers, depths, confidences = estimate_bbox_depths(bboxes, depth_array, **kwargs)
+    return deproject_pixels(centers[:, 0], centers[:, 1], depths, intrinsics), confidences
+
+
+@lru_cache(maxsize=8)
+def _ray_grid(width, height, fx, fy, cx, cy):
+    u = (np.arange(width, dtype=np.float32) - np.float32(cx)) / np.float32(fx)
+    v = (np.arange(height, dtype=np.float32) - np.float32(cy)) / np.float32(fy)
+    rays = np.empty((height, width, 3), dtype=np.float32)
+    rays[..., 0] = u[np.newaxis, :]
+    rays[..., 1] = v[:, np.newaxis]
+    rays[..., 2] = 1.0
+    rays.setflags(write=False)
+    return rays
+
+
+def get_ray_grid(intrinsics):
+    """
+    Return the (H, W, 3) float32 grid of rays at unit depth, ((u - cx) / fx, (v - cy) / fy, 1) per pixel.
+
+    The grid is computed once per resolution and intrinsics and cached, so a depth map in meters becomes a point
+    cloud with a single multiply: `get_ray_grid(intrinsics) * depth[..., np.newaxis]`.
+    """
+    intrinsics = as_intrinsics(intrinsics)
+    return _ray_grid(*intrinsics)
+
+
+def voxel_downsample(points, voxel_size, colors=None):
+    """
+    Downsample a point cloud by averaging the points (and colors) falling into each voxel.
+
+    Parameters:
+        points (np.ndarray): Points of shape (N, 3).
+        voxel_size (float): The voxel edge length in meters.
+        colors (np.ndarray): Optional colors of shape (N, 3).
+
+    Returns:
+        np.ndarray or tuple: The downsampled points, and the downsampled colors if `colors` is given.
+    """
+    voxels = np.floor(points / voxel_size).astype(np.int64)
+    _, inverse, counts = np.unique(voxels, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+
+    def _average(values):
+        sums = np.zeros((len(counts), values.shape[1]), dtype=np.float64)
+        np.add.at(sums, inverse, values)
+        return (sums / counts[:, np.newaxis]).astype(values.dtype)
+
+    if colors is None:
+        return _average(points)
+    return _average(points), _average(colors)
+
+
+def depth_to_point_cloud(depth_array, intrinsics, colors=None, stride=1, roi=None, voxel_size=None,
+                         remove_invalid=False):
+    """
+    Convert a depth map to a point cloud in the camera frame using the cached ray grid.
+
+    Parameters:
+        depth_array (np.ndarray): Depth map in meters of shape (H, W), see `depth_to_meters`.
+        intrinsics: Camera intrinsics matching the depth map resolution, see `as_intrinsics`.
+        colors (np.ndarray): Optional per-pixel colors of shape (H, W, 3) to carry along.
+        stride (int): Pixel stride for downsampling rows and columns.
+        roi (tuple): Optional pixel region (u1, v1, u2, v2) to convert.
+        voxel_size (float): Optional voxel size in meters for voxel-grid downsampling (implies `remove_invalid`).
+        remove_invalid (bool): Whether to drop points with invalid (zero) depth.
+
+    Returns:
+        np.ndarray or tuple: Points of shape (M, 3) as float32, where M = H * W without downsampling, and the
+        matching colors of shape (M, 3) if `colors` is given.
+    """
+    intrinsics = as_intrinsics(intrinsics)
+    if depth_array.shape[:2] != (intrinsics.height, intrinsics.width):
+        raise ValueError("Depth map of shape {} does not match the intrinsics resolution {}x{}.".format(
+            depth_array.shape, intrinsics.width, intrinsics.height))
+
+    rays = get_ray_grid(intrinsics)
+    u1, v1, u2, v2 = roi if roi is not None else (0, 0, intrinsics.width, intrinsics.height)
+    window = (slice(v1, v2, stride), slice(u1, u2, stride))
+
+    points = (rays[window] * depth_array[window][..., np.newaxis].astype(np.float32, copy=False)).reshape(-1, 3)
+    if colors is not None:
+        colors = np.asarray(colors)[window].reshape(-1, colors.shape[-1])
+
+    if remove_invalid or voxel_size is not None:
+        valid = points[:, 2] > 0
+        points = points[valid]
+        colors = colors[valid] if colors is not None else None
+
+    if voxel_size is not None:
+        if colors is None:
+            points = voxel_downsample(points, voxel_size)
+        else:
+            points, colors = voxel_downsample(points, voxel_size, colors.astype(np.float32))
+
+    if colors is None:
+        return points
+    return points, colors
+
+
+class DepthRegistration(object):
+    """Align depth images to the color camera frame.
+
+    The per-pixel tables are computed once from the depth/color intrinsics and the depth-to-color extrinsics: the
+    depth rays rotated into the color frame and, when the two optical centers coincide, a complete color-to-depth
+    remap table. Each frame is then registered with a single vectorized pass.
+
+    Attributes:
+        depth_intrinsics (CameraIntrinsics)
+        color_intrinsics (CameraIntrinsics)
+        depth_to_color (Transform): Pose of the depth camera in the color camera frame.
+    """
+
+    def __init__(self, depth_intrinsics, color_intrinsics, depth_to_color=None):
+        self.depth_intrinsics = as_intrinsics(depth_intrinsics)
+        self.color_intrinsics = as_intrinsics(color_intrinsics)
+        self.depth_to_color = depth_to_color if depth_to_color is not None else Transform.identity()
+
+        rotation = self.depth_to_color.rotation.as_matrix().astype(np.float32)
+        self._translation = self.depth_to_color.translation.astype(np.float32)
+        self._rotated_rays = get_ray_grid(self.depth_intrinsics).reshape(-1, 3).dot(rotation.T)
+
+        self._remap = None
+        if np.allclose(self._translation, 0.0):
+            self._remap = self._build_remap_table(rotation)
+
+    def _build_remap_table(self, rotation):
+        """Color-to-depth pixel maps and depth scale factors, valid when the optical centers coincide."""
+        color_rays = get_ray_grid(self.color_intrinsics).reshape(-1, 3).dot(rotation)
+        depth = self.depth_intrinsics
+        with np.errstate(divide="ignore", invalid="ignore"):
+            map_x = depth.fx * color_rays[:, 0] / color_rays[:, 2] + depth.cx
+            map_y = depth.fy * color_rays[:, 1] / color_rays[:, 2] + depth.cy
+            # z in the color frame = z in the depth frame / z of the color ray in the depth frame
+            scale = 1.0 / color_rays[:, 2]
+        invalid = ~(color_rays[:, 2] > 0)
+        map_x[invalid] = -1.0
+        map_y[invalid] = -1.0
+        scale[invalid] = 0.0
+
+        shape = (self.color_intrinsics.height, self.color_intrinsics.width)
+        return (map_x.reshape(shape).astype(np.float32), map_y.reshape(shape).astype(np.float32),
+                scale.reshape(shape).astype(np.float32))
+
+    def register(self, depth_array):
+        """
+        Register a depth map to the color camera.
+
+        Parameters:
+            depth_array (np.ndarray): Depth map in meters at the depth camera resolution.
+
+        Returns:
+            np.ndarray: float32 depth map in meters at the color camera resolution; 0 where no depth maps.
+        """
+        depth = self.depth_intrinsics
+        if depth_array.shape[:2] != (depth.height, depth.width):
+            raise ValueError("Depth map of shape {} does not match the depth intrinsics {}x{}.".format(
+                depth_array.shape, depth.width, depth.height))
+        depth_array = depth_array.astype(np.float32, copy=False)
+
+        if self._remap is not None:
+            map_x, map_y, scale = self._remap
+            registered = cv2.remap(depth_array, map_x, map_y, cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT,
+                                   borderValue=0)
+            return registered * scale
+
+        return self._register_with_baseline(depth_array)
+
+    def _register_with_baseline(self, depth_array):
+        """Forward-project every depth pixel into the color image, keeping the nearest depth per color pixel."""
+        color = self.color_intrinsics
+        z = depth_array.reshape(-1)
+        valid = z > 0
+        points = self._rotated_rays[valid] * z[valid, np.newaxis] + self._translation
+
+        in_front = points[:, 2] > 0
+        points = points[in_front]
+        u = np.floor(color.fx * points[:, 0] / points[:, 2] + color.cx + 0.5).astype(np.int64)
+        v = np.floor(color.fy * points[:, 1] / points[:, 2] + color.cy + 0.5).astype(np.int64)
+        inside = (u >= 0) & (u < color.width) & (v >= 0) & (v < color.height)
+        index = v[inside] * color.width + u[inside]
+        z_mm = np.minimum(np.round(points[inside, 2] * 1000.0), 2 ** 20 - 1).astype(np.int64)
+
+        # z-buffer: sort by (pixel index, depth) in one key and keep the first (nearest) depth of each pixel
+        keys = np.sort((index << 20) | z_mm)
+        index = keys >> 20
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = index[1:] != index[:-1]
+
+        registered = np.zeros(color.height * color.width, dtype=np.float32)
+        registered[index[first]] = (keys[first] & (2 ** 20 - 1)).astype(np.float32) / 1000.0
+        return registered.reshape(color.height, color.width)
+
+
+def load_camera_config(camera_config):
+    """
+    Load the camera intrinsics and, if needed, the depth registration from the "camera" section of the config.
+
+    Parameters:
+        camera_config (dict): With "color_intrinsics" and optionally "depth_intrinsics" (width, height, fx, fy, cx,
+            cy) and "depth_to_color" (a `Transform` dict with "rotation" quaternion and "translation").
+
+    Returns:
+        tuple: (color_intrinsics, registration), where registration is None if depth is already aligned to color.
+    """
+    color_intrinsics = CameraIntrinsics.from_dict(camera_config["color_intrinsics"])
+    depth_intrinsics = CameraIntrinsics.from_dict(camera_config.get("depth_intrinsics",
+                                                                    camera_config["color_intrinsics"]))
+    depth_to_color = Transform.from_dict(camera_config["depth_to_color"]) if "depth_to_color" in camera_config \
+        else Transform.identity()
+
+    if depth_intrinsics == color_intrinsics and np.allclose(depth_to_color.as_matrix(), np.eye(4)):
+        return color_intrinsics, None
+    return color_intrinsics, DepthRegistration(depth_intrinsics, color_intrinsics, depth_to_color)
@@ -0,0 +1,196 @@
+"""
+Frame Store
+===========================
+In-memory store for the latest camera frames, shared between the image callbacks and the reasoning loop.
+"""
+
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+import cv2
+import numpy as np
+
+
+# A single published frame. `stamp` is the capture time reported by the sensor (seconds), `recv_time` is the
+# local monotonic time at which the frame was published, and `seq` increases by one per published frame.
+Frame = namedtuple("Frame", ["image", "stamp", "seq", "recv_time"])
+
+# A time-synchronized color/depth pair. Both images share one `frame_id` (the sequence number of the color frame),
+# `stamp` is the color capture time and `recv_time` the publish time of the older of the two frames. `scene_version`
+# is set by a `SceneChangeDetector` and stays the same as long as the scene does not change.
+RGBDFrame = namedtuple("RGBDFrame", ["rgb", "depth", "stamp", "frame_id", "recv_time", "scene_version"],
+                       defaults=(None,))
+
+
+class FrameStore(object):
+    """Thread-safe latest-frame buffer for a set of named camera streams (e.g. "rgb", "depth").
+
+    Writers hand over a freshly converted array with `put` (or the arrays of several streams captured together with
+    `put_many`); the array is marked read-only and swapped in as the front buffer under a lock, so readers can take a
+    snapshot by reference without copying and can never observe a partially written frame. A short history of frames is kept per stream for approximate-time pairing.
+    """
+
+    def __init__(self, history=8):
+        self._cond = threading.Condition()
+        self._history_size = history
+        self._frames = {}
+
+    def put(self, stream, image, stamp=None):
+        """Publish a new frame for `stream` and return it.
+
+        The store takes ownership of `image`: it is made read-only and must not be modified by the caller afterwards.
+        """
+        return self.put_many({stream: image}, stamp)[stream]
+
+    def put_many(self, images, stamp=None):
+        """Publish new frames for several streams at once and return them by stream.
+
+        All frames are swapped in under a single lock acquisition, so a reader sees either all of them or none, e.g.
+        never the new color frame of a frameset paired with the previous depth frame. The store takes ownership of the
+        images, see `put`.
+        """
+        images = {stream: np.asarray(image) for stream, image in images.items()}
+        for image in images.values():
+            image.setflags(write=False)
+        recv_time = time.monotonic()
+        if stamp is None:
+            stamp = time.time()
+
+        published = {}
+        with self._cond:
+            for stream, image in images.items():
+                frames = self._frames.setdefault(stream, deque(maxlen=self._history_size))
+                seq = frames[-1].seq + 1 if frames else 0
+                published[stream] = Frame(image, stamp, seq, recv_time)
+                frames.append(published[stream])
+            self._cond.notify_all()
+
+        return published
+
+    def _latest(self, stream):
+        frames = self._frames.get(stream)
+        return frames[-1] if frames else None
+
+    def latest(self, stream):
+        """Return the latest frame of `stream`, or None if nothing has been published yet."""
+        with self._cond:
+            return self._latest(stream)
+
+    def previous(self, stream):
+        """Return the frame published before the latest one, or None."""
+        with self._cond:
+            frames = self._frames.get(stream)
+            return frames[-2] if frames and len(frames) > 1 else None
+
+    def snapshot(self, streams=("rgb", "depth")):
+        """Return a dict with the latest frame of each stream, taken under a single lock acquisition."""
+        with self._cond:
+            return {stream: self._latest(stream) for stream in streams}
+
+    def snapshot_rgbd(self, max_age=None, slop=0.05, rgb_stream="rgb", depth_stream="depth"):
+        """
+        Return the newest approximately time-synchronized color/depth pair, see `select_rgbd_pair`.
+
+        Parameters:
+            max_age (float): Maximum age in seconds of both frames, None to accept frames of any age.
+            slop (float): Maximum difference in seconds between the color and depth capture stamps.
+            rgb_stream (str): Name of the color stream.
+            depth_stream (str): Name of the depth stream.
+
+        Returns:
+            RGBDFrame: The synchronized pair, or None if no fresh pair is available.
+        """
+        with self._cond:
+            rgb_frames = list(self._frames.get(rgb_stream, ()))
+            depth_frames = list(self._frames.get(depth_stream, ()))
+
+        pair = select_rgbd_pair(rgb_frames, depth_frames, max_age, slop)
+        if pair is None:
+            return None
+        rgb, depth = pair
+        return RGBDFrame(rgb.image, depth.image, rgb.stamp, rgb.seq, min(rgb.recv_time, depth.recv_time))
+
+    def wait_next(self, stream, after_seq=None, timeout=None):
+        """Block until a frame newer than `after_seq` is published on `stream`.
+
+        Parameters:
+            stream (str): The stream name.
+            after_seq (int): Sequence number to wait past. Defaults to the current latest frame.
+            timeout (float): Maximum time to wait in seconds, None to wait forever.
+
+        Returns:
+            Frame: The new frame, or None on timeout.
+        """
+        with self._cond:
+            if after_seq is None:
+                current = self._latest(stream)
+                after_seq = current.seq if current is not None else -1
+
+            def _has_new_frame():
+                frame = self._latest(stream)
+                return frame is not None and frame.seq > after_seq
+
+            if not self._cond.wait_for(_has_new_frame, timeout):
+                return None
+            return self._latest(stream)
+
+
+def select_rgbd_pair(rgb_frames, depth_frames, max_age=None, slop=0.05):
+    """
+    Select the newest approximately time-synchronized pair from two frame histories.
+
+    Color frames are searched newest first; for each one the depth frame with the closest capture stamp is
+    selected, and the first pair whose stamps differ by at most `slop` seconds and whose frames are both younger
+    than `max_age` seconds is returned.
+
+    Parameters:
+        rgb_frames (list): Color frames (with `stamp` and `recv_time`), oldest first.
+        depth_frames (list): Depth frames (with `stamp` and `recv_time`), oldest first.
+        max_age (float): Maximum age in seconds of both frames, None to accept frames of any age.
+        slop (float): Maximum difference in seconds between the color and depth capture stamps.
+
+    Returns:
+        tuple: (rgb_frame, depth_frame), or None if no fresh pair is available.
+    """
+    if not rgb_frames or not depth_frames:
+        return None
+
+    depth_stamps = np.array([frame.stamp for frame in depth_frames])
+    now = time.monotonic()
+    for rgb in reversed(rgb_frames):
+        if max_age is not None and now - rgb.recv_time > max_age:
+            # older color frames are staler still
+            break
+        depth = depth_frames[int(np.argmin(np.abs(depth_stamps - rgb.stamp)))]
+        if abs(depth.stamp - rgb.stamp) > slop:
+            continue
+        if max_age is not None and now - depth.recv_time > max_age:
+            continue
+        return rgb, depth
+
+    return None
+
+
+def write_image_atomic(path, image):
+    """
+    Encode an image and write it to disk atomically, so readers never see a partially written file.
+
+    Parameters:
+        path (str): Destination file path; the extension selects the encoder.
+        image (np.ndarray): The image to write (BGR for color images, as with cv2.imwrite).
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    ext = os.path.splitext(path)[1] or ".png"
+    ok, buffer = cv2.imencode(ext, np.ascontiguousarray(image))
+    if not ok:
+        raise ValueError("Failed to encode image for {}".format(path))
+
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+    with open(tmp_path, "wb") as file:
+        file.write(buffer.tobytes())
+    os.replace(tmp_path, path)
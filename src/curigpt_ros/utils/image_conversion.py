@@ -0,0 +1,90 @@
+"""
+Image Conversion
+===========================
+Conversion of sensor_msgs/Image messages to numpy arrays without cv_bridge, as zero-copy views where possible. The
+module does not import rospy, the messages are only read through their fields.
+"""
+
+import cv2
+import numpy as np
+
+
+# ROS image encodings supported by `image_msg_to_numpy`: encoding -> (dtype, channels)
+IMAGE_ENCODINGS = {
+    "bgr8": (np.uint8, 3),
+    "rgb8": (np.uint8, 3),
+    "bgra8": (np.uint8, 4),
+    "rgba8": (np.uint8, 4),
+    "mono8": (np.uint8, 1),
+    "8UC1": (np.uint8, 1),
+    "8UC3": (np.uint8, 3),
+    "mono16": (np.uint16, 1),
+    "16UC1": (np.uint16, 1),
+    "32FC1": (np.float32, 1),
+}
+
+# The 8-bit color conversions that need new pixels, as cv_bridge does them: (encoding, desired encoding) -> code
+_CVT_CODES = {
+    ("mono8", "bgr8"): cv2.COLOR_GRAY2BGR,
+    ("mono8", "rgb8"): cv2.COLOR_GRAY2RGB,
+    ("mono8", "bgra8"): cv2.COLOR_GRAY2BGRA,
+    ("mono8", "rgba8"): cv2.COLOR_GRAY2RGBA,
+    ("bgr8", "mono8"): cv2.COLOR_BGR2GRAY,
+    ("rgb8", "mono8"): cv2.COLOR_RGB2GRAY,
+    ("bgra8", "mono8"): cv2.COLOR_BGRA2GRAY,
+    ("rgba8", "mono8"): cv2.COLOR_RGBA2GRAY,
+    ("bgr8", "bgra8"): cv2.COLOR_BGR2BGRA,
+    ("bgr8", "rgba8"): cv2.COLOR_BGR2RGBA,
+    ("rgb8", "rgba8"): cv2.COLOR_RGB2RGBA,
+    ("rgb8", "bgra8"): cv2.COLOR_RGB2BGRA,
+    ("bgra8", "rgba8"): cv2.COLOR_BGRA2RGBA,
+    ("rgba8", "bgra8"): cv2.COLOR_RGBA2BGRA,
+}
+
+
+def image_msg_to_numpy(msg, desired_encoding="passthrough"):
+    """Convert a sensor_msgs/Image message to a numpy array without copying the pixel data.
+
+    The array is a read-only view on `msg.data`; row padding (`step`) and big-endian data are handled through the
+    view's strides and dtype. Single-channel images have shape (H, W), others (H, W, C).
+
+    Args:
+        msg: The sensor_msgs/Image message.
+        desired_encoding: "passthrough" to keep the message encoding, or "bgr8"/"rgb8" to get a 3-channel color
+            image; swapping between rgb8 and bgr8 is a reversed-channel view and does not copy either. Conversions
+            that need new pixels (e.g. mono8 to bgr8) copy through `cv2.cvtColor` like cv_bridge does, and anything
+            else falls back to cv_bridge itself.
+    """
+    if msg.encoding not in IMAGE_ENCODINGS:
+        return _cv_bridge_to_numpy(msg, desired_encoding)
+
+    dtype, channels = IMAGE_ENCODINGS[msg.encoding]
+    dtype = np.dtype(dtype).newbyteorder(">" if msg.is_bigendian else "<")
+    data = msg.data if isinstance(msg.data, (bytes, bytearray, memoryview)) else bytes(msg.data)
+
+    shape = (msg.height, msg.width, channels)
+    strides = (msg.step, channels * dtype.itemsize, dtype.itemsize)
+    image = np.ndarray(shape, dtype=dtype, buffer=data, strides=strides)
+    image.setflags(write=False)
+
+    if desired_encoding in ("passthrough", msg.encoding):
+        pass
+    elif {desired_encoding, msg.encoding} == {"bgr8", "rgb8"}:
+        image = image[..., ::-1]
+    elif desired_encoding in ("bgr8", "rgb8") and msg.encoding in ("bgra8", "rgba8"):
+        image = image[..., :3] if desired_encoding[:3] == msg.encoding[:3] else image[..., 2::-1]
+    elif (msg.encoding, desired_encoding) in _CVT_CODES:
+        return cv2.cvtColor(np.ascontiguousarray(image), _CVT_CODES[msg.encoding, desired_encoding])
+    else:
+        return _cv_bridge_to_numpy(msg, desired_encoding)
+
+    return image[..., 0] if channels == 1 else image
+
+
+def _cv_bridge_to_numpy(msg, desired_encoding):
+    """Convert an image message with cv_bridge, for the encodings and conversions without a fast path."""
+    try:
+        from cv_bridge import CvBridge
+    except ImportError:
+        raise ValueError("Cannot convert encoding {} to {} without cv_bridge".format(msg.encoding, desired_encoding))
+    return CvBridge().imgmsg_to_cv2(msg, desired_encoding)
@@ -0,0 +1,145 @@
+"""
+Image Encoding
+===========================
+Size-adaptive, content-addressed image encoding for the multimodal LLM uploads.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict, namedtuple
+
+import cv2
+import numpy as np
+
+
+# An encoded image. `path` is the content-addressed file handed to the MLLM, `scale` the resize factor applied to
+# both axes. Since the aspect ratio is kept and nothing is cropped, normalized 0-1000 bbox coordinates predicted on
+# the encoded image are valid on the original image as well.
+EncodedImage = namedtuple("EncodedImage", ["path", "data", "content_hash", "width", "height", "scale"])
+
+_ENCODE_PARAMS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+    "png": (".png", None),
+}
+
+
+def image_content_hash(image):
+    """Return a hex digest of the pixel content, shape and dtype of an image."""
+    image = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("{}{}".format(image.shape, image.dtype.str).encode())
+    digest.update(memoryview(image).cast("B"))
+    return digest.hexdigest()
+
+
+def fit_to_pixel_budget(image, max_pixels):
+    """Downsize an image, keeping its aspect ratio, so that it has at most `max_pixels` pixels."""
+    height, width = image.shape[:2]
+    scale = min(1.0, np.sqrt(max_pixels / float(width * height))) if max_pixels else 1.0
+    if scale >= 1.0:
+        return image, 1.0
+    size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+    return cv2.resize(np.ascontiguousarray(image), size, interpolation=cv2.INTER_AREA), scale
+
+
+class ImageEncoder(object):
+    """Encode frames for upload to a pixel budget, caching the results by frame content.
+
+    Encoded images are written once to `cache_dir` under their content hash and the encoding parameters, so retries
+    and repeated turns on the same frame reuse both the bytes and the file instead of re-encoding, while encoders
+    with other parameters (e.g. the scene and the crop encoders) or a changed config never share a file.
+
+    Attributes:
+        hits (int), misses (int): Cache statistics.
+    """
+
+    def __init__(self, max_pixels=1280 * 720, image_format="jpeg", quality=85, cache_dir="assets/cache/encoded",
+                 cache_size=32):
+        if image_format not in _ENCODE_PARAMS:
+            raise ValueError("Image format must be one of {}.".format(sorted(_ENCODE_PARAMS)))
+        self.max_pixels = max_pixels
+        self.image_format = image_format
+        self.quality = quality
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        # the encoding parameters, part of the cache keys and file names
+        self.variant = "{}px_{}_q{}".format(max_pixels or 0, image_format, quality)
+
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create an encoder from the "image_encoding" section of the config."""
+        return cls(max_pixels=config.get("max_pixels", 1280 * 720), image_format=config.get("format", "jpeg"),
+                   quality=config.get("quality", 85), cache_dir=config.get("cache_dir", "assets/cache/encoded"))
+
+    def _lookup(self, key):
+        encoded = self._cache.get(key)
+        if encoded is not None and os.path.exists(encoded.path):
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return encoded
+        self.misses += 1
+        return None
+
+    def _store(self, key, encoded):
+        self._cache[key] = encoded
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def encode(self, image, content_hash=None):
+        """
+        Encode a BGR image for upload.
+
+        Parameters:
+            image (np.ndarray): The BGR image.
+            content_hash (str): The content hash of the image if already known, see `image_content_hash`.
+
+        Returns:
+            EncodedImage: The encoded image.
+        """
+        if content_hash is None:
+            content_hash = image_content_hash(image)
+        key = "{}_{}".format(content_hash, self.variant)
+        encoded = self._lookup(key)
+        if encoded is not None:
+            return encoded
+
+        resized, scale = fit_to_pixel_budget(image, self.max_pixels)
+        extension, quality_flag = _ENCODE_PARAMS[self.image_format]
+        params = [quality_flag, int(self.quality)] if quality_flag is not None else []
+        ok, buffer = cv2.imencode(extension, np.ascontiguousarray(resized), params)
+        if not ok:
+            raise ValueError("Failed to encode image as {}".format(self.image_format))
+        data = buffer.tobytes()
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        path = os.path.join(self.cache_dir, key + extension)
+        if not os.path.exists(path):
+            tmp_path = "{}.tmp{}".format(path, os.getpid())
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+
+        encoded = EncodedImage(path, data, content_hash, resized.shape[1], resized.shape[0], scale)
+        self._store(key, encoded)
+        return encoded
+
+    def encode_file(self, image_path):
+        """Encode an image file for upload, keyed by the file content so unchanged files are not decoded again."""
+        with open(image_path, "rb") as file:
+            file_hash = hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+        key = "file:" + file_hash
+        encoded = self._lookup(key)
+        if encoded is not None:
+            return encoded
+
+        # the lookup above counted a miss, the encode below must not count another one
+        self.misses -= 1
+        encoded = self.encode(cv2.imread(image_path, cv2.IMREAD_COLOR), content_hash=file_hash)
+        self._store(key, encoded)
+        return encoded
@@ -0,0 +1,133 @@
+"""
+RealSense Source
+===========================
+Long-lived RealSense capture that keeps the pipeline running and serves the latest color and aligned depth frames.
+"""
+
+import threading
+
+import numpy as np
+import pyrealsense2 as rs
+from curigpt_ros.utils.depth_utils import CameraIntrinsics
+from curigpt_ros.utils.frame_store import FrameStore, RGBDFrame
+
+
+class RealSenseSource(object):
+    """Persistent RealSense pipeline feeding a `FrameStore`.
+
+    The pipeline is started once and delivers framesets into a small `rs.frame_queue`; a background thread aligns
+    depth to color and publishes both images into the frame store atomically (as "rgb" and "depth" with the same
+    stamp, see `FrameStore.put_many`), so that a snapshot never pairs the color and depth of two framesets, and a
+    capture costs no device startup and readers only pay for a dictionary lookup.
+
+    Attributes:
+        frame_store (FrameStore): The store receiving the frames, shareable with the ROS camera path.
+        color_intrinsics (CameraIntrinsics): The intrinsics of the active color stream, which the aligned depth
+            shares, available once started.
+        depth_scale (float): Meters per raw depth unit, available once started.
+    """
+
+    def __init__(self, width=640, height=480, fps=30, enable_depth=True, queue_size=2, warmup_frames=30,
+                 frame_store=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.enable_depth = enable_depth
+        self.warmup_frames = warmup_frames
+        self.frame_store = frame_store if frame_store is not None else FrameStore()
+        self.color_intrinsics = None
+        self.depth_scale = None
+
+        self._pipeline = rs.pipeline()
+        self._queue = rs.frame_queue(queue_size)
+        self._align = rs.align(rs.stream.color) if enable_depth else None
+        self._thread = None
+        self._running = threading.Event()
+
+    def start(self):
+        """Start the pipeline and the frame publishing thread."""
+        config = rs.config()
+        config.enable_stream(rs.stream.color, self.width, self.height, rs.format.bgr8, self.fps)
+        if self.enable_depth:
+            config.enable_stream(rs.stream.depth, self.width, self.height, rs.format.z16, self.fps)
+
+        profile = self._pipeline.start(config, self._queue)
+        color_profile = profile.get_stream(rs.stream.color).as_video_stream_profile()
+        self.color_intrinsics = CameraIntrinsics.from_realsense(color_profile.get_intrinsics())
+        if self.enable_depth:
+            self.depth_scale = profile.get_device().first_depth_sensor().get_depth_scale()
+
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="realsense_source", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the publishing thread and the pipeline."""
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._pipeline.stop()
+
+    def _run(self):
+        skipped = 0
+        while self._running.is_set():
+            try:
+                frame = self._queue.wait_for_frame(100)
+            except RuntimeError:
+                # timeout without a new frameset
+                continue
+
+            # let auto-exposure settle before publishing frames
+            if skipped < self.warmup_frames:
+                skipped += 1
+                continue
+
+            frames = frame.as_frameset()
+            if self._align is not None:
+                frames = self._align.process(frames)
+
+            color_frame = frames.get_color_frame()
+            if not color_frame:
+                continue
+            depth_frame = frames.get_depth_frame() if self.enable_depth else None
+            if self.enable_depth and not depth_frame:
+                continue
+
+            # copy out of the librealsense frame pool so the frames can be released immediately
+            stamp = frames.get_timestamp() / 1000.0
+            images = {"rgb": np.array(color_frame.get_data())}
+            if depth_frame:
+                images["depth"] = np.array(depth_frame.get_data())
+            self.frame_store.put_many(images, stamp)
+
+    def latest(self):
+        """
+        Return the latest color frame and its aligned depth frame.
+
+        Returns:
+            RGBDFrame: The latest frame pair (with depth None if depth is disabled), or None before the first frame.
+        """
+        if self.enable_depth:
+            # color and depth of one frameset share the same stamp
+            return self.frame_store.snapshot_rgbd(slop=1e-6)
+
+        rgb = self.frame_store.latest("rgb")
+        if rgb is None:
+            return None
+        return RGBDFrame(rgb.image, None, rgb.stamp, rgb.seq, rgb.recv_time)
+
+    def wait_next(self, timeout=None):
+        """
+        Block until a frame newer than the current latest one is published and return it.
+
+        Parameters:
+            timeout (float): Maximum time to wait in seconds, None to wait forever.
+
+        Returns:
+            RGBDFrame: The new frame pair, or None on timeout.
+        """
+        # the color and depth images of a frameset are published together
+        if self.frame_store.wait_next("rgb", timeout=timeout) is None:
+            return None
+        return self.latest()
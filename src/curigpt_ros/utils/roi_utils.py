@@ -0,0 +1,155 @@
+"""
+ROI Utilities
+===========================
+Two-stage grounding: refine the bounding boxes of a low-resolution scene pass on high-resolution crops around them.
+"""
+
+import copy
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def normalized_to_pixels(bbox, width, height):
+    """Convert a bbox [x1, y1, x2, y2] in normalized 0-1000 coordinates to float pixel coordinates."""
+    x1, y1, x2, y2 = bbox
+    return np.array([x1 * width, y1 * height, x2 * width, y2 * height], dtype=np.float64) / 1000.0
+
+
+def crop_box_around(bbox, width, height, margin=0.5, min_size=0.15):
+    """
+    Compute the pixel crop box around a normalized bbox.
+
+    Parameters:
+        bbox (list): The bbox [x1, y1, x2, y2] in normalized 0-1000 coordinates.
+        width (int), height (int): The size of the full frame.
+        margin (float): The context added on each side, as a fraction of the bbox size.
+        min_size (float): The minimum crop size, as a fraction of the frame size, so that small boxes keep context.
+
+    Returns:
+        tuple: The integer crop box (x0, y0, x1, y1) in pixels, clipped to the frame.
+    """
+    x1, y1, x2, y2 = normalized_to_pixels(bbox, width, height)
+    crop_w = max((x2 - x1) * (1 + 2 * margin), min_size * width)
+    crop_h = max((y2 - y1) * (1 + 2 * margin), min_size * height)
+    center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+
+    x0 = int(np.clip(np.floor(center_x - crop_w / 2), 0, width - 1))
+    y0 = int(np.clip(np.floor(center_y - crop_h / 2), 0, height - 1))
+    x1 = int(np.clip(np.ceil(center_x + crop_w / 2), x0 + 1, width))
+    y1 = int(np.clip(np.ceil(center_y + crop_h / 2), y0 + 1, height))
+    return x0, y0, x1, y1
+
+
+def crop_bbox_to_frame(bbox, crop_box, width, height):
+    """Map a normalized 0-1000 bbox predicted on a crop back to normalized 0-1000 coordinates of the full frame."""
+    x0, y0, x1, y1 = crop_box
+    bx1, by1, bx2, by2 = normalized_to_pixels(bbox, x1 - x0, y1 - y0)
+    frame_bbox = np.array([(bx1 + x0) / width, (by1 + y0) / height, (bx2 + x0) / width, (by2 + y0) / height])
+    return [int(round(value)) for value in np.clip(frame_bbox * 1000.0, 0, 1000)]
+
+
+_NUMBER = r"-?\d+(?:\.\d+)?"
+# the Qwen-VL box format, <box>(x1,y1),(x2,y2)</box>
+_POINT = r"\(\s*({0})\s*,\s*({0})\s*\)".format(_NUMBER)
+_BOX_PATTERN = re.compile(r"<box>\s*{0}\s*,\s*{0}\s*</box>".format(_POINT))
+# the JSON bbox, {"bbox_coordinates": [x1, y1, x2, y2]}, or the bare list
+_JSON_BBOX_PATTERN = re.compile(r'"bbox_coordinates"\s*:\s*(\[[^\[\]]*\])|^\s*(\[[^\[\]]*\])\s*$')
+
+
+def parse_bbox(text):
+    """
+    Extract the bbox from a grounding response, either JSON ("bbox_coordinates": [x1, y1, x2, y2], or the bare list)
+    or the Qwen-VL box format (<box>(x1,y1),(x2,y2)</box>). Other numbers in the response, such as those of a
+    description ("7up can"), are ignored, and decimal coordinates are rounded.
+
+    Returns:
+        list: The bbox [x1, y1, x2, y2] in normalized 0-1000 coordinates, or None if there is no valid bbox.
+    """
+    if not text:
+        return None
+    box_match = _BOX_PATTERN.search(text)
+    json_match = _JSON_BBOX_PATTERN.search(text)
+    if box_match is not None:
+        values = [float(value) for value in box_match.groups()]
+    elif json_match is not None:
+        try:
+            values = json.loads(json_match.group(1) or json_match.group(2))
+        except ValueError:
+            return None
+        if len(values) != 4 or not all(isinstance(value, (int, float)) and not isinstance(value, bool)
+                                       for value in values):
+            return None
+    else:
+        return None
+    values = [int(round(value)) for value in values]
+    x1, y1, x2, y2 = values
+    if not (0 <= x1 < x2 <= 1000 and 0 <= y1 < y2 <= 1000):
+        return None
+    return values
+
+
+def boxes_overlap(bbox_a, bbox_b):
+    """Whether two [x1, y1, x2, y2] boxes intersect."""
+    return bbox_a[0] < bbox_b[2] and bbox_b[0] < bbox_a[2] and bbox_a[1] < bbox_b[3] and bbox_b[1] < bbox_a[3]
+
+
+def bbox_iou(bbox_a, bbox_b):
+    """Return the intersection over union of two [x1, y1, x2, y2] boxes."""
+    width = min(bbox_a[2], bbox_b[2]) - max(bbox_a[0], bbox_b[0])
+    height = min(bbox_a[3], bbox_b[3]) - max(bbox_a[1], bbox_b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = ((bbox_a[2] - bbox_a[0]) * (bbox_a[3] - bbox_a[1]) + (bbox_b[2] - bbox_b[0]) * (bbox_b[3] - bbox_b[1])
+             - intersection)
+    return intersection / union
+
+
+def refine_action_bboxes(action_response, image, locate, image_encoder, margin=0.5, min_size=0.15):
+    """
+    Refine the bboxes of the action arguments on high-resolution crops of the full frame.
+
+    Each argument bbox is cropped with some context from the full-resolution frame, the crop is located again by
+    `locate`, and the refined bbox is mapped back to the full-frame 0-1000 space. A refinement that cannot be parsed
+    or does not overlap the coarse bbox (likely another object) keeps the coarse bbox. The crops are located in
+    parallel.
+
+    Parameters:
+        action_response (list): The robot actions of the scene pass.
+        image (np.ndarray): The full-resolution BGR frame the scene pass was made on.
+        locate (callable): `locate(image_path, description)` returning the grounding response text for a crop.
+        image_encoder (ImageEncoder): The encoder for the crop uploads.
+        margin (float), min_size (float): The crop context, see `crop_box_around`.
+
+    Returns:
+        list: A copy of the robot actions with the refined bboxes.
+    """
+    height, width = image.shape[:2]
+    refined_actions = copy.deepcopy(action_response)
+    arguments = [argument for action in refined_actions for argument in action.get("parameters", {}).values()
+                 if isinstance(argument, dict) and argument.get("bbox_coordinates")]
+    if not arguments:
+        return refined_actions
+
+    def refine(argument):
+        coarse_bbox = argument["bbox_coordinates"]
+        crop_box = crop_box_around(coarse_bbox, width, height, margin, min_size)
+        x0, y0, x1, y1 = crop_box
+        crop_path = image_encoder.encode(image[y0:y1, x0:x1]).path
+        crop_bbox = parse_bbox(locate(crop_path, argument.get("description", "the object")))
+        if crop_bbox is None:
+            return coarse_bbox
+        refined_bbox = crop_bbox_to_frame(crop_bbox, crop_box, width, height)
+        return refined_bbox if boxes_overlap(refined_bbox, coarse_bbox) else coarse_bbox
+
+    with ThreadPoolExecutor(max_workers=len(arguments)) as executor:
+        refined_bboxes = list(executor.map(refine, arguments))
+
+    for argument, refined_bbox in zip(arguments, refined_bboxes):
+        print("Refined bbox of {}: {} -> {}".format(argument.get("description"), argument["bbox_coordinates"],
+                                                   refined_bbox))
+        argument["bbox_coordinates"] = refined_bbox
+    return refined_actions
@@ -1,10 +1,11 @@
 import geometry_msgs.msg
 import numpy as np
 import rospy
-from sensor_msgs.msg import PointCloud2, PointField
+from sensor_msgs.msg import CameraInfo, PointCloud2, PointField
 import std_msgs.msg
 import tf2_ros
 from curigpt_ros.utils.transform import Rotation, Transform
+from curigpt_ros.utils.depth_utils import CameraIntrinsics
 
 
 def to_point_msg(position):
@@ -84,6 +85,12 @@ def to_color_msg(color):
     return msg
 
 
+def wait_for_camera_intrinsics(topic, timeout=5.0):
+    """Wait for a CameraInfo message on `topic` and return its intrinsics as `CameraIntrinsics`."""
+    msg = rospy.wait_for_message(topic, CameraInfo, timeout)
+    return CameraIntrinsics.from_camera_info(msg)
+
+
 def to_cloud_msg(points, intensities=None, frame=None, stamp=None):
     """Convert list of unstructured points to a PointCloud2 message.
 
@@ -0,0 +1,88 @@
+"""
+Scene Utilities
+===========================
+Cheap scene-change detection over consecutive camera snapshots, so unchanged scenes can reuse earlier results.
+"""
+
+import cv2
+import numpy as np
+
+
+def difference_hash(gray, hash_size=8):
+    """Return the difference hash (dHash) of a grayscale image as a boolean array of hash_size**2 bits."""
+    resized = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return (resized[:, 1:] > resized[:, :-1]).ravel()
+
+
+class SceneChangeDetector(object):
+    """Tag consecutive snapshots with a scene version that only increases when the scene visibly changes.
+
+    Each snapshot is compared with the reference snapshot of the current version, by the Hamming distance of their
+    perceptual difference hashes and by the mean absolute difference of their downsampled grayscale images. Comparing
+    with the reference rather than the previous snapshot keeps slow drifts from going unnoticed.
+
+    Attributes:
+        scene_version (int): The current scene version, -1 before the first snapshot.
+    """
+
+    def __init__(self, hash_size=8, thumbnail_size=(32, 24), hash_threshold=6, diff_threshold=8.0):
+        self.hash_size = hash_size
+        self.thumbnail_size = thumbnail_size
+        self.hash_threshold = hash_threshold
+        self.diff_threshold = diff_threshold
+
+        self.scene_version = -1
+        self._reference_hash = None
+        self._reference_thumbnail = None
+
+    def update(self, image):
+        """
+        Compare a BGR (or grayscale) snapshot with the current scene and return its scene version.
+
+        Parameters:
+            image (np.ndarray): The snapshot.
+
+        Returns:
+            int: The scene version, incremented if the scene changed.
+        """
+        image = np.ascontiguousarray(image)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        thumbnail = cv2.resize(gray, self.thumbnail_size, interpolation=cv2.INTER_AREA).astype(np.float32)
+        image_hash = difference_hash(thumbnail, self.hash_size)
+
+        if self._reference_hash is None or self.is_changed(image_hash, thumbnail):
+            self.scene_version += 1
+            self._reference_hash = image_hash
+            self._reference_thumbnail = thumbnail
+
+        return self.scene_version
+
+    def is_changed(self, image_hash, thumbnail):
+        """Whether a hash/thumbnail pair differs from the current reference snapshot."""
+        hash_distance = np.count_nonzero(image_hash != self._reference_hash)
+        mean_difference = np.abs(thumbnail - self._reference_thumbnail).mean()
+        return hash_distance > self.hash_threshold or mean_difference > self.diff_threshold
+
+
+class SceneCache(object):
+    """Results computed for one scene version (uploaded image, detections, scene description, ...).
+
+    All entries are dropped as soon as a different scene version is seen.
+    """
+
+    def __init__(self):
+        self.scene_version = None
+        self._entries = {}
+
+    def _sync(self, scene_version):
+        if scene_version != self.scene_version:
+            self.scene_version = scene_version
+            self._entries = {}
+
+    def get(self, scene_version, key, default=None):
+        self._sync(scene_version)
+        return self._entries.get(key, default)
+
+    def put(self, scene_version, key, value):
+        self._sync(scene_version)
+        self._entries[key] = value
@@ -0,0 +1,232 @@
+"""
+Shared-Memory Frames
+===========================
+Hand camera frames from a separate capture process to the reasoning process through shared memory, so image
+decoding does not compete for the GIL with audio recording, MLLM calls and plotting.
+"""
+
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import rospy
+from sensor_msgs.msg import Image as RosImage
+from curigpt_ros.utils.frame_store import Frame, RGBDFrame, select_rgbd_pair
+from curigpt_ros.utils.image_conversion import image_msg_to_numpy
+
+
+class SharedFrameRing(object):
+    """Fixed-size ring of frames of one stream in a `multiprocessing.shared_memory` block.
+
+    Layout: an int64 header with the latest sequence number and, per slot, the sequence number of the frame it
+    holds (-1 while empty or being written) and a reader pin flag; a float64 (stamp, recv_time) table; then the
+    frame data. The writer never reuses a pinned slot, so a reader can map a frame without copying and keep it for
+    as long as it stays pinned. Slot bookkeeping is done under a shared lock, the pixel copy is not.
+    """
+
+    def __init__(self, name, shape, dtype, slots, lock, create=False):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self._lock = lock
+
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        counter_bytes = 8 * (1 + 2 * slots)
+        time_bytes = 8 * 2 * slots
+        size = counter_bytes + time_bytes + slots * frame_bytes
+
+        self._shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self.name = self._shm.name
+
+        buffer = self._shm.buf
+        counters = np.ndarray((1 + 2 * slots,), dtype=np.int64, buffer=buffer)
+        self._latest = counters[0:1]
+        self._slot_seq = counters[1:1 + slots]
+        self._pinned = counters[1 + slots:]
+        self._times = np.ndarray((slots, 2), dtype=np.float64, buffer=buffer, offset=counter_bytes)
+        self._frames = np.ndarray((slots,) + self.shape, dtype=self.dtype, buffer=buffer,
+                                  offset=counter_bytes + time_bytes)
+
+        if create:
+            self._latest[0] = -1
+            self._slot_seq[:] = -1
+            self._pinned[:] = 0
+
+    def write(self, image, stamp):
+        """Copy a frame into the oldest unpinned slot and publish it (writer side)."""
+        with self._lock:
+            free = np.flatnonzero(self._pinned == 0)
+            if free.size == 0:
+                return
+            slot = free[np.argmin(self._slot_seq[free])]
+            self._slot_seq[slot] = -1
+
+        np.copyto(self._frames[slot], image)
+        self._times[slot] = (stamp, time.monotonic())
+
+        with self._lock:
+            seq = self._latest[0] + 1
+            self._slot_seq[slot] = seq
+            self._latest[0] = seq
+
+    def frames(self):
+        """Return the published frames, oldest first, as `Frame` tuples with the slot index as `image`."""
+        with self._lock:
+            slot_seq = self._slot_seq.copy()
+            times = self._times.copy()
+        slots = [slot for slot in np.argsort(slot_seq) if slot_seq[slot] >= 0]
+        return [Frame(int(slot), times[slot, 0], int(slot_seq[slot]), times[slot, 1]) for slot in slots]
+
+    def pin(self, frame):
+        """Pin the slot of `frame` and return a read-only view of it, or None if the slot was overwritten."""
+        with self._lock:
+            if self._slot_seq[frame.image] != frame.seq:
+                return None
+            self._pinned[frame.image] = 1
+        view = self._frames[frame.image]
+        view.setflags(write=False)
+        return view
+
+    def unpin_all(self):
+        with self._lock:
+            self._pinned[:] = 0
+
+    def close(self, unlink=False):
+        self._latest = self._slot_seq = self._pinned = self._times = self._frames = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # views handed out to readers are still alive, the mapping is released with them
+            pass
+        if unlink:
+            self._shm.unlink()
+
+
+def capture_worker(spec_queue, lock, stop_event, topics, slots):
+    """
+    Capture process: subscribe to the camera topics and write the frames into shared-memory rings.
+
+    The rings are created on the first frame of each stream, and their (stream, name, shape, dtype) are sent to
+    the reader through `spec_queue`.
+    """
+    rospy.init_node('curigpt_capture', anonymous=True, disable_signals=True)
+    rings = {}
+
+    def make_callback(stream, encoding):
+        def callback(msg):
+            try:
+                image = image_msg_to_numpy(msg, encoding)
+            except ValueError as e:
+                print(e)
+                return
+            ring = rings.get(stream)
+            if ring is None:
+                ring = SharedFrameRing(None, image.shape, image.dtype, slots, lock, create=True)
+                rings[stream] = ring
+                spec_queue.put((stream, ring.name, image.shape, image.dtype.str))
+            ring.write(image, msg.header.stamp.to_sec())
+        return callback
+
+    subscribers = [rospy.Subscriber(topic, RosImage, make_callback(stream, encoding), queue_size=1)
+                   for stream, (topic, encoding) in topics.items()]
+
+    try:
+        while not stop_event.is_set() and not rospy.is_shutdown():
+            stop_event.wait(0.1)
+    finally:
+        for subscriber in subscribers:
+            subscriber.unregister()
+        rospy.signal_shutdown("Capture process stopped.")
+        for ring in rings.values():
+            ring.close(unlink=True)
+
+
+class SharedFrameReader(object):
+    """Reader side of the shared-memory rings, with the same snapshot API as `FrameStore`.
+
+    Returned images are read-only views into shared memory. They stay valid until the next snapshot call on this
+    reader, which releases the previously pinned slots.
+    """
+
+    def __init__(self, spec_queue, lock, slots):
+        self._spec_queue = spec_queue
+        self._lock = lock
+        self._slots = slots
+        self._rings = {}
+
+    def _attach(self):
+        while True:
+            try:
+                stream, name, shape, dtype = self._spec_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._rings[stream] = SharedFrameRing(name, shape, dtype, self._slots, self._lock)
+
+    def _release(self):
+        for ring in self._rings.values():
+            ring.unpin_all()
+
+    def latest(self, stream):
+        """Return the latest frame of `stream` as a pinned `Frame`, or None."""
+        self._attach()
+        self._release()
+        ring = self._rings.get(stream)
+        frames = ring.frames() if ring is not None else []
+        for frame in reversed(frames):
+            image = ring.pin(frame)
+            if image is not None:
+                return frame._replace(image=image)
+        return None
+
+    def snapshot_rgbd(self, max_age=None, slop=0.05, rgb_stream="rgb", depth_stream="depth"):
+        """Return the newest synchronized color/depth pair as pinned views, see `FrameStore.snapshot_rgbd`."""
+        self._attach()
+        self._release()
+        if rgb_stream not in self._rings or depth_stream not in self._rings:
+            return None
+
+        rgb_ring, depth_ring = self._rings[rgb_stream], self._rings[depth_stream]
+        pair = select_rgbd_pair(rgb_ring.frames(), depth_ring.frames(), max_age, slop)
+        if pair is None:
+            return None
+        rgb, depth = pair
+        rgb_image, depth_image = rgb_ring.pin(rgb), depth_ring.pin(depth)
+        if rgb_image is None or depth_image is None:
+            # overwritten between selection and pinning, take the next pair
+            return self.snapshot_rgbd(max_age, slop, rgb_stream, depth_stream)
+        return RGBDFrame(rgb_image, depth_image, rgb.stamp, rgb.seq, min(rgb.recv_time, depth.recv_time))
+
+    def close(self):
+        self._release()
+        for ring in self._rings.values():
+            ring.close()
+        self._rings = {}
+
+
+class CaptureProcess(object):
+    """Run `capture_worker` in a separate process and expose a `SharedFrameReader` on its frames.
+
+    Attributes:
+        reader (SharedFrameReader): The reader for the reasoning process.
+    """
+
+    def __init__(self, topics=None, slots=4):
+        if topics is None:
+            topics = {"rgb": ("/camera/color/image_raw", "bgr8"), "depth": ("/camera/depth/image_raw", "passthrough")}
+        context = mp.get_context("spawn")
+        lock = context.Lock()
+        spec_queue = context.Queue()
+        self._stop_event = context.Event()
+        self._process = context.Process(target=capture_worker, name="curigpt_capture",
+                                        args=(spec_queue, lock, self._stop_event, topics, slots), daemon=True)
+        self.reader = SharedFrameReader(spec_queue, lock, slots)
+
+    def start(self):
+        self._process.start()
+
+    def stop(self, timeout=5.0):
+        self.reader.close()
+        self._stop_event.set()
+        self._process.join(timeout)
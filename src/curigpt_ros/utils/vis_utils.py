@@ -1,25 +1,27 @@
 #!/usr/bin/env python
 import rospy
 from sensor_msgs.msg import Image as RosImage
-from cv_bridge import CvBridge, CvBridgeError
 from PIL import Image, ImageDraw
 import cv2
-import pyrealsense2 as rs
 import os
-import time
-import json
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
-import open3d as o3d
+from curigpt_ros.utils.frame_store import FrameStore, write_image_atomic
+from curigpt_ros.utils.image_conversion import image_msg_to_numpy
+from curigpt_ros.utils.realsense_utils import RealSenseSource
+from curigpt_ros.utils.depth_utils import GEMINI_INTRINSICS, depth_to_meters, deproject_bboxes_robust, depth_to_point_cloud
 
 class ImageSaver:
-    def __init__(self):
-        self.bridge = CvBridge()
+    def __init__(self, frame_store=None):
         self.rgb_callback_flag = False
         self.depth_callback_flag = False
 
-        # Image save rate parameter
+        # In-memory store holding the latest frames for the reasoning loop
+        self.frame_store = frame_store if frame_store is not None else FrameStore()
+
+        # Optional, throttled disk persistence of the latest frames
+        self.save_to_disk = rospy.get_param('~save_to_disk', False)
         self.save_rate = rospy.get_param('~save_rate', 1)  # Default to 1 Hz
         self.rate = rospy.Rate(self.save_rate)
 
@@ -36,10 +38,11 @@ class ImageSaver:
         self.depth_save_dir = "assets/img/realtime_depth"
 
         # Create directories if they don't exist
-        if not os.path.exists(self.rgb_save_dir):
-            os.makedirs(self.rgb_save_dir)
-        if not os.path.exists(self.depth_save_dir):
-            os.makedirs(self.depth_save_dir)
+        if self.save_to_disk:
+            if not os.path.exists(self.rgb_save_dir):
+                os.makedirs(self.rgb_save_dir)
+            if not os.path.exists(self.depth_save_dir):
+                os.makedirs(self.depth_save_dir)
 
         self.image_count = 0
 
@@ -49,40 +52,40 @@ class ImageSaver:
     def rgb_callback(self, data):
         self.rgb_callback_flag = True  # Set flag to true when image is received
 
+        try:
+            # View the ROS image message as a BGR numpy array without copying
+            cv_image = image_msg_to_numpy(data, "bgr8")
+        except ValueError as e:
+            print(e)
+            return
+
+        self.frame_store.put("rgb", cv_image, data.header.stamp.to_sec())
+        self.image_count += 1
+
         current_time = rospy.Time.now()
-        if (current_time - self.last_rgb_save_time).to_sec() > 1 / self.save_rate:
-            try:
-                # Convert ROS image message to OpenCV image
-                cv_image = self.bridge.imgmsg_to_cv2(data, "bgr8")
-                img_filename = os.path.join(self.rgb_save_dir, "realtime_rgb.png")
-                cv2.imwrite(img_filename, cv_image)
-                # print(f"Saved RGB image to {img_filename}")
-                self.image_count += 1
-                self.last_rgb_save_time = current_time
-            except CvBridgeError as e:
-                print(e)
+        if self.save_to_disk and (current_time - self.last_rgb_save_time).to_sec() > 1.0 / self.save_rate:
+            img_filename = os.path.join(self.rgb_save_dir, "realtime_rgb.png")
+            write_image_atomic(img_filename, cv_image)
+            self.last_rgb_save_time = current_time
 
     def depth_callback(self, data):
         self.depth_callback_flag = True  # Set flag to true when image is received
 
-        current_time = rospy.Time.now()
-        if (current_time - self.last_depth_save_time).to_sec() > 1.0 / self.save_rate:
-            try:
-                img_filename = os.path.join(self.depth_save_dir, "realtime_depth.png")
-
-                # Convert ROS depth image message to OpenCV image
-                cv_image = self.bridge.imgmsg_to_cv2(data, "passthrough")
-                cv2.imwrite(img_filename, cv_image)
+        try:
+            # View the ROS depth image message as a numpy array without copying
+            cv_image = image_msg_to_numpy(data, "passthrough")
+        except ValueError as e:
+            print(e)
+            return
 
-                # Open and save the file in binary write mode
-                # with open(img_filename, 'wb') as file:
-                #     file.write(data.data)
+        self.frame_store.put("depth", cv_image, data.header.stamp.to_sec())
+        self.image_count += 1
 
-                # print(f"Saved Depth image to {img_filename}")
-                self.image_count += 1
-                self.last_depth_save_time = current_time
-            except CvBridgeError as e:
-                print(e)
+        current_time = rospy.Time.now()
+        if self.save_to_disk and (current_time - self.last_depth_save_time).to_sec() > 1.0 / self.save_rate:
+            img_filename = os.path.join(self.depth_save_dir, "realtime_depth.png")
+            write_image_atomic(img_filename, cv_image)
+            self.last_depth_save_time = current_time
 
     def check_images_received(self, event):
         if not self.rgb_callback_flag and self.depth_callback_flag:
@@ -93,62 +96,45 @@ class ImageSaver:
         self.depth_callback_flag = False
 
 
-def save_color_image_rs():
+def save_color_image_rs(source=None, timeout=5.0):
     """
-    Capture and save color images from the RealSense camera.
+    Capture and save a color image from the RealSense camera.
 
     Parameters:
-        folder_path (str): folder to save the images.
-        save_interval (int): interval in seconds to save images.
+        source (RealSenseSource): A running RealSense source to grab the frame from. If None, a temporary
+            color-only source is started and stopped around the capture.
+        timeout (float): Maximum time in seconds to wait for a frame.
     """
 
     folder_path = "../../assets/img/realtime_rgb"
 
-    # ensure the folder exists
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-
-    # set up the RealSense pipeline
-    pipeline = rs.pipeline()
-    config = rs.config()
-    config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
-
-    # start the pipeline
-    pipeline.start(config)
-    save_interval = 1
-    save_times = 2
+    temporary_source = source is None
+    if temporary_source:
+        source = RealSenseSource(enable_depth=False)
+        source.start()
 
     try:
-        for i in range(save_times):
-            frames = pipeline.wait_for_frames()
-            color_frame = frames.get_color_frame()
-
-            if not color_frame:
-                print("No color frame captured")
-                continue
-
-            color_image = np.asanyarray(color_frame.get_data())
-            img_name = "realtime_rgb.png"
-            cv2.imwrite(os.path.join(folder_path, img_name), color_image)
-            time.sleep(save_interval)
+        frame = source.wait_next(timeout)
+        if frame is None:
+            print("No color frame captured")
+            return
 
+        write_image_atomic(os.path.join(folder_path, "realtime_rgb.png"), frame.rgb)
         print(f"RGB image saved")
 
     finally:
-        # stop the pipeline and close the OpenCV windows
-        pipeline.stop()
-        cv2.destroyAllWindows()
+        if temporary_source:
+            source.stop()
 
 
-def save_images_gemini():
+def save_images_gemini(frame_store=None):
     """
     Capture color and depth images from the Gemini camera.
 
     Parameters:
-        folder_path (str): folder to save the images.
-        save_interval (int): interval in seconds to save images.
+        frame_store (FrameStore): in-memory store receiving the latest frames.
     """
-    image_saver = ImageSaver()
+    image_saver = ImageSaver(frame_store)
 
     try:
         rospy.spin()
@@ -182,17 +168,43 @@ def add_bbox_patch(ax, draw, bbox, color, w, h, caption):
             bbox=dict(facecolor='white', alpha=0.75, edgecolor='none', boxstyle='round,pad=0.1'))
 
 
-def plot_image_with_bbox(rgb_img_path, action_response):
+def load_rgbd_arrays(rgb_img, depth_img, depth_scale=1000.0, depth_trunc=3.0):
+    """
+    Load a color and a depth image as numpy arrays, either from file paths or from in-memory arrays.
+
+    Integer depth images are converted to meters with `depth_scale`, and depths beyond `depth_trunc` are set
+    to 0 (invalid), matching the defaults of Open3D's RGBDImage. Float depth images are assumed to be in meters.
+
+    Parameters:
+        rgb_img (str or np.ndarray): The path to the color image, or the BGR image itself.
+        depth_img (str or np.ndarray): The path to the depth image, or the raw depth image itself.
+        depth_scale (float): The scale of integer depth values per meter.
+        depth_trunc (float): The maximum valid depth in meters.
+
+    Returns:
+        tuple: (color_array, depth_array) with the depth in meters as float32.
+    """
+    color_array = cv2.imread(rgb_img, cv2.IMREAD_COLOR) if isinstance(rgb_img, str) else np.asarray(rgb_img)
+    depth_raw = cv2.imread(depth_img, cv2.IMREAD_UNCHANGED) if isinstance(depth_img, str) else np.asarray(depth_img)
+    depth_array = depth_to_meters(depth_raw, depth_scale, depth_trunc)
+
+    return color_array, depth_array
+
+
+def plot_image_with_bbox(rgb_img, action_response):
     """
     Parse the bbox coordinates from the response of CuriGPT and plot them on the image.
 
     Parameters:
-    image_path (str): The path to the image file.
+    rgb_img (str or np.ndarray): The path to the image file, or the BGR image itself.
     action_response (str): The action_response from the multimodal large language model.
     """
 
     # load the image.
-    image = Image.open(rgb_img_path)
+    if isinstance(rgb_img, str):
+        image = Image.open(rgb_img)
+    else:
+        image = Image.fromarray(np.ascontiguousarray(rgb_img[..., ::-1]))
     draw = ImageDraw.Draw(image)
     # get the width and height od the image size
     w, h = image.size
@@ -224,92 +236,60 @@ def plot_image_with_bbox(rgb_img_path, action_response):
         plt.show()
 
 
-def get_spatial_coordinates(bbox, rgb_img, depth_img, cam_intrinsics):
+def get_spatial_coordinates(bbox, rgb_img, depth_img, cam_intrinsics, depth_registration=None):
     """
     Calculate 3D coordinates of the center of a bounding box using the depth map and camera intrinsics.
 
-    :param bbox: Tuple (x, y, width, height) defining the bounding box.
-    :param depth_map: 2D array where each element is the depth in meters from the camera.
-    :param camera_intrinsics: Camera intrinsic matrix typically shaped (3, 3).
+    :param bbox: Tuple (x1, y1, x2, y2) defining the bounding box, normalized to 0-1000.
+    :param rgb_img: Path to the color image, or the color image array.
+    :param depth_img: Path to the depth image, or the raw depth image array.
+    :param cam_intrinsics: Intrinsics of the color camera, see `depth_utils.as_intrinsics`.
+    :param depth_registration: Optional `DepthRegistration` aligning the depth image to the color image.
     :return: Numpy array containing the 3D coordinates (X, Y, Z) in meters.
     """
 
-    # Open the depth image
-    color_raw = o3d.io.read_image(rgb_img)
-    depth_raw = o3d.io.read_image(depth_img)
-
-    rgbd_img = o3d.geometry.RGBDImage.create_from_color_and_depth(color_raw, depth_raw)
+    # Load the color and depth images
+    color_array, depth_array = load_rgbd_arrays(rgb_img, depth_img)
+    if depth_registration is not None:
+        depth_array = depth_registration.register(depth_array)
 
-    color_array = np.asarray(rgbd_img.color)
-    depth_array = np.asarray(rgbd_img.depth)
-
-    # assert the size of color image and depth image are both 848*480, otherwise through an error
-    assert color_array.shape[0] == depth_array.shape[0] and color_array.shape[1] == depth_array.shape[1], "The size of color image and depth image are not the same."
-
-    img_width, img_hight = depth_array.shape[1], depth_array.shape[0]
-
-
-    # Assuming the depth is scaled as depth in millimeters
-    # depth_array = depth_array.astype(np.float32) / 1000.0
-
-    # define the camera intrinsics
-    camera_intrinsics_matrix = cam_intrinsics.intrinsic_matrix
-
-    # Extract the bounding box center
-    x1, y1, x2, y2 = (int(bbox[0] / 1000 * img_width), int(bbox[1] / 1000 * img_hight), int(bbox[2] / 1000 *
-                                                                                            img_width),
-                      int(bbox[3] / 1000 * img_hight))
-
-    print(x1, y1, x2, y2)
-
-    # calculate the center of the bounding box
-    x_center = int((x1 + x2) / 2)
-    y_center = int((y1 + y2) / 2)
-
-    # Get the depth value at the center of the bounding box
-    z = depth_array[y_center, x_center]
-
-    print("Depth value at center of bounding box:", z)
-
-    # Create a vector for the pixel coordinates including the depth
-    pixel_vector = np.array([x_center * z, y_center * z, z])
-    print("Pixel Vector:", pixel_vector)
-    pixel_vector = pixel_vector.reshape(3, 1)  # Ensuring the pixel_vector is a column vector
-
-    # Compute the inverse of the camera intrinsic matrix
-    try:
-        # Attempt to invert the camera intrinsics matrix
-        camera_intrinsics_inv = np.linalg.inv(camera_intrinsics_matrix)
-        # print("Inverted Camera Intrinsics Matrix:\n", camera_intrinsics_inv)
-    except np.linalg.LinAlgError as e:
-        print("Error inverting camera intrinsics:", e)
+    if color_array.shape[:2] != depth_array.shape[:2]:
+        print("The size of color image and depth image are not the same, configure the depth registration.")
         return None
 
-    # Calculate the 3D coordinates
-    spatial_coordinates = camera_intrinsics_inv.dot(pixel_vector)
+    # Deproject the bounding box with a robust depth estimate over its interior
+    spatial_points, confidences = deproject_bboxes_robust([bbox], depth_array, cam_intrinsics)
+    spatial_coordinates = spatial_points[0].reshape(3, 1)
+    print("Depth value of bounding box:", spatial_coordinates[2, 0], "confidence:", confidences[0])
     print("World Coordinates (X, Y, Z):", spatial_coordinates)
 
-    return spatial_coordinates
+    if confidences[0] == 0:
+        print("No valid depth inside the bounding box.")
+        return None
 
+    return spatial_coordinates
 
-def create_point_cloud_from_rgbd(rgb_image_path, depth_image_path, camera_intrinsics):
-    # Load RGB and depth images
-    color_raw = o3d.io.read_image(rgb_image_path)
-    depth_raw = o3d.io.read_image(depth_image_path)
 
-    # Create an RGBD image
-    rgbd_image = o3d.geometry.RGBDImage.create_from_color_and_depth(color_raw, depth_raw)
+def create_point_cloud_from_rgbd(rgb_image_path, depth_image_path, camera_intrinsics, stride=1, voxel_size=None):
+    """
+    Create a colored point cloud of the scene with the numpy ray-grid engine.
 
-    # Create point cloud from RGBD image
-    pcd = o3d.geometry.PointCloud.create_from_rgbd_image(
-        rgbd_image,
-        camera_intrinsics
-    )
+    Parameters:
+        rgb_image_path (str or np.ndarray): The path to the color image, or the BGR image itself.
+        depth_image_path (str or np.ndarray): The path to the depth image, or the raw depth image itself.
+        camera_intrinsics: Camera intrinsics, see `depth_utils.as_intrinsics`.
+        stride (int): Pixel stride for downsampling.
+        voxel_size (float): Optional voxel size in meters for voxel-grid downsampling.
+
+    Returns:
+        tuple: (points, colors) as float32 arrays of shape (M, 3), colors in RGB within [0, 1].
+    """
+    color_array, depth_array = load_rgbd_arrays(rgb_image_path, depth_image_path)
+    colors = color_array[..., ::-1].astype(np.float32) / 255.0
 
-    # Translate the point cloud for a better visualization (optional)
-    # pcd.transform([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]])
+    return depth_to_point_cloud(depth_array, camera_intrinsics, colors=colors, stride=stride,
+                                voxel_size=voxel_size, remove_invalid=True)
 
-    return pcd
 
 def vis_spatial_point(spatial_coordinates_list, rgb_img, depth_img, cam_intrinsics):
 
@@ -317,8 +297,13 @@ def vis_spatial_point(spatial_coordinates_list, rgb_img, depth_img, cam_intrinsi
         print("No points or colors provided for visualization.")
         return
 
+    # Open3D is only needed for the interactive visualization
+    import open3d as o3d
+
     # create the scene point cloud
-    scene_pcd = create_point_cloud_from_rgbd(rgb_img, depth_img, cam_intrinsics)
+    points, colors = create_point_cloud_from_rgbd(rgb_img, depth_img, cam_intrinsics)
+    scene_pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points.astype(np.float64)))
+    scene_pcd.colors = o3d.utility.Vector3dVector(colors.astype(np.float64))
 
     # prepare visualization
     vis = o3d.visualization.Visualizer()
@@ -346,7 +331,7 @@ if __name__ == '__main__':
     bbox =[343, 761, 516, 888]
     rgb_img = "assets/img/realtime_rgb/realtime_rgb.png"
     depth_img = "assets/img/realtime_depth/realtime_depth.png"
-    cam_intrinsics = o3d.camera.PinholeCameraIntrinsic(width=640, height=360, fx=345.9, fy=346.0, cx=322.7, cy=181.3)
+    cam_intrinsics = GEMINI_INTRINSICS
 
     get_spatial_coordinates(bbox, rgb_img, depth_img, cam_intrinsics)
 
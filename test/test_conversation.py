@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from curigpt_ros.models.conversation import ConversationHistory
+
+ACTION_RESPONSE = json.dumps({"robot_response": "Sure.", "robot_actions": [
+    {"action": "grasp_and_give", "parameters": {"arg1": {"description": "apple",
+                                                         "bbox_coordinates": [431, 314, 491, 428]}}}]})
+
+
+def user_texts(history):
+    return [message["content"][-1]["text"] for message in history.messages() if message["role"] == "user"]
+
+
+def test_only_the_latest_image_is_sent():
+    history = ConversationHistory(keep_images=1)
+    history.add_turn("give me the apple", "scene_1.jpg", ACTION_RESPONSE)
+    history.add_turn("and now?", "scene_2.jpg", '{"robot_response": "Done.", "robot_actions": null}')
+    messages = history.messages()
+    assert messages[0]["content"] == [{"text": "(earlier camera image omitted) give me the apple"}]
+    assert json.loads(messages[1]["content"][0]["text"]) == {"robot_response": "Sure.",
+                                                              "robot_actions": ["grasp_and_give(apple)"]}
+    assert messages[2]["content"] == [{"image": "scene_2.jpg"}, {"text": "and now?"}]
+
+
+def test_text_only_turns_get_no_image_marker():
+    history = ConversationHistory(keep_images=1)
+    history.add_turn("give me the apple", "scene_1.jpg", ACTION_RESPONSE)
+    history.add_turn("how are you?", None, "I am fine.")
+    history.add_turn("tell me a joke", None, "Why did the robot cross the road?")
+    messages = history.messages()
+    # the chat turns neither carry the marker nor push the image of the last image turn out
+    assert messages[0]["content"][0] == {"image": "scene_1.jpg"}
+    assert user_texts(history)[1:] == ["how are you?", "tell me a joke"]
+    assert messages[-1]["content"] == [{"text": "Why did the robot cross the road?"}]
+
+
+def test_the_marker_is_in_the_prompt_language():
+    history = ConversationHistory(keep_images=0, language="zh")
+    history.add_turn("你面前有什么？", "scene_1.jpg", "桌子上有一个苹果。")
+    assert user_texts(history) == ["（之前的相机图像已省略） 你面前有什么？"]
+    with pytest.raises(ValueError):
+        ConversationHistory(language="fr")
+
+
+def test_the_window_is_trimmed_to_the_budget():
+    history = ConversationHistory(max_turns=3, max_tokens=1500, keep_images=1, image_tokens=1000)
+    for index in range(5):
+        history.add_turn("query {}".format(index), "scene_{}.jpg".format(index), "response")
+    assert [turn.query for turn in history.turns] == ["query 2", "query 3", "query 4"]
+    assert history.tokens() <= 1500
+    history.add_turn("a long question " * 200, None, "response")
+    assert [turn.query for turn in history.turns] == ["a long question " * 200]
@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+from curigpt_ros.utils.depth_utils import (CameraIntrinsics, DepthRegistration, GEMINI_INTRINSICS, bboxes_to_pixels,
+                                           deproject_bboxes, deproject_bboxes_robust, deproject_pixels,
+                                           depth_to_meters, depth_to_point_cloud, estimate_bbox_depths,
+                                           load_camera_config)
+from curigpt_ros.utils.transform import Rotation, Transform
+
+INTRINSICS = CameraIntrinsics(width=64, height=48, fx=50.0, fy=60.0, cx=31.5, cy=23.5)
+
+
+def test_deproject_pixels_matches_the_pinhole_model():
+    u, v, z = np.array([0.0, 31.5, 63.0]), np.array([10.0, 23.5, 47.0]), np.array([1.0, 2.0, 0.5])
+    points = deproject_pixels(u, v, z, INTRINSICS)
+    np.testing.assert_allclose(points[:, 0], (u - INTRINSICS.cx) * z / INTRINSICS.fx)
+    np.testing.assert_allclose(points[:, 1], (v - INTRINSICS.cy) * z / INTRINSICS.fy)
+    np.testing.assert_allclose(points[:, 2], z)
+
+
+def test_deproject_pixels_accepts_intrinsics_dicts():
+    np.testing.assert_allclose(deproject_pixels([5], [7], [1.5], INTRINSICS.to_dict()),
+                               deproject_pixels([5], [7], [1.5], INTRINSICS))
+
+
+def test_bboxes_to_pixels_scales_and_clips():
+    pixels = bboxes_to_pixels([[0, 0, 1000, 1000], [500, 250, 750, 500]], 64, 48)
+    np.testing.assert_array_equal(pixels, [[0, 0, 63, 47], [32, 12, 48, 24]])
+
+
+def test_deproject_bboxes_uses_the_box_centers():
+    depth = np.full((48, 64), 1.25, dtype=np.float32)
+    points = deproject_bboxes([[500, 250, 750, 500], [0, 0, 100, 100]], depth, INTRINSICS)
+    np.testing.assert_allclose(points, deproject_pixels([40, 3], [18, 2], [1.25, 1.25], INTRINSICS))
+
+
+def test_depth_to_meters_scales_integers_and_masks_invalid_depths():
+    raw = np.array([[1000, 2500], [0, 4000]], dtype=np.uint16)
+    np.testing.assert_allclose(depth_to_meters(raw), [[1.0, 2.5], [0.0, 0.0]])
+    # e.g. a RealSense with 0.25 mm units
+    np.testing.assert_allclose(depth_to_meters(raw, depth_scale=4000.0), [[0.25, 0.625], [0.0, 1.0]])
+    meters = np.array([[np.nan, 1.5], [np.inf, 3.5]], dtype=np.float32)
+    np.testing.assert_allclose(depth_to_meters(meters), [[0.0, 1.5], [0.0, 0.0]])
+
+
+def test_robust_depth_ignores_holes_and_outliers():
+    rng = np.random.default_rng(0)
+    depth = np.full((48, 64), 0.8, dtype=np.float32) + rng.normal(0, 0.002, (48, 64)).astype(np.float32)
+    depth[::3, ::3] = 0.0
+    depth[20:24, 28:32] = 2.9
+    _, depths, confidences = estimate_bbox_depths([[250, 250, 750, 750]], depth)
+    assert depths[0] == pytest.approx(0.8, abs=0.005)
+    assert 0.5 < confidences[0] < 1.0
+
+
+def test_foreground_depth_separates_the_object_from_the_table():
+    depth = np.full((48, 64), 1.0, dtype=np.float32)
+    depth[16:32, 24:40] = 0.7
+    bbox = [[300, 250, 700, 750]]
+    _, background, _ = estimate_bbox_depths(bbox, depth, shrink=1.0)
+    _, foreground, _ = estimate_bbox_depths(bbox, depth, shrink=1.0, foreground=True)
+    assert background[0] == pytest.approx(1.0)
+    assert foreground[0] == pytest.approx(0.7)
+
+
+def test_box_without_valid_depth_has_zero_confidence():
+    depth = np.zeros((48, 64), dtype=np.float32)
+    points, confidences = deproject_bboxes_robust([[100, 100, 300, 300]], depth, INTRINSICS)
+    assert points[0, 2] == 0.0 and confidences[0] == 0.0
+
+
+def test_point_cloud_matches_the_deprojection():
+    depth = np.random.default_rng(1).uniform(0.5, 2.0, (48, 64)).astype(np.float32)
+    points = depth_to_point_cloud(depth, INTRINSICS)
+    v, u = np.mgrid[0:48, 0:64]
+    np.testing.assert_allclose(points, deproject_pixels(u.ravel(), v.ravel(), depth.ravel(), INTRINSICS), rtol=1e-5)
+
+    depth[0, :] = 0.0
+    assert len(depth_to_point_cloud(depth, INTRINSICS, remove_invalid=True)) == 47 * 64
+    assert len(depth_to_point_cloud(depth, INTRINSICS, stride=2)) == 24 * 32
+
+
+def test_point_cloud_rejects_a_mismatched_resolution():
+    with pytest.raises(ValueError):
+        depth_to_point_cloud(np.ones((10, 10), dtype=np.float32), INTRINSICS)
+
+
+
+def test_identical_cameras_need_no_registration():
+    config = {"color_intrinsics": INTRINSICS.to_dict(), "depth_intrinsics": INTRINSICS.to_dict(),
+              "depth_to_color": {"rotation": [0.0, 0.0, 0.0, 1.0], "translation": [0.0, 0.0, 0.0]}}
+    assert load_camera_config(config) == (INTRINSICS, None)
+    assert load_camera_config({"color_intrinsics": INTRINSICS.to_dict()}) == (INTRINSICS, None)
+
+
+def test_registration_resamples_a_plane_to_the_color_intrinsics():
+    depth_intrinsics = CameraIntrinsics(width=80, height=60, fx=40.0, fy=40.0, cx=39.5, cy=29.5)
+    registration = DepthRegistration(depth_intrinsics, INTRINSICS)
+    registered = registration.register(np.full((60, 80), 1.5, dtype=np.float32))
+    assert registered.shape == (48, 64)
+    # the wider depth camera covers the whole color image
+    np.testing.assert_allclose(registered, 1.5, rtol=1e-5)
+
+
+def test_registration_with_a_baseline_shifts_by_the_disparity_and_keeps_the_nearest_depth():
+    intrinsics = CameraIntrinsics(width=64, height=48, fx=100.0, fy=100.0, cx=31.5, cy=23.5)
+    registration = DepthRegistration(intrinsics, intrinsics, Transform(Rotation.identity(), [0.1, 0.0, 0.0]))
+    depth = np.zeros((48, 64), dtype=np.float32)
+    depth[20:28, 10:20] = 1.0  # near object, disparity of 100 * 0.1 / 1.0 = 10 pixels
+    depth[20:28, 20:35] = 2.0  # far background, disparity of 5 pixels
+    registered = registration.register(depth)
+
+    # the object maps to columns 20-29 and the background to 25-39, where both map the nearer depth occludes
+    np.testing.assert_array_equal(registered[24, 20:30], 1.0)
+    np.testing.assert_array_equal(registered[24, 30:40], 2.0)
+    assert registered[24, 19] == 0.0 and registered[24, 40] == 0.0
+    assert registered[19, 25] == 0.0 and registered[28, 25] == 0.0
+
+
+def test_registration_rejects_a_mismatched_depth_map():
+    registration = DepthRegistration(INTRINSICS, INTRINSICS._replace(fx=55.0))
+    with pytest.raises(ValueError):
+        registration.register(np.ones((10, 10), dtype=np.float32))
+
+
+def test_intrinsics_from_a_realsense_profile():
+    class RealSenseIntrinsics(object):
+        width, height, fx, fy, ppx, ppy = 640, 480, 615.0, 615.5, 320.5, 240.5
+
+    intrinsics = CameraIntrinsics.from_realsense(RealSenseIntrinsics())
+    assert intrinsics == CameraIntrinsics(640, 480, 615.0, 615.5, 320.5, 240.5)
+    assert intrinsics != GEMINI_INTRINSICS
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from curigpt_ros.utils.frame_store import Frame, FrameStore, select_rgbd_pair
+
+
+def frames(stamps, age=0.0):
+    now = time.monotonic()
+    return [Frame(None, stamp, seq, now - age) for seq, stamp in enumerate(stamps)]
+
+
+def test_newest_pair_within_the_slop_is_selected():
+    rgb, depth = select_rgbd_pair(frames([1.0, 2.0, 3.0]), frames([1.01, 2.02, 2.9]), slop=0.05)
+    assert (rgb.stamp, depth.stamp) == (2.0, 2.02)
+
+
+def test_closest_depth_is_paired_with_each_color_frame():
+    rgb, depth = select_rgbd_pair(frames([3.0]), frames([2.96, 2.99, 3.03]), slop=0.05)
+    assert depth.stamp == 2.99
+
+
+def test_no_pair_within_the_slop():
+    assert select_rgbd_pair(frames([1.0, 2.0]), frames([1.5, 2.5]), slop=0.05) is None
+    assert select_rgbd_pair(frames([1.0]), [], slop=0.05) is None
+
+
+def test_stale_frames_are_rejected():
+    now = time.monotonic()
+    fresh_rgb = [Frame(None, 5.0, 0, now)]
+    stale_depth = [Frame(None, 5.0, 0, now - 2.0)]
+    assert select_rgbd_pair(fresh_rgb, stale_depth, max_age=1.0) is None
+    assert select_rgbd_pair(fresh_rgb, stale_depth, max_age=None) is not None
+    assert select_rgbd_pair(frames([5.0], age=2.0), frames([5.0]), max_age=1.0) is None
+
+
+def test_snapshot_pairs_the_stored_frames():
+    store = FrameStore()
+    store.put("rgb", np.zeros((2, 2, 3), dtype=np.uint8), stamp=10.0)
+    store.put("depth", np.ones((2, 2), dtype=np.uint16), stamp=10.02)
+    store.put("rgb", np.full((2, 2, 3), 7, dtype=np.uint8), stamp=10.5)
+    rgbd = store.snapshot_rgbd(max_age=1.0, slop=0.05)
+    assert (rgbd.stamp, rgbd.frame_id) == (10.0, 0)
+    assert rgbd.depth[0, 0] == 1 and rgbd.scene_version is None
+    assert store.snapshot_rgbd(slop=0.01) is None
+
+
+def test_published_frames_are_read_only():
+    store = FrameStore()
+    frame = store.put("rgb", np.zeros((2, 2), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        frame.image[0, 0] = 1
+    assert store.latest("rgb").seq == 0 and store.previous("rgb") is None
+
+
+def test_wait_next_returns_the_next_frame_or_times_out():
+    store = FrameStore()
+    store.put("rgb", np.zeros(1))
+    assert store.wait_next("rgb", timeout=0.01) is None
+
+    threading.Timer(0.05, store.put, args=("rgb", np.ones(1))).start()
+    frame = store.wait_next("rgb", timeout=2.0)
+    assert frame is not None and frame.seq == 1
+
+
+def test_frames_published_together_are_always_paired_together():
+    store = FrameStore()
+    mismatches = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            frame = store.snapshot_rgbd(slop=0.05)
+            if frame is not None and frame.rgb[0] != frame.depth[0]:
+                mismatches.append((frame.rgb[0], frame.depth[0]))
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    # consecutive framesets are closer than the slop, so a color frame published without its depth frame would be
+    # paired with the previous depth frame
+    for index in range(2000):
+        published = store.put_many({"rgb": np.array([index]), "depth": np.array([index])}, stamp=index * 0.03)
+        assert published["rgb"].stamp == published["depth"].stamp
+    done.set()
+    reader.join()
+    assert mismatches == []
@@ -0,0 +1,82 @@
+import sys
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+from curigpt_ros.utils.image_conversion import image_msg_to_numpy
+
+
+def image_msg(image, encoding, padding=0, bigendian=False):
+    """Build a sensor_msgs/Image-like message from an array, with `padding` bytes at the end of each row."""
+    image = np.asarray(image)
+    if bigendian:
+        image = image.astype(image.dtype.newbyteorder(">"))
+    height, width = image.shape[:2]
+    rows = image.reshape(height, -1).view(np.uint8)
+    padded = np.zeros((height, rows.shape[1] + padding), dtype=np.uint8)
+    padded[:, :rows.shape[1]] = rows
+    return SimpleNamespace(height=height, width=width, encoding=encoding, is_bigendian=bigendian,
+                           step=padded.shape[1], data=padded.tobytes())
+
+
+def color_image(height=4, width=5):
+    return np.arange(height * width * 3, dtype=np.uint8).reshape(height, width, 3)
+
+
+def test_passthrough_is_a_read_only_view_on_the_message_data():
+    msg = image_msg(color_image(), "bgr8")
+    image = image_msg_to_numpy(msg)
+    np.testing.assert_array_equal(image, color_image())
+    assert np.shares_memory(image, np.frombuffer(msg.data, dtype=np.uint8))
+    assert not image.flags.writeable
+
+
+def test_padded_rows_are_skipped_through_the_strides():
+    msg = image_msg(color_image(), "rgb8", padding=7)
+    image = image_msg_to_numpy(msg)
+    assert image.strides == (msg.step, 3, 1)
+    np.testing.assert_array_equal(image, color_image())
+
+
+def test_rgb_bgr_swap_is_a_reversed_channel_view():
+    msg = image_msg(color_image(), "rgb8", padding=3)
+    image = image_msg_to_numpy(msg, "bgr8")
+    np.testing.assert_array_equal(image, color_image()[..., ::-1])
+    assert np.shares_memory(image, np.frombuffer(msg.data, dtype=np.uint8))
+
+
+def test_alpha_is_dropped_by_a_view():
+    rgba = np.dstack([color_image(), np.full((4, 5), 255, np.uint8)])
+    np.testing.assert_array_equal(image_msg_to_numpy(image_msg(rgba, "rgba8"), "rgb8"), color_image())
+    np.testing.assert_array_equal(image_msg_to_numpy(image_msg(rgba, "rgba8"), "bgr8"), color_image()[..., ::-1])
+
+
+@pytest.mark.parametrize("bigendian", [False, True])
+def test_depth_images_keep_their_values(bigendian):
+    depth = np.arange(20, dtype=np.uint16).reshape(4, 5) * 1000
+    image = image_msg_to_numpy(image_msg(depth, "16UC1", padding=2, bigendian=bigendian))
+    assert image.shape == (4, 5)
+    np.testing.assert_array_equal(image, depth)
+
+
+def test_mono8_is_converted_to_color_like_cv_bridge():
+    gray = np.arange(20, dtype=np.uint8).reshape(4, 5)
+    image = image_msg_to_numpy(image_msg(gray, "mono8", padding=3), "bgr8")
+    assert image.shape == (4, 5, 3)
+    np.testing.assert_array_equal(image, cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+
+
+def test_color_is_converted_to_mono8_like_cv_bridge():
+    image = image_msg_to_numpy(image_msg(color_image(), "bgr8"), "mono8")
+    np.testing.assert_array_equal(image, cv2.cvtColor(color_image(), cv2.COLOR_BGR2GRAY))
+
+
+def test_other_conversions_need_cv_bridge(monkeypatch):
+    # cv_bridge is only imported for the conversions without a fast path
+    monkeypatch.setitem(sys.modules, "cv_bridge", None)
+    with pytest.raises(ValueError, match="without cv_bridge"):
+        image_msg_to_numpy(image_msg(np.zeros((4, 5), np.uint16), "mono16"), "bgr8")
+    with pytest.raises(ValueError, match="without cv_bridge"):
+        image_msg_to_numpy(SimpleNamespace(encoding="yuv422"), "bgr8")
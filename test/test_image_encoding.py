@@ -0,0 +1,44 @@
+import os
+
+import cv2
+import numpy as np
+
+from curigpt_ros.utils.image_encoding import ImageEncoder, fit_to_pixel_budget
+
+
+def frame(width=640, height=360):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def test_fit_to_pixel_budget_keeps_the_aspect_ratio():
+    resized, scale = fit_to_pixel_budget(frame(), 320 * 180)
+    assert resized.shape == (180, 320, 3) and scale == 0.5
+    assert fit_to_pixel_budget(frame(), None)[1] == 1.0
+
+
+def test_repeated_frames_are_encoded_once(tmp_path):
+    encoder = ImageEncoder(cache_dir=str(tmp_path))
+    image = frame()
+    assert encoder.encode(image) is encoder.encode(image.copy())
+    assert (encoder.hits, encoder.misses) == (1, 1)
+
+
+def test_encoders_with_other_parameters_do_not_share_files(tmp_path):
+    image = frame()
+    scene = ImageEncoder(max_pixels=320 * 180, cache_dir=str(tmp_path)).encode(image)
+    crop = ImageEncoder(max_pixels=1280 * 720, cache_dir=str(tmp_path)).encode(image)
+    assert scene.content_hash == crop.content_hash
+    assert scene.path != crop.path
+    assert (crop.width, crop.height) == (640, 360)
+    assert cv2.imread(crop.path).shape == (360, 640, 3)
+    with open(crop.path, "rb") as file:
+        assert file.read() == crop.data
+
+
+def test_a_changed_quality_writes_another_file(tmp_path):
+    image = frame()
+    low = ImageEncoder(quality=30, cache_dir=str(tmp_path)).encode(image)
+    high = ImageEncoder(quality=95, cache_dir=str(tmp_path)).encode(image)
+    assert low.path != high.path
+    assert os.path.getsize(low.path) == len(low.data) < os.path.getsize(high.path) == len(high.data)
@@ -0,0 +1,59 @@
+import json
+import os
+
+import pytest
+
+from curigpt_ros.models.intent_router import IntentRouter, CHAT, SCENE, ACTION
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config",
+                             "intent_examples.json")
+
+
+@pytest.fixture(scope="module")
+def router():
+    with open(EXAMPLES_PATH, "r", encoding="utf-8") as file:
+        return IntentRouter(json.load(file))
+
+
+@pytest.mark.parametrize("query", ["What do you see?", "what can you see", "What is in front of you?",
+                                   "Describe the scene.", "What's on the table?", "你看到了什么？"])
+def test_scene_questions_are_not_routed_to_chat(router, query):
+    # the chat path sends no camera image, so a misrouted scene question gets a wrong answer without any error
+    assert router.route(query).intent != CHAT
+
+
+@pytest.mark.parametrize("query", ["Can you give me the soda can?", "hand me the banana", "把香蕉放到盘子里"])
+def test_action_requests_are_routed_to_action(router, query):
+    assert router.route(query).intent == ACTION
+
+
+@pytest.mark.parametrize("query", ["How are you today?", "你好"])
+def test_confident_chat_is_routed_to_chat(router, query):
+    assert router.route(query) == (CHAT, pytest.approx(router.classify(query)[CHAT]), "classifier")
+
+
+def test_uncertain_chat_falls_back_to_the_default(router):
+    router = IntentRouter({CHAT: ["tell me a joke", "how are you?"], SCENE: ["what do you see?"],
+                           ACTION: ["give me the can"]}, chat_min_confidence=1.0)
+    route = router.route("tell me a joke")
+    assert route.intent == ACTION and route.source == "fallback"
+
+
+def test_force_and_overrides_skip_the_classifier():
+    assert IntentRouter({CHAT: ["hi"], ACTION: ["give"]}, force=SCENE).route("hi").source == "force"
+    overridden = IntentRouter({CHAT: ["hi"], ACTION: ["give"]}, overrides=[["^look", SCENE]])
+    assert overridden.route("Look at this") == (SCENE, 1.0, "override")
+
+
+def test_invalid_intent_is_rejected():
+    with pytest.raises(ValueError):
+        IntentRouter({CHAT: ["hi"], ACTION: ["give"]}, default="dance")
+
+
+def test_decisions_are_logged(tmp_path):
+    log_path = str(tmp_path / "routes" / "intent_routes.jsonl")
+    router = IntentRouter({CHAT: ["hi"], ACTION: ["give"]}, force=ACTION, log_path=log_path)
+    router.route("give me the can")
+    with open(log_path, "r", encoding="utf-8") as file:
+        entry = json.loads(file.readline())
+    assert entry["query"] == "give me the can" and entry["intent"] == ACTION and entry["source"] == "force"
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from curigpt_ros.models.mllm_backends import DashScopeBackend, OpenAICompatibleBackend
+
+
+class FakeStream(object):
+    status_code = 200
+    text = ""
+
+    def __init__(self, events):
+        self.events = events
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def iter_lines(self, decode_unicode=False):
+        for event in self.events:
+            yield "data: " + (event if isinstance(event, str) else json.dumps(event))
+
+
+def dashscope_event(text):
+    return {"output": {"choices": [{"message": {"content": [{"text": text}]}}]}}
+
+
+def stream(backend, events):
+    backend.session.post = lambda *args, **kwargs: FakeStream(events)
+    return list(backend.stream([{"role": "user", "content": [{"text": "hi"}]}]))
+
+
+def test_dashscope_stream_yields_the_chunks():
+    backend = DashScopeBackend(api_key="key")
+    assert stream(backend, [dashscope_event('{"robot'), dashscope_event('_response": null}')]) == \
+        ['{"robot', '_response": null}']
+
+
+@pytest.mark.parametrize("event", ["{not json", {"output": {"choices": []}}, {"output": {}}, "null"])
+def test_malformed_stream_events_raise_runtime_errors(event):
+    with pytest.raises(RuntimeError, match="Malformed stream event"):
+        stream(DashScopeBackend(api_key="key"), [dashscope_event("ok"), event])
+
+
+def test_openai_stream_stops_at_done():
+    event = {"choices": [{"delta": {"content": "ok"}}]}
+    assert stream(OpenAICompatibleBackend("model"), [event, "[DONE]", "{not json"]) == ["ok"]
+
+
+def test_dashscope_backend_needs_an_api_key(monkeypatch):
+    monkeypatch.delenv("DASHSCOPE_API_KEY", raising=False)
+    with pytest.raises(ValueError, match="DASHSCOPE_API_KEY"):
+        DashScopeBackend()
+    monkeypatch.setenv("DASHSCOPE_API_KEY", "key")
+    assert DashScopeBackend().api_key == "key"
+
+
+def test_model_parameters_are_overridden_by_the_configured_ones():
+    backend = DashScopeBackend("qwen-vl-chat-v1", api_key="key", parameters={"top_k": 10})
+    assert backend.parameters == {"top_p": 0.9, "top_k": 10}
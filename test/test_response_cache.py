@@ -0,0 +1,82 @@
+import os
+import time
+
+import pytest
+
+from curigpt_ros.models.response_cache import ResponseCache, normalize_query, prompt_hash
+
+
+def key(query="what do you see?", image_hash="image"):
+    return ResponseCache.make_key("qwen-vl-max", prompt_hash(["prompt"]), image_hash, query)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path), max_entries=2, ttl=60.0)
+
+
+def test_trivially_different_queries_share_a_key():
+    assert normalize_query("  What do  you see?! ") == "what do you see"
+    assert key("What do you see?") == key("what do you see")
+    assert key() != key(image_hash="other image")
+    assert key() != ResponseCache.make_key("qwen-vl-plus", prompt_hash(["prompt"]), "image", "what do you see?")
+
+
+def test_hit_and_miss(cache):
+    assert cache.get(key()) is None
+    cache.put(key(), "a table")
+    assert cache.get(key()) == "a table"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_persist_across_sessions(cache):
+    cache.put(key(), "a table")
+    assert ResponseCache(cache.cache_dir, ttl=60.0).get(key()) == "a table"
+
+
+def test_expired_entries_miss_and_are_removed(cache, monkeypatch):
+    cache.put(key(), "a table")
+    later = time.time() + 61.0
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert cache.get(key()) is None
+    assert os.listdir(cache.cache_dir) == []
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    cache.put(key("a"), "A")
+    cache.put(key("b"), "B")
+    cache.get(key("a"))
+    cache.put(key("c"), "C")
+    assert sorted(os.listdir(cache.cache_dir)) == sorted([key("a") + ".json", key("c") + ".json"])
+    assert cache.get(key("b")) is None and cache.get(key("a")) == "A"
+
+
+def test_files_of_earlier_sessions_are_pruned(tmp_path):
+    earlier = ResponseCache(str(tmp_path), max_entries=10, ttl=60.0)
+    for index, query in enumerate("abcd"):
+        earlier.put(key(query), query)
+        os.utime(earlier._path(key(query)), (time.time() - 3 + index,) * 2)
+    os.utime(earlier._path(key("d")), (time.time() - 120,) * 2)
+
+    # "d" expired, and "a" is the oldest beyond max_entries
+    ResponseCache(str(tmp_path), max_entries=2, ttl=60.0)
+    assert sorted(os.listdir(str(tmp_path))) == sorted([key("b") + ".json", key("c") + ".json"])
+
+
+def test_disabled_and_bypassed_caches(tmp_path):
+    disabled = ResponseCache.from_config({"cache_dir": str(tmp_path)})
+    assert not disabled.enabled
+    disabled.put(key(), "a table")
+    assert disabled.get(key()) is None and os.listdir(str(tmp_path)) == []
+
+    bypassed = ResponseCache(str(tmp_path), bypass=True)
+    bypassed.put(key(), "a table")
+    assert bypassed.get(key()) is None
+    assert bypassed.get(key(), bypass=False) is None
+    assert ResponseCache(str(tmp_path)).get(key()) == "a table"
+
+
+def test_corrupt_entries_are_ignored(cache):
+    with open(cache._path(key()), "w") as file:
+        file.write("{not json")
+    assert cache.get(key()) is None
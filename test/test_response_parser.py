@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from curigpt_ros.models.response_parser import parse_response, validate_action, ResponseError
+
+GIVE = {"action": "grasp_and_give",
+        "parameters": {"arg1": {"description": "soda can", "bbox_coordinates": [634, 672, 815, 780]}}}
+PLAN = {"robot_response": "Sure, here is the soda can.", "robot_actions": [GIVE]}
+
+
+def test_valid_response_needs_no_repair():
+    plan = parse_response(json.dumps(PLAN))
+    assert plan.robot_response == PLAN["robot_response"]
+    assert plan.action_dicts() == [GIVE]
+    assert plan.repairs == []
+
+
+def test_null_actions_give_an_empty_plan():
+    plan = parse_response('{"robot_response": "I see a table.", "robot_actions": null}')
+    assert plan.actions == [] and plan.repairs == []
+
+
+@pytest.mark.parametrize("text, repairs", [
+    ("```json\n{}\n```".format(json.dumps(PLAN)), ["code_fence"]),
+    ("Here is my answer: {} Hope it helps!".format(json.dumps(PLAN)), ["code_fence"]),
+    (json.dumps(PLAN, indent=4).replace("]\n", "],\n").replace("780]", "780,]"), ["trailing_commas"]),
+    ("```\n{}\n```".format(json.dumps(PLAN).replace("]}", "],}")), ["code_fence", "trailing_commas"]),
+    (repr(PLAN), ["python_literal"]),
+    ("{'robot_response': null, 'robot_actions': null}", ["python_literal"]),
+])
+def test_formatting_mistakes_are_repaired(text, repairs):
+    plan = parse_response(text)
+    assert plan.repairs == repairs
+    assert plan.robot_response == (None if "null" in text else PLAN["robot_response"])
+
+
+def test_single_action_object_is_wrapped_in_a_list():
+    plan = parse_response(json.dumps(dict(PLAN, robot_actions=GIVE)))
+    assert plan.action_dicts() == [GIVE]
+    assert plan.repairs == ["single_action"]
+
+
+@pytest.mark.parametrize("bbox, expected, repair", [
+    ([-10, 672, 815, 1020], [0, 672, 815, 1000], "bbox_clamp"),
+    ([815, 780, 634, 672], [634, 672, 815, 780], "bbox_order"),
+    ([634.4, 672, 815, 780], [634, 672, 815, 780], "bbox_clamp"),
+])
+def test_bbox_repairs(bbox, expected, repair):
+    repairs = []
+    action = validate_action({"action": "grasp_and_give", "parameters": {"arg1": {"bbox_coordinates": bbox}}},
+                             repairs)
+    assert action.arguments["arg1"].bbox == expected
+    assert repairs == [repair]
+
+
+@pytest.mark.parametrize("text, message", [
+    ("", "empty response"),
+    ("I cannot help with that.", "invalid JSON"),
+    ("[1, 2]", "must be a JSON object"),
+    ('{"robot_response": "hi"}', "missing keys"),
+    ('{"robot_response": 1, "robot_actions": null}', "robot_response must be a string"),
+    ('{"robot_response": null, "robot_actions": "grasp"}', "robot_actions must be a list"),
+    ("{[1]: 2}", "invalid JSON"),
+    ("[" * 100000, "invalid JSON"),
+])
+def test_invalid_responses_are_rejected(text, message):
+    with pytest.raises(ResponseError, match=message):
+        parse_response(text)
+
+
+@pytest.mark.parametrize("action, message", [
+    ({"action": "dance", "parameters": {}}, "unknown action"),
+    ({"action": "grasp_and_give"}, "missing parameters"),
+    ({"action": "grasp_and_place", "parameters": {"arg1": GIVE["parameters"]["arg1"]}}, "missing arg2"),
+    ({"action": "grasp_and_give", "parameters": {"arg1": {"bbox_coordinates": [1, 2, 3]}}}, "must be 4 numbers"),
+    ({"action": "grasp_and_give", "parameters": {"arg1": {"bbox_coordinates": [0, 0, 2000, 10]}}}, "out of the"),
+    ({"action": "grasp_and_give", "parameters": {"arg1": {"bbox_coordinates": [5, 0, 5, 10]}}}, "empty bbox"),
+])
+def test_invalid_actions_are_rejected(action, message):
+    with pytest.raises(ResponseError, match=message):
+        validate_action(action)
+
+
+def test_all_action_errors_are_reported():
+    bad = {"action": "grasp_and_give", "parameters": {"arg1": {"bbox_coordinates": [1, 2, 3]}}}
+    with pytest.raises(ResponseError) as error:
+        parse_response(json.dumps(dict(PLAN, robot_actions=[GIVE, bad, {"action": "dance"}])))
+    assert [message.split(":")[0] for message in error.value.errors] == ["robot_actions[1]", "robot_actions[2]"]
+
+
+def test_repairs_leave_string_literals_unchanged():
+    text = """{"robot_response": "Sure, [the red one,] is true, not null.", 'robot_actions': [%s,],}""" % (
+        json.dumps(GIVE))
+    plan = parse_response(text)
+    assert plan.robot_response == "Sure, [the red one,] is true, not null."
+    assert plan.repairs == ["trailing_commas", "python_literal"]
+    assert plan.action_dicts() == [GIVE]
@@ -0,0 +1,132 @@
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+from curigpt_ros.utils.roi_utils import (bbox_iou, boxes_overlap, crop_bbox_to_frame, crop_box_around,
+                                         normalized_to_pixels, parse_bbox, refine_action_bboxes)
+
+
+EncodedCrop = namedtuple("EncodedCrop", ["path"])
+
+
+class FakeEncoder(object):
+    def __init__(self):
+        self.shapes = []
+
+    def encode(self, image):
+        self.shapes.append(image.shape)
+        return EncodedCrop("crop_{}.jpg".format(len(self.shapes)))
+
+
+def test_normalized_to_pixels():
+    np.testing.assert_allclose(normalized_to_pixels([100, 250, 500, 1000], 640, 360), [64, 90, 320, 360])
+
+
+def test_crop_box_adds_the_margin_around_the_bbox():
+    assert crop_box_around([400, 400, 600, 600], 1000, 1000, margin=0.5) == (300, 300, 700, 700)
+
+
+def test_crop_box_keeps_a_minimum_size_for_small_boxes():
+    assert crop_box_around([495, 495, 505, 505], 1000, 1000, min_size=0.15) == (425, 425, 575, 575)
+
+
+def test_crop_box_is_clipped_to_the_frame():
+    assert crop_box_around([0, 0, 100, 100], 1000, 1000) == (0, 0, 150, 150)
+    assert crop_box_around([950, 900, 1000, 1000], 640, 360) == (576, 306, 640, 360)
+
+
+def test_crop_bbox_maps_back_to_the_frame():
+    crop_box = (300, 300, 700, 700)
+    assert crop_bbox_to_frame([250, 250, 750, 750], crop_box, 1000, 1000) == [400, 400, 600, 600]
+    assert crop_bbox_to_frame([0, 0, 1000, 1000], crop_box, 1000, 1000) == [300, 300, 700, 700]
+
+
+def test_crop_bbox_round_trip_on_a_non_square_frame():
+    bbox = [310, 420, 480, 690]
+    crop_box = crop_box_around(bbox, 1280, 720, margin=0.0, min_size=0.0)
+    x0, y0, x1, y1 = crop_box
+    # the bbox of the full crop is the crop box itself
+    assert crop_bbox_to_frame([0, 0, 1000, 1000], crop_box, 1280, 720) == \
+        [round(x0 / 1.28), round(y0 / 0.72), round(x1 / 1.28), round(y1 / 0.72)]
+    assert bbox_iou(crop_bbox_to_frame([0, 0, 1000, 1000], crop_box, 1280, 720), bbox) > 0.95
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"bbox_coordinates": [12, 34, 560, 780]}', [12, 34, 560, 780]),
+    ("<box>(12,34),(560,780)</box>", [12, 34, 560, 780]),
+    ("<box>(560,34),(12,780)</box>", None),
+    ("<box>(12,34),(560,1200)</box>", None),
+    ('```json\n{"bbox_coordinates": [12, 34, 560, 780]}\n```', [12, 34, 560, 780]),
+    ('{"description": "7up can", "bbox_coordinates": [12, 34, 560, 780]}', [12, 34, 560, 780]),
+    ("The 2 cans: <box>(12,34),(560,780)</box>", [12, 34, 560, 780]),
+    ("[12.4, 34.6, 560, 780.0]", [12, 35, 560, 780]),
+    ("<box>(12.4,34.6),(560,780)</box>", [12, 35, 560, 780]),
+    ("[12, 34, 560]", None),
+    ('{"bbox_coordinates": [12, 34, "560", 780]}', None),
+    ("The 7up can is at 12 34 560 780.", None),
+    ("", None),
+    (None, None),
+])
+def test_parse_bbox(text, expected):
+    assert parse_bbox(text) == expected
+
+
+def test_boxes_overlap():
+    assert boxes_overlap([0, 0, 10, 10], [5, 5, 15, 15])
+    assert not boxes_overlap([0, 0, 10, 10], [10, 0, 20, 10])
+    assert not boxes_overlap([0, 0, 10, 10], [0, 20, 10, 30])
+
+
+def test_bbox_iou():
+    assert bbox_iou([0, 0, 10, 10], [0, 0, 10, 10]) == 1.0
+    assert bbox_iou([0, 0, 10, 10], [5, 0, 15, 10]) == pytest.approx(50 / 150)
+    assert bbox_iou([0, 0, 10, 10], [10, 10, 20, 20]) == 0.0
+    assert bbox_iou([0, 0, 10, 10], [2, 2, 4, 4]) == pytest.approx(4 / 100)
+
+
+def actions(*bboxes):
+    return [{"action": "pick_and_place", "parameters": {
+        "arg{}".format(index): {"description": "object {}".format(index), "bbox_coordinates": bbox}
+        for index, bbox in enumerate(bboxes, 1)}}]
+
+
+def test_refine_maps_the_crop_bboxes_back():
+    image = np.zeros((1000, 1000, 3), dtype=np.uint8)
+    encoder = FakeEncoder()
+    requests = []
+
+    def locate(image_path, description):
+        requests.append((image_path, description))
+        return "<box>(250,250),(750,750)</box>"
+
+    original = actions([410, 390, 610, 590])
+    refined = refine_action_bboxes(original, image, locate, encoder)
+    assert refined[0]["parameters"]["arg1"]["bbox_coordinates"] == [410, 390, 610, 590]
+    assert encoder.shapes == [(400, 400, 3)]
+    assert requests == [("crop_1.jpg", "object 1")]
+
+
+def test_refine_keeps_the_coarse_bbox_on_unparsable_or_distant_refinements():
+    image = np.zeros((1000, 1000, 3), dtype=np.uint8)
+    responses = {"object 1": "I cannot find it.", "object 2": "<box>(0,0),(10,10)</box>"}
+    original = actions([400, 400, 600, 600], [400, 400, 600, 600])
+    refined = refine_action_bboxes(original, image, lambda path, description: responses[description], FakeEncoder())
+    assert refined[0]["parameters"]["arg1"]["bbox_coordinates"] == [400, 400, 600, 600]
+    assert refined[0]["parameters"]["arg2"]["bbox_coordinates"] == [400, 400, 600, 600]
+
+
+def test_refine_does_not_modify_the_scene_actions():
+    image = np.zeros((1000, 1000, 3), dtype=np.uint8)
+    original = actions([400, 400, 600, 600])
+    refined = refine_action_bboxes(original, image, lambda path, description: "<box>(0,0),(500,500)</box>",
+                                   FakeEncoder())
+    assert original[0]["parameters"]["arg1"]["bbox_coordinates"] == [400, 400, 600, 600]
+    assert refined[0]["parameters"]["arg1"]["bbox_coordinates"] == [300, 300, 500, 500]
+
+
+def test_refine_without_bboxes_makes_no_requests():
+    def locate(image_path, description):
+        raise AssertionError("no bbox to refine")
+
+    assert refine_action_bboxes([], np.zeros((10, 10, 3), dtype=np.uint8), locate, FakeEncoder()) == []
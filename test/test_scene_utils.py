@@ -0,0 +1,53 @@
+import numpy as np
+
+from curigpt_ros.utils.scene_utils import SceneCache, SceneChangeDetector, difference_hash
+
+
+def scene(seed=0, shape=(360, 640, 3)):
+    # a smooth random scene, so that sensor noise does not flip the hash bits
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (6, 8, 3)).astype(np.float32)
+    return np.kron(coarse, np.ones((shape[0] // 6, shape[1] // 8, 1), dtype=np.float32)).astype(np.uint8)
+
+
+def test_difference_hash_has_hash_size_squared_bits():
+    gray = np.tile(np.arange(64, dtype=np.float32), (48, 1))
+    image_hash = difference_hash(gray)
+    assert image_hash.shape == (64,) and image_hash.all()
+    assert not difference_hash(gray[:, ::-1]).any()
+
+
+def test_sensor_noise_keeps_the_scene_version():
+    detector = SceneChangeDetector()
+    image = scene()
+    noise = np.random.default_rng(1).normal(0, 2, image.shape)
+    assert detector.update(image) == 0
+    assert detector.update(np.clip(image + noise, 0, 255).astype(np.uint8)) == 0
+
+
+def test_a_different_scene_increments_the_version():
+    detector = SceneChangeDetector()
+    assert detector.update(scene(0)) == 0
+    assert detector.update(scene(1)) == 1
+    assert detector.update(scene(1)) == 1
+
+
+def test_a_slow_drift_is_compared_with_the_reference_snapshot():
+    detector = SceneChangeDetector(hash_threshold=64, diff_threshold=8.0)
+    image = scene().astype(np.int16)
+    versions = [detector.update(np.clip(image + step * 3, 0, 255).astype(np.uint8)) for step in range(5)]
+    # each step only changes the brightness by 3, but the difference to the reference adds up
+    assert versions == [0, 0, 0, 1, 1]
+
+
+def test_grayscale_snapshots_are_accepted():
+    detector = SceneChangeDetector()
+    assert detector.update(scene()[..., 0]) == 0
+
+
+def test_scene_cache_drops_the_entries_of_other_versions():
+    cache = SceneCache()
+    cache.put(0, "prompt_image", "encoded")
+    assert cache.get(0, "prompt_image") == "encoded"
+    assert cache.get(1, "prompt_image") is None
+    assert cache.get(0, "prompt_image", "missing") == "missing"
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from curigpt_ros.models.stream_parser import StreamingJSONParser
+
+RESPONSE = json.dumps({
+    "robot_response": "Sure, here is the \"soda\" can {for you}.",
+    "robot_actions": [
+        {"action": "grasp_and_give", "parameters": {"arg1": {"description": "soda can",
+                                                             "bbox_coordinates": [634, 672, 815, 780]}}},
+        {"action": "grasp_and_place", "parameters": {"arg1": {"bbox_coordinates": [1, 2, 3, 4]},
+                                                     "arg2": {"bbox_coordinates": [5, 6, 7, 8]}}},
+    ],
+}, indent=4)
+
+
+def parse(chunks):
+    fields, items = [], []
+    parser = StreamingJSONParser(lambda key, value: fields.append((key, value)),
+                                 lambda key, index, value: items.append((key, index, value)))
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser, fields, items
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16, len(RESPONSE)])
+def test_fields_do_not_depend_on_chunk_boundaries(size):
+    parser, fields, items = parse([RESPONSE[start:start + size] for start in range(0, len(RESPONSE), size)])
+    expected = json.loads(RESPONSE)
+    assert parser.done
+    assert parser.fields == expected
+    assert fields == list(expected.items())
+    assert items == [("robot_actions", index, action) for index, action in enumerate(expected["robot_actions"])]
+
+
+def test_field_is_emitted_before_the_rest_is_generated():
+    end = RESPONSE.index('"robot_actions"')
+    parser, fields, items = parse([RESPONSE[:end]])
+    assert fields == [("robot_response", json.loads(RESPONSE)["robot_response"])]
+    assert items == [] and not parser.done
+
+
+def test_first_action_is_emitted_before_the_second_one():
+    end = RESPONSE.index('"grasp_and_place"')
+    _, _, items = parse([RESPONSE[:end]])
+    assert [(key, index, value["action"]) for key, index, value in items] == [("robot_actions", 0, "grasp_and_give")]
+
+
+def test_code_fence_before_the_object_is_skipped():
+    parser, fields, _ = parse(["```json\n", '{"robot_response": null, ', '"robot_actions": null}', "\n```"])
+    assert fields == [("robot_response", None), ("robot_actions", None)]
+    assert parser.done
+
+
+def test_scalar_values_end_at_the_delimiter():
+    _, fields, _ = parse(['{"a": 1', '2, "b": true', '}'])
+    assert fields == [("a", 12), ("b", True)]
+
+
+def test_invalid_field_is_skipped_and_parsing_continues():
+    parser, fields, _ = parse(['{"a": [1, 2,], "b": "ok"}'])
+    assert fields == [("b", "ok")]
+    assert parser.done
+
+
+def test_text_after_the_object_is_ignored():
+    parser, _, _ = parse(['{"a": 1}', ' {"b": 2}'])
+    assert parser.fields == {"a": 1} and parser.done
+
+
+def test_invalid_item_is_reported_and_later_items_are_still_parsed():
+    errors = []
+    items = []
+    parser = StreamingJSONParser(on_item=lambda key, index, value: items.append((index, value["action"])),
+                                 on_item_error=lambda key, index, text: errors.append((key, index, text)))
+    parser.feed('{"robot_actions": [{"action": "first",}, {"action": "second"}]}')
+    assert errors == [("robot_actions", 0, '{"action": "first",}')]
+    assert items == [(1, "second")]